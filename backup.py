@@ -0,0 +1,514 @@
+"""Incremental, streaming backups of accounts.db and the mafiles directory.
+
+A full backup is a consistent snapshot of the DB (SQLite online backup
+API) plus every maFile. Later backups are incremental: account rows
+written since the previous backup (from the change_journal table, filled
+by triggers), new confirmation history rows, and the maFiles whose size or
+mtime changed since the previous backup's manifest, plus deletions.
+
+Each backup is one tar stream compressed on the fly (nothing is staged in
+memory; changed rows go through a temp file) ending in manifest.json with
+the sha256 of every member. Archives are created mode 0600. The backup
+directory holds the archives, catalog.json (the chain of backups) and
+mafiles.state.json (the maFile manifest of the last backup).
+
+The journal is only pruned on request (--prune), and then only up to the
+oldest position recorded by any backup directory of this DB, so another
+chain never loses entries it still needs. An incremental backup whose
+parent predates a prune is made full instead.
+
+restore() verifies every archive of the chain against its manifest and the
+catalog before anything is installed.
+
+CLI:
+    python backup.py create BACKUP_DIR [--full] [--prune] [--db PATH] [--mafiles DIR]
+    python backup.py restore BACKUP_DIR [--id ID] [--db PATH] [--mafiles DIR]
+    python backup.py verify BACKUP_DIR
+    python backup.py list BACKUP_DIR
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import tarfile
+import argparse
+import tempfile
+
+from db import DB_PATH, Database, get_database
+from mafile_store import write_atomic
+
+MAFILES_DIR = os.path.join(os.path.dirname(__file__), 'mafiles')
+CATALOG = 'catalog.json'
+STATE = 'mafiles.state.json'
+CHUNK = 1 << 16
+# settings rows: journal position covered by each backup dir, and the prune point
+CHAIN_MARK = 'backup_chain:'
+PRUNED_UPTO = 'backup_journal_pruned_upto'
+
+class BackupError(Exception):
+    """Raised when a backup chain is missing, inconsistent or fails verification."""
+
+class _HashingReader(io.RawIOBase):
+    """File wrapper that hashes everything read through it."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._f.readinto(b)
+        if n:
+            self.sha.update(memoryview(b)[:n])
+        return n
+
+class _HashingWriter(io.RawIOBase):
+    def __init__(self, f):
+        self._f = f
+        self.sha = hashlib.sha256()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.sha.update(b)
+        return self._f.write(b)
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def load_catalog(backup_dir):
+    return _load_json(os.path.join(backup_dir, CATALOG), {'backups': []})
+
+def _scan_mafiles(mafiles_dir):
+    """{relative path: (size, mtime_ns)} for every maFile-dir file, stat only."""
+    found = {}
+    if not os.path.isdir(mafiles_dir):
+        return found
+    stack = [mafiles_dir]
+    while stack:
+        d = stack.pop()
+        with os.scandir(d) as it:
+            for e in it:
+                # skip in-flight temp files and the like
+                if e.name.startswith('.'):
+                    continue
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                elif e.is_file(follow_symlinks=False):
+                    st = e.stat(follow_symlinks=False)
+                    found[os.path.relpath(e.path, mafiles_dir).replace(os.sep, '/')] = (st.st_size, st.st_mtime_ns)
+    return found
+
+def _add_file(tar, arcname, path, members):
+    """Stream one file into tar, recording its sha256 in members."""
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        info = tarfile.TarInfo(arcname)
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)
+        info.mode = 0o600
+        reader = _HashingReader(f)
+        tar.addfile(info, io.BufferedReader(reader, CHUNK))
+    digest = reader.sha.hexdigest()
+    members[arcname] = {'sha256': digest, 'size': info.size}
+    return digest
+
+def _add_bytes(tar, arcname, data, members):
+    info = tarfile.TarInfo(arcname)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o600
+    tar.addfile(info, io.BytesIO(data))
+    members[arcname] = {'sha256': hashlib.sha256(data).hexdigest(), 'size': len(data)}
+
+def _snapshot_db(db_path, dest):
+    """Consistent copy of db_path at dest through the online backup API."""
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst, pages=1024)
+    finally:
+        dst.close()
+        src.close()
+
+def _write_changes(db_path, since_seq, history_after, out):
+    """Write account rows written and deleted after since_seq, history rows
+    after history_after and the whole (small) settings table to out as JSON
+    lines, read in one transaction and streamed row by row. Returns
+    (rows written, deleted ids, journal seq, history max id)."""
+    def emit(rec):
+        out.write(json.dumps(rec, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    con = sqlite3.connect(db_path)
+    try:
+        con.execute('BEGIN')
+        seq = con.execute('SELECT COALESCE(MAX(seq), 0) FROM change_journal').fetchone()[0]
+        cur = con.execute(
+            "SELECT j.key, a.* FROM (SELECT DISTINCT key FROM change_journal "
+            "WHERE entity='account' AND seq > ? AND seq <= ?) j LEFT JOIN accounts a ON a.id = j.key",
+            (since_seq, seq))
+        cols = [d[0] for d in cur.description][1:]
+        changed, deleted = 0, []
+        for key, *values in cur:
+            if values[0] is None:
+                deleted.append(key)
+            else:
+                emit({'op': 'upsert', 'row': dict(zip(cols, values))})
+                changed += 1
+        for acc_id in deleted:
+            emit({'op': 'delete', 'id': acc_id})
+        history_max = history_after
+        cur = con.execute('SELECT * FROM confirmation_history WHERE id > ? ORDER BY id', (history_after,))
+        cols = [d[0] for d in cur.description]
+        for r in cur:
+            row = dict(zip(cols, r))
+            history_max = row['id']
+            emit({'op': 'history', 'row': row})
+        emit({'op': 'settings', 'values': dict(con.execute('SELECT key, value FROM settings'))})
+        con.execute('COMMIT')
+        return changed, deleted, seq, history_max
+    finally:
+        con.close()
+
+def _db_marks(db_path):
+    con = sqlite3.connect(db_path)
+    try:
+        seq = con.execute('SELECT COALESCE(MAX(seq), 0) FROM change_journal').fetchone()[0]
+        hist = con.execute('SELECT COALESCE(MAX(id), 0) FROM confirmation_history').fetchone()[0]
+        return seq, hist
+    finally:
+        con.close()
+
+def create_backup(backup_dir, db_path=DB_PATH, mafiles_dir=MAFILES_DIR, full=False, compression='gz', prune=False):
+    """Write a full or incremental backup into backup_dir; returns its catalog entry.
+
+    An incremental backup is made when backup_dir already has a chain, full
+    is False and the journal still covers everything since its last backup.
+    The journal position reached is recorded in the DB for this directory;
+    with prune, journal entries covered by every recorded directory are
+    removed from the live DB afterwards.
+    """
+    # make sure the journal exists before the first snapshot
+    db = get_database(db_path)
+    os.makedirs(backup_dir, mode=0o700, exist_ok=True)
+    catalog = load_catalog(backup_dir)
+    parent = catalog['backups'][-1] if catalog['backups'] and not full else None
+    if parent and parent['journal_seq'] < int(db.get_setting(PRUNED_UPTO) or 0):
+        # entries after the parent were pruned for another chain
+        parent = None
+    kind = 'incremental' if parent else 'full'
+    now = time.time()
+    backup_id = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f'-{int(now * 1000) % 1000:03d}'
+    name = f'backup-{backup_id}-{kind}.tar.{compression}'
+    state = _load_json(os.path.join(backup_dir, STATE), {}) if parent else {}
+    current = _scan_mafiles(mafiles_dir)
+    members = {}
+    manifest = {'id': backup_id, 'type': kind, 'parent': parent['id'] if parent else None, 'created_at': int(now)}
+
+    partial = os.path.join(backup_dir, '.' + name + '.partial')
+    with os.fdopen(os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as raw:
+        out = _HashingWriter(raw)
+        with tarfile.open(fileobj=out, mode='w|' + compression) as tar:
+            if kind == 'full':
+                fd, snap = tempfile.mkstemp(prefix='.snapshot-', suffix='.db', dir=backup_dir)
+                os.close(fd)
+                try:
+                    _snapshot_db(db_path, snap)
+                    # marks come from the snapshot itself, so they match its contents
+                    seq, hist = _db_marks(snap)
+                    _add_file(tar, 'accounts.db', snap, members)
+                finally:
+                    os.remove(snap)
+            else:
+                # rows go to a temp file so the tar header gets a known size
+                fd, changes = tempfile.mkstemp(prefix='.changes-', suffix='.jsonl', dir=backup_dir)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        changed, deleted, seq, hist = _write_changes(
+                            db_path, parent['journal_seq'], parent['history_max_id'], f)
+                    _add_file(tar, 'accounts.jsonl', changes, members)
+                finally:
+                    os.remove(changes)
+                manifest['accounts_changed'] = changed
+                manifest['accounts_deleted'] = deleted
+            new_state = {}
+            for rel, (size, mtime_ns) in current.items():
+                old = state.get(rel)
+                if old and old[0] == size and old[1] == mtime_ns:
+                    new_state[rel] = old
+                    continue
+                try:
+                    digest = _add_file(tar, 'mafiles/' + rel, os.path.join(mafiles_dir, rel), members)
+                except FileNotFoundError:
+                    continue
+                new_state[rel] = [size, mtime_ns, digest]
+            manifest['mafiles_deleted'] = sorted(set(state) - set(current))
+            manifest['journal_seq'] = seq
+            manifest['history_max_id'] = hist
+            manifest['members'] = members
+            _add_bytes(tar, 'manifest.json', json.dumps(manifest, indent=1).encode('utf-8'), {})
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial, os.path.join(backup_dir, name))
+
+    entry = {'id': backup_id, 'file': name, 'type': kind, 'parent': manifest['parent'],
+             'journal_seq': seq, 'history_max_id': hist, 'sha256': out.sha.hexdigest(),
+             'members': len(members), 'created_at': manifest['created_at']}
+    write_atomic(os.path.join(backup_dir, STATE), new_state)
+    catalog['backups'].append(entry)
+    write_atomic(os.path.join(backup_dir, CATALOG), catalog)
+    db.set_setting(CHAIN_MARK + os.path.abspath(backup_dir), str(seq))
+    if prune:
+        prune_journal(db)
+    return entry
+
+def prune_journal(db):
+    """Drop journal entries every recorded backup directory has covered;
+    returns the position pruned up to. Directories whose catalog is gone
+    are forgotten, so a deleted chain does not hold pruning back."""
+    marks = []
+    for key, value in db.get_settings(CHAIN_MARK).items():
+        if os.path.exists(os.path.join(key[len(CHAIN_MARK):], CATALOG)):
+            marks.append(int(value))
+        else:
+            db.delete_setting(key)
+    if not marks:
+        return 0
+    upto = min(marks)
+    db.prune_change_journal(upto)
+    if upto > int(db.get_setting(PRUNED_UPTO) or 0):
+        db.set_setting(PRUNED_UPTO, str(upto))
+    return upto
+
+def forget_chain(backup_dir, db_path=DB_PATH):
+    """Stop pruning from waiting for backup_dir; its next backup will be full
+    if the journal is pruned past it. Returns whether it was recorded."""
+    return get_database(db_path).delete_setting(CHAIN_MARK + os.path.abspath(backup_dir))
+
+def _chain(catalog, upto=None):
+    backups = catalog['backups']
+    if not backups:
+        raise BackupError('no backups in catalog')
+    by_id = {b['id']: b for b in backups}
+    cur = by_id.get(upto) if upto else backups[-1]
+    if cur is None:
+        raise BackupError(f'unknown backup {upto}')
+    chain = [cur]
+    while cur['parent'] is not None:
+        cur = by_id.get(cur['parent'])
+        if cur is None:
+            raise BackupError(f"backup {chain[-1]['id']} has a missing parent")
+        chain.append(cur)
+    chain.reverse()
+    return chain
+
+def _safe_name(name):
+    parts = name.split('/')
+    return not (name.startswith('/') or '..' in parts or '' in parts)
+
+def _extract_stream(archive, staging):
+    got = {}
+    manifest = None
+    with open(archive, 'rb') as raw:
+        reader = _HashingReader(raw)
+        with tarfile.open(fileobj=io.BufferedReader(reader, CHUNK), mode='r|*') as tar:
+            for m in tar:
+                if not m.isfile() or not _safe_name(m.name):
+                    raise BackupError(f'{archive}: unexpected member {m.name!r}')
+                src = tar.extractfile(m)
+                if m.name == 'manifest.json':
+                    manifest = json.loads(src.read())
+                    continue
+                dest = os.path.join(staging, *m.name.split('/'))
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                sha = hashlib.sha256()
+                with open(dest, 'wb') as f:
+                    for chunk in iter(lambda: src.read(CHUNK), b''):
+                        sha.update(chunk)
+                        f.write(chunk)
+                got[m.name] = sha.hexdigest()
+        # drain trailing padding so the whole file is hashed
+        while reader.read(CHUNK):
+            pass
+    return got, manifest, reader.sha.hexdigest()
+
+def _extract(archive, entry, staging):
+    """Stream archive into staging, verifying member and archive checksums.
+    Returns the manifest."""
+    try:
+        got, manifest, digest = _extract_stream(archive, staging)
+    except (tarfile.TarError, EOFError) as e:
+        raise BackupError(f'{archive}: corrupt archive ({e})')
+    if manifest is None:
+        raise BackupError(f'{archive}: no manifest')
+    if entry.get('sha256') and digest != entry['sha256']:
+        raise BackupError(f'{archive}: archive checksum mismatch')
+    expected = {k: v['sha256'] for k, v in manifest['members'].items()}
+    if got != expected:
+        bad = sorted(k for k in set(got) | set(expected) if got.get(k) != expected.get(k))
+        raise BackupError(f'{archive}: checksum mismatch for {", ".join(bad[:5])}')
+    return manifest
+
+def _apply_changes(con, path):
+    cols = [r[1] for r in con.execute('PRAGMA table_info(accounts)')]
+    hcols = [r[1] for r in con.execute('PRAGMA table_info(confirmation_history)')]
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if rec['op'] == 'upsert':
+                row = {k: v for k, v in rec['row'].items() if k in cols}
+                names = list(row)
+                # an UPSERT (not REPLACE) so the update triggers keep the search index in sync
+                con.execute(
+                    f'INSERT INTO accounts ({",".join(names)}) VALUES ({",".join("?" * len(names))}) '
+                    f'ON CONFLICT(id) DO UPDATE SET {",".join(f"{n}=excluded.{n}" for n in names if n != "id")}',
+                    [row[n] for n in names])
+            elif rec['op'] == 'delete':
+                con.execute('DELETE FROM accounts WHERE id=?', (rec['id'],))
+                con.execute('DELETE FROM confirmation_history WHERE account_id=?', (rec['id'],))
+            elif rec['op'] == 'settings':
+                # a full copy, e.g. the key parameters of encrypted secrets
+                con.execute('DELETE FROM settings')
+                con.executemany('INSERT INTO settings (key, value) VALUES (?,?)', rec['values'].items())
+            elif rec['op'] == 'history':
+                row = {k: v for k, v in rec['row'].items() if k in hcols}
+                names = list(row)
+                con.execute(f'INSERT OR IGNORE INTO confirmation_history ({",".join(names)}) VALUES ({",".join("?" * len(names))})',
+                            [row[n] for n in names])
+
+def verify(backup_dir, upto=None):
+    """Check every archive of the chain; returns the chain. Raises BackupError."""
+    chain = _chain(load_catalog(backup_dir), upto)
+    staging = tempfile.mkdtemp(prefix='.verify-', dir=backup_dir)
+    try:
+        for entry in chain:
+            sub = os.path.join(staging, entry['id'])
+            os.makedirs(sub)
+            _extract(os.path.join(backup_dir, entry['file']), entry, sub)
+            shutil.rmtree(sub)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return chain
+
+def restore(backup_dir, db_path=DB_PATH, mafiles_dir=MAFILES_DIR, upto=None):
+    """Restore the chain ending at upto (default: the latest backup).
+
+    Every archive is extracted to a staging directory and verified first;
+    only then are accounts.db and the maFiles replaced. Run it with the app
+    and daemon stopped. maFiles that are not in the backup are left alone.
+    Returns the number of maFiles written.
+    """
+    chain = _chain(load_catalog(backup_dir), upto)
+    target_dir = os.path.dirname(os.path.abspath(db_path))
+    staging = tempfile.mkdtemp(prefix='.restore-', dir=target_dir)
+    try:
+        files = {}
+        deleted = set()
+        changes = []
+        for entry in chain:
+            sub = os.path.join(staging, entry['id'])
+            os.makedirs(sub)
+            manifest = _extract(os.path.join(backup_dir, entry['file']), entry, sub)
+            if entry['type'] == 'full':
+                if entry is not chain[0]:
+                    raise BackupError('full backup in the middle of a chain')
+                files.clear()
+                deleted.clear()
+            else:
+                changes.append(os.path.join(sub, 'accounts.jsonl'))
+            for rel in manifest['mafiles_deleted']:
+                files.pop(rel, None)
+                deleted.add(rel)
+            for name in manifest['members']:
+                if name.startswith('mafiles/'):
+                    rel = name[len('mafiles/'):]
+                    files[rel] = os.path.join(sub, 'mafiles', *rel.split('/'))
+                    deleted.discard(rel)
+
+        # rebuild the DB in staging, then swap it in
+        db_file = os.path.join(staging, chain[0]['id'], 'accounts.db')
+        # bring an older snapshot up to the current schema first
+        Database(db_file).close()
+        con = sqlite3.connect(db_file)
+        try:
+            with con:
+                for path in changes:
+                    _apply_changes(con, path)
+                # the restored state is the new baseline
+                con.execute('DELETE FROM change_journal')
+        finally:
+            con.close()
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        os.replace(db_file, db_path)
+
+        os.makedirs(mafiles_dir, exist_ok=True)
+        for rel, src in files.items():
+            dest = os.path.join(mafiles_dir, *rel.split('/'))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(src, dest)
+        for rel in deleted:
+            path = os.path.join(mafiles_dir, *rel.split('/'))
+            if os.path.exists(path):
+                os.remove(path)
+        return len(files)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Backup and restore accounts.db and maFiles.')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    for cmd in ('create', 'restore', 'verify', 'list', 'forget'):
+        p = sub.add_parser(cmd)
+        p.add_argument('backup_dir')
+        if cmd in ('create', 'restore', 'forget'):
+            p.add_argument('--db', default=DB_PATH)
+        if cmd in ('create', 'restore'):
+            p.add_argument('--mafiles', default=MAFILES_DIR)
+        if cmd in ('restore', 'verify'):
+            p.add_argument('--id', help='backup to restore up to (default: latest)')
+    sub.choices['create'].add_argument('--full', action='store_true')
+    sub.choices['create'].add_argument('--prune', action='store_true',
+                                       help='drop journal entries every backup directory of this DB has covered')
+    sub.choices['create'].add_argument('--compression', default='gz', choices=('gz', 'bz2', 'xz'))
+    args = ap.parse_args(argv)
+
+    try:
+        if args.cmd == 'create':
+            t = time.perf_counter()
+            e = create_backup(args.backup_dir, args.db, args.mafiles, full=args.full,
+                              compression=args.compression, prune=args.prune)
+            print(f"{e['type']} backup {e['file']}: {e['members']} members in {time.perf_counter() - t:.2f} s")
+        elif args.cmd == 'restore':
+            n = restore(args.backup_dir, args.db, args.mafiles, args.id)
+            print(f'restored accounts.db and {n} maFiles')
+        elif args.cmd == 'forget':
+            found = forget_chain(args.backup_dir, args.db)
+            print('forgotten' if found else 'not a backup directory of this DB')
+        elif args.cmd == 'verify':
+            chain = verify(args.backup_dir, args.id)
+            print(f'ok: {len(chain)} archives verified')
+        else:
+            for e in load_catalog(args.backup_dir)['backups']:
+                print(f"{e['id']}  {e['type']:<11}  {e['members']:>7} members  {e['file']}")
+    except BackupError as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,435 @@
+"""Offline benchmarks for the DB, maFile I/O, signing and Steam API paths.
+
+Everything runs against temporary files and a local stub of the Steam
+mobileconf endpoints, so results are reproducible without network access.
+Each operation reports latency percentiles (microseconds) and ops/s, and
+each scenario the growth of the process's peak RSS (and, with
+--trace-memory, the peak Python heap from tracemalloc).
+
+    python bench.py [--sizes 1000,10000,100000] [--only db,mafile,sign,network]
+                    [--sample 2000] [--repeat 3] [--save FILE] [--compare FILE]
+                    [--tolerance 0.2] [--min-delta 1]
+
+--sample caps the per-operation sample for the slower paths (single-row
+writes, maFile files, HTTP calls); the table itself always has the full
+size. --repeat runs everything several times and keeps each operation's
+median p50. --compare exits with 1 when an operation's p50 got slower than
+the baseline by more than --tolerance plus that op's noise in the baseline
+(the spread of its p50 across --repeat runs, else half its p50-p90 gap),
+and at least --min-delta microseconds.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from db import Database
+from mafile_store import MaFileStore
+from network import NetworkLayer
+from steam_time import LocalTime
+import steam_wrapper
+from steam_wrapper import SteamWrapper
+
+SCENARIOS = ('db', 'mafile', 'sign', 'network')
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * q))]
+
+def summarize(samples_ns, wall_ns=None):
+    vals = sorted(samples_ns)
+    # concurrent ops overlap, so their throughput comes from wall time
+    total = wall_ns or sum(vals)
+    return {
+        'n': len(vals),
+        'p50': _percentile(vals, 0.50) / 1000,
+        'p90': _percentile(vals, 0.90) / 1000,
+        'p99': _percentile(vals, 0.99) / 1000,
+        'max': vals[-1] / 1000,
+        'ops_per_s': len(vals) / (total / 1e9) if total else 0.0,
+    }
+
+class Recorder:
+    """Per-operation latency samples in nanoseconds."""
+
+    def __init__(self):
+        self.samples = {}
+        self.wall = {}
+
+    def add(self, op, ns):
+        self.samples.setdefault(op, []).append(ns)
+
+    def run(self, op, fn, args):
+        """Call fn(arg) for each arg, timing every call."""
+        clock = time.perf_counter_ns
+        out = self.samples.setdefault(op, [])
+        for a in args:
+            t = clock()
+            fn(a)
+            out.append(clock() - t)
+
+    def report(self):
+        return {op: summarize(v, self.wall.get(op)) for op, v in self.samples.items() if v}
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+def _secret(rng, n=20):
+    return base64.b64encode(rng.randbytes(n)).decode()
+
+def _accounts(rng, n):
+    return [{
+        'account_name': f'bench{i}',
+        'password': 'pw',
+        'shared_secret': _secret(rng),
+        'identity_secret': _secret(rng),
+    } for i in range(n)]
+
+# --- scenarios -------------------------------------------------------------
+
+def bench_db(rec, n, workdir, sample, rng):
+    db = Database(os.path.join(workdir, 'bench.db'))
+    try:
+        accounts = _accounts(rng, n)
+        t = time.perf_counter_ns()
+        ids = db.add_accounts_bulk(accounts)
+        rec.add('add_accounts_bulk', time.perf_counter_ns() - t)
+
+        picks = [rng.choice(ids) for _ in range(sample)]
+        rec.run('get_account_by_id', db.get_account_by_id, picks)
+        rec.run('update_account', lambda i: db.update_account(i, f'bench{i}', 'pw2', 'c2VjcmV0'), picks)
+        rec.run('add_account', lambda i: db.add_account(f'extra{i}', 'pw', 'c2VjcmV0'), range(sample))
+
+        # keyset walk over the whole table, the way the account list scrolls
+        clock = time.perf_counter_ns
+        start = 0
+        while True:
+            t = clock()
+            rows = db.list_accounts(start, 50)
+            rec.add('list_accounts_page', clock() - t)
+            if len(rows) < 50:
+                break
+            start = rows[-1]['id'] + 1
+        rec.run('list_accounts_before', lambda i: db.list_accounts_before(i, 50), picks)
+        # one search per keystroke while typing a name, then a typo
+        names = [accounts[i - ids[0]]['account_name'] for i in picks[:200]]
+        rec.run('search_accounts', lambda q: db.search_accounts(q), [n[:k] for n in names for k in range(1, len(n) + 1)])
+        rec.run('fuzzy_search_accounts', lambda q: db.fuzzy_search_accounts(q), [n[:2] + n[3] + n[2] + n[4:] for n in names])
+        rec.run('count_accounts', lambda _: db.count_accounts(refresh=True), range(20))
+        rec.run('get_shared_secrets', lambda _: db.get_shared_secrets(), range(3))
+        rec.run('delete_account', db.delete_account, sorted(set(picks)))
+    finally:
+        db.close()
+
+def bench_mafile(rec, n, workdir, sample, rng):
+    mafiles = os.path.join(workdir, 'mafiles')
+    os.makedirs(mafiles, exist_ok=True)
+    saved_dir = steam_wrapper.MAFILES_DIR
+    steam_wrapper.MAFILES_DIR = mafiles
+    try:
+        store = MaFileStore()
+        steam = SteamWrapper(store=store, time_source=LocalTime())
+        m = min(n, sample)
+        accounts = [dict(a, id=i) for i, a in enumerate(_accounts(rng, m), start=1)]
+        paths = []
+        rec.run('create_mafile', lambda a: paths.append(steam.create_mafile(a)), accounts)
+        # served from the store's cache
+        rec.run('import_mafile', steam.import_mafile, paths)
+        clock = time.perf_counter_ns
+        for p in paths:
+            store.invalidate(p)
+            t = clock()
+            steam.import_mafile(p)
+            rec.add('import_mafile_cold', clock() - t)
+    finally:
+        steam_wrapper.MAFILES_DIR = saved_dir
+
+def bench_sign(rec, n, workdir, sample, rng):
+    steam = SteamWrapper(time_source=LocalTime())
+    secrets = [_secret(rng) for _ in range(n)]
+    t0 = 1700000000
+    # first use of each secret builds its signer; the second pass hits the cache
+    rec.run('confirmation_key_first', lambda s: steam._generate_confirmation_key(s, 'conf', t0), secrets)
+    hot = secrets[:4096]
+    rec.run('confirmation_key_cached', lambda s: steam._generate_confirmation_key(s, 'allow', t0 + 1), hot * max(1, n // len(hot)))
+
+_stub_rsa = None
+_stub_rsa_lock = threading.Lock()
+
+def _stub_rsa_key():
+    """One RSA key for every stub server, generated on first login."""
+    global _stub_rsa
+    with _stub_rsa_lock:
+        if _stub_rsa is None:
+            from Crypto.PublicKey import RSA
+            _stub_rsa = RSA.generate(1024)
+        return _stub_rsa
+
+class _StubSteam(BaseHTTPRequestHandler):
+    """mobileconf and login endpoints. dologin accepts any account whose
+    password is 'pw-' + username, encrypted with the key from getrsakey;
+    server.calls counts requests per path, server.delay (seconds) slows
+    mobileconf/conf down and server.max_inflight records its peak concurrency."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    RSA_TIMESTAMP = '266210000000'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _count(self):
+        calls = getattr(self.server, 'calls', None)
+        if calls is not None:
+            with self.server.calls_lock:
+                path = self.path.split('?')[0]
+                calls[path] = calls.get(path, 0) + 1
+
+    def _json(self, obj, cookies=None):
+        body = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (cookies or {}).items():
+            self.send_header('Set-Cookie', f'{name}={value}; Path=/')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _login(self, form):
+        from urllib.parse import parse_qs
+        q = {k: v[0] for k, v in parse_qs(form.decode()).items()}
+        key = _stub_rsa_key()
+        if self.path.startswith('/login/getrsakey'):
+            return self._json({'success': True, 'publickey_mod': format(key.n, 'x'),
+                               'publickey_exp': format(key.e, 'x'), 'timestamp': self.RSA_TIMESTAMP})
+        from Crypto.Cipher import PKCS1_v1_5
+        import base64 as b64
+        user = q.get('username', '')
+        password = PKCS1_v1_5.new(key).decrypt(b64.b64decode(q.get('password', '')), None)
+        if q.get('rsatimestamp') != self.RSA_TIMESTAMP or password != f'pw-{user}'.encode():
+            return self._json({'success': False, 'message': 'The account name or password that you have entered is incorrect.'})
+        steamid = str(76561197960265728 + sum(user.encode()))
+        return self._json({'success': True, 'login_complete': True, 'transfer_parameters': {'steamid': steamid}},
+                          cookies={'steamLoginSecure': f'{steamid}%7C%7Ctoken-{user}', 'sessionid': f'sid-{user}'})
+
+    def do_GET(self):
+        self._count()
+        if self.path.startswith('/mobileconf/conf'):
+            from urllib.parse import urlsplit, parse_qs
+            steamid = parse_qs(urlsplit(self.path).query).get('a', [''])[0]
+            delay = getattr(self.server, 'delay', 0)
+            if delay:
+                with self.server.calls_lock:
+                    self.server.inflight += 1
+                    self.server.max_inflight = max(self.server.max_inflight, self.server.inflight)
+                time.sleep(delay)
+                with self.server.calls_lock:
+                    self.server.inflight -= 1
+            return self._json({'success': True, 'conf': [
+                {'id': str(i), 'nonce': str(1000 + i), 'type': 2, 'headline': f'Trade {i}', 'creator_id': steamid}
+                for i in range(3)
+            ]})
+        self.send_error(404)
+
+    def do_POST(self):
+        form = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._count()
+        if self.path.startswith('/mobileconf/'):
+            return self._json({'success': True})
+        if self.path.startswith('/login/'):
+            return self._login(form)
+        self.send_error(404)
+
+def stub_steam_server():
+    """Start a local mobileconf and login stub; returns (server, base_url)."""
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), _StubSteam)
+    srv.daemon_threads = True
+    srv.calls = {}
+    srv.calls_lock = threading.Lock()
+    srv.delay = 0
+    srv.inflight = srv.max_inflight = 0
+    threading.Thread(target=srv.serve_forever, name='stub-steam', daemon=True).start()
+    return srv, f'http://127.0.0.1:{srv.server_address[1]}'
+
+def bench_network(rec, n, workdir, sample, rng):
+    from sessions import pooled_session
+    srv, base_url = stub_steam_server()
+    db = Database(os.path.join(workdir, 'history.db'))
+    session = pooled_session(32, store_cookies=False)
+    try:
+        store = MaFileStore(max_entries=max(1024, sample))
+        # no throttling: this measures our overhead, not Steam's limits
+        network = NetworkLayer(global_rate=1e9, global_burst=1e9, account_rate=1e9, account_burst=1e9)
+        steam = SteamWrapper(store=store, history=db, session=session, base_url=base_url,
+                             network=network, time_source=LocalTime())
+        accounts = []
+        for i in range(1, min(n, sample) + 1):
+            path = os.path.join(workdir, f'net{i}.maFile')
+            store.save(path, {
+                'account_name': f'bench{i}', 'identity_secret': _secret(rng), 'serial_number': str(i),
+                'steamid': str(76561197960265728 + i),
+                'session_cookies': {'steamLoginSecure': f'token{i}', 'sessionid': f'sid{i}'},
+            }, defer=False)
+            accounts.append({'id': i, 'account_name': f'bench{i}', 'mafile_path': path})
+
+        confs = {}
+        rec.run('fetch_confirmations', lambda a: confs.__setitem__(a['id'], steam.fetch_confirmations(a)), accounts)
+        rec.run('respond_confirmation', lambda a: steam.respond_confirmation(a, 0), accounts)
+        rec.run('respond_confirmations', lambda a: steam.respond_confirmations(a, [0, 1, 2], confirmations=confs[a['id']]), accounts)
+
+        # the same fetches from a pool, as the fleet poller runs them
+        clock = time.perf_counter_ns
+        lock = threading.Lock()
+
+        def timed_fetch(a):
+            t = clock()
+            steam.fetch_confirmations(a)
+            d = clock() - t
+            with lock:
+                rec.add('fetch_confirmations_x32', d)
+        t = clock()
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            list(pool.map(timed_fetch, accounts))
+        rec.wall['fetch_confirmations_x32'] = clock() - t
+    finally:
+        session.close()
+        db.close()
+        srv.shutdown()
+        srv.server_close()
+
+_BENCHES = {'db': bench_db, 'mafile': bench_mafile, 'sign': bench_sign, 'network': bench_network}
+
+def run(sizes, only=SCENARIOS, sample=2000, trace_memory=False, seed=1234, log=print):
+    """Run the scenarios at each size; returns {'meta': ..., 'results': {'scenario/size': {...}}}."""
+    results = {}
+    for n in sizes:
+        for name in only:
+            rng = random.Random(seed)
+            rec = Recorder()
+            workdir = tempfile.mkdtemp(prefix='bench-')
+            rss0 = _peak_rss_mb()
+            if trace_memory:
+                tracemalloc.start()
+            t = time.perf_counter()
+            try:
+                _BENCHES[name](rec, n, workdir, sample, rng)
+            finally:
+                heap = tracemalloc.get_traced_memory()[1] / (1 << 20) if trace_memory else None
+                if trace_memory:
+                    tracemalloc.stop()
+                shutil.rmtree(workdir, ignore_errors=True)
+            key = f'{name}/{n}'
+            results[key] = {
+                'ops': rec.report(),
+                'seconds': time.perf_counter() - t,
+                'rss_peak_mb': _peak_rss_mb(),
+                'rss_growth_mb': _peak_rss_mb() - rss0,
+                'heap_peak_mb': heap,
+            }
+            if log:
+                log_result(key, results[key], log)
+    meta = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': list(sizes),
+        'sample': sample,
+        'time': int(time.time()),
+    }
+    return {'meta': meta, 'results': results}
+
+def log_result(key, res, log=print):
+    mem = f"rss +{res['rss_growth_mb']:.1f} MB (peak {res['rss_peak_mb']:.1f})"
+    if res.get('heap_peak_mb') is not None:
+        mem += f", heap peak {res['heap_peak_mb']:.1f} MB"
+    log(f"== {key}  {res['seconds']:.2f} s  {mem}")
+    for op, s in res['ops'].items():
+        log(f"  {op:<26} n={s['n']:<7} p50 {s['p50']:>10.1f}  p90 {s['p90']:>10.1f}  "
+            f"p99 {s['p99']:>10.1f}  max {s['max']:>10.1f} us  {s['ops_per_s']:>12.0f}/s")
+
+def median_report(reports):
+    """The first of several run() reports, with every op's p50 replaced by
+    the median p50 across all of them (kept in p50_runs)."""
+    merged = json.loads(json.dumps(reports[0]))
+    for key, res in merged['results'].items():
+        for op, s in res['ops'].items():
+            runs = sorted(r['results'][key]['ops'][op]['p50'] for r in reports
+                          if op in r['results'].get(key, {}).get('ops', {}))
+            s['p50_runs'] = runs
+            s['p50'] = runs[len(runs) // 2] if len(runs) % 2 else (runs[len(runs) // 2 - 1] + runs[len(runs) // 2]) / 2
+    merged['meta']['repeat'] = len(reports)
+    return merged
+
+def _noise(s):
+    """Expected run-to-run wobble of an op's p50 in microseconds: the spread
+    of p50 across --repeat runs when recorded, else half its p50-p90 gap."""
+    runs = s.get('p50_runs') or []
+    if len(runs) > 1:
+        return runs[-1] - runs[0]
+    return max(0.0, s['p90'] - s['p50']) / 2
+
+def compare(current, baseline, tolerance=0.2, min_delta=1.0):
+    """(key, op, baseline p50, current p50) for every op slower than allowed:
+    by more than tolerance (a fraction) plus the baseline's own noise for
+    that op, never less than min_delta microseconds."""
+    slow = []
+    for key, res in current['results'].items():
+        base = baseline.get('results', {}).get(key)
+        if base is None:
+            continue
+        for op, s in res['ops'].items():
+            b = base['ops'].get(op)
+            if b and s['p50'] > b['p50'] * (1 + tolerance) + max(min_delta, _noise(b)):
+                slow.append((key, op, b['p50'], s['p50']))
+    return slow
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Offline benchmarks at fleet scale.')
+    ap.add_argument('--sizes', default='1000,10000,100000', help='comma-separated account counts')
+    ap.add_argument('--only', default=','.join(SCENARIOS), help='comma-separated scenarios: ' + ', '.join(SCENARIOS))
+    ap.add_argument('--sample', type=int, default=2000, help='max operations per slow path')
+    ap.add_argument('--trace-memory', action='store_true', help='also record the peak Python heap (slows every timing down)')
+    ap.add_argument('--save', help='write results to this JSON file')
+    ap.add_argument('--compare', help='baseline JSON to compare against')
+    ap.add_argument('--repeat', type=int, default=1, help='run everything this many times and keep the median p50')
+    ap.add_argument('--tolerance', type=float, default=0.2, help='allowed p50 slowdown, as a fraction')
+    ap.add_argument('--min-delta', type=float, default=1.0,
+                    help='least slack in microseconds on top of --tolerance (the baseline noise of an op may raise it)')
+    args = ap.parse_args(argv)
+
+    only = [s for s in args.only.split(',') if s]
+    unknown = [s for s in only if s not in _BENCHES]
+    if unknown:
+        ap.error('unknown scenario: ' + ', '.join(unknown))
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    reports = [run(sizes, only, args.sample, args.trace_memory) for _ in range(max(1, args.repeat))]
+    report = median_report(reports) if len(reports) > 1 else reports[0]
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        slow = compare(report, baseline, args.tolerance, args.min_delta)
+        for key, op, b, c in slow:
+            print(f'regression: {key} {op} p50 {b:.1f} us -> {c:.1f} us')
+        status = 1 if slow else 0
+    return status
+
+if __name__ == '__main__':
+    raise SystemExit(main())
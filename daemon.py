@@ -0,0 +1,371 @@
+"""Headless daemon: Steam Guard codes and confirmations over a local JSON API.
+
+Keeps one Database, SteamWrapper, session pool, code cache and watcher warm
+for the life of the process, so bot processes on the host pay no startup
+cost per call.
+
+    python daemon.py [--host 127.0.0.1] [--port 8645] [--unix PATH] [--db PATH] [--watch] [--lock-after SECONDS]
+                     [--token-file PATH]
+
+Over TCP every request except /health needs "Authorization: Bearer TOKEN".
+The token comes from STEAM_AUTH_TOKEN, else from --token-file (default
+daemon.token next to the DB; created with a random token, mode 0600). A
+--unix socket is created mode 0600 and needs no token. POSTs must be sent
+as application/json, so browser pages cannot forge them.
+
+With encrypted secrets (secure_store) the daemon starts locked unless
+STEAM_AUTH_PASSPHRASE is set; codes, signing and logins need POST /unlock.
+
+Endpoints:
+    GET  /health
+    GET  /accounts?start=ID&limit=N     keyset page of accounts with id >= start
+    GET  /accounts/search?q=TEXT&limit=N  prefix/substring matches, then fuzzy ones
+    GET  /codes                         {"codes": {id: code}, "seconds_left": n}
+    GET  /accounts/ID/code
+    GET  /accounts/ID/confirmations     add ?refresh=1 to bypass the watcher snapshot
+    POST /accounts/ID/confirmations     {"confirmations": [{"id": ..., "nonce": ...}], "accept": true}
+                                        matched against a fresh fetch; 409 if any is gone
+    GET  /metrics                       Prometheus text (with --metrics)
+    GET  /metrics.json
+    POST /reload                        re-read accounts and secrets from the DB
+    POST /unlock                        {"passphrase": "..."}
+    POST /lock
+"""
+import os
+import re
+import hmac
+import json
+import secrets
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+
+from db import DB_PATH, get_database
+from steam_wrapper import SteamWrapper, SteamGuardCodes
+from sessions import SessionManager
+from poller import FleetPoller
+from watcher import ConfirmationWatcher
+from steam_time import LocalTime, get_time_source, set_time_source
+from secure_store import BadPassphrase, Locked
+import metrics
+
+class Daemon:
+    """Long-lived state shared by all API requests."""
+
+    def __init__(self, db_path=DB_PATH, watch=False, lock_after=None):
+        self.db = get_database(db_path)
+        if lock_after is not None:
+            self.db.keyring.idle_timeout = lock_after
+        self.sessions = SessionManager()
+        self.steam = SteamWrapper(history=self.db, sessions=self.sessions)
+        self.codes = SteamGuardCodes(loader=self.db.get_shared_secrets, keyring=self.db.keyring)
+        self.poller = FleetPoller(keyring=self.db.keyring)
+        self.watcher = ConfirmationWatcher(self.poller)
+        self.watch = watch
+        self._accounts = {}
+        self._respond_locks = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        passphrase = os.environ.get('STEAM_AUTH_PASSPHRASE')
+        if passphrase and self.db.keyring.enabled:
+            self.db.keyring.unlock(passphrase)
+        # decode (and, when unlocked, open) every secret before the first request
+        self.codes.codes()
+        get_time_source().start()
+        self.watcher.start()
+        if self.watch:
+            after = 0
+            while True:
+                rows = self.db.list_accounts(after, 500)
+                if not rows:
+                    break
+                self.watcher.watch_all(self.account(r['id']) for r in rows)
+                after = rows[-1]['id'] + 1
+
+    def stop(self):
+        self.watcher.stop()
+        self.poller.shutdown()
+        self.sessions.close()
+        get_time_source().stop()
+
+    def account(self, acc_id):
+        """Account dict, cached so per-account sessions and watches stay keyed to one object."""
+        with self._lock:
+            acc = self._accounts.get(acc_id)
+        if acc is None:
+            acc = self.db.get_account_by_id(acc_id)
+            if acc is not None:
+                with self._lock:
+                    acc = self._accounts.setdefault(acc_id, acc)
+        return acc
+
+    def reload(self):
+        """Drop cached accounts and secrets after the DB was changed elsewhere."""
+        with self._lock:
+            self._accounts.clear()
+        self.db.reload_keyring()
+        codes = SteamGuardCodes(loader=self.db.get_shared_secrets, keyring=self.db.keyring)
+        codes.codes()
+        self.codes = codes
+        self.db.count_accounts(refresh=True)
+
+    def confirmations(self, acc, refresh=False):
+        if not refresh:
+            snap = self.watcher.snapshot(acc)
+            if snap is not None:
+                return snap
+        confs, _ = self.poller.fetch_one(acc)
+        return confs
+
+    def respond(self, acc, wanted, accept):
+        """Accept or decline wanted (id, nonce) pairs; returns (success, missing ids).
+
+        Fetch, match and respond run under the account's lock, so concurrent
+        requests never act on positions another one has just shifted.
+        """
+        with self._lock:
+            lock = self._respond_locks.setdefault(acc['id'], threading.Lock())
+        with lock:
+            # resolve against what Steam has now, never a possibly stale snapshot
+            current = self.confirmations(acc, refresh=True)
+            indices, missing = _match_confirmations(current, wanted)
+            if missing:
+                return False, missing
+            ok = self.steam.respond_confirmations(acc, indices, accept, confirmations=current)
+        self.watcher.note_activity(acc)
+        return bool(ok), []
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; without this each
+    # keep-alive response stalls on delayed ACK
+    disable_nagle_algorithm = True
+    daemon = None
+    # bearer token required on every request but /health; None on the Unix socket
+    token = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, obj, content_type='application/json'):
+        if isinstance(obj, str):
+            body = obj.encode('utf-8')
+        else:
+            body = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self, path):
+        if self.token is None or path == '/health':
+            return True
+        auth = self.headers.get('Authorization') or ''
+        if auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].strip().encode(), self.token.encode()):
+            return True
+        self._send(401, {'error': 'missing or wrong bearer token'})
+        return False
+
+    def _account_or_404(self, acc_id):
+        acc = self.daemon.account(int(acc_id))
+        if acc is None:
+            self._send(404, {'error': 'account not found'})
+        return acc
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = parse_qs(url.query)
+        d = self.daemon
+        if not self._authorized(url.path):
+            return
+        if url.path == '/health':
+            ring = d.db.keyring
+            return self._send(200, {'ok': True, 'locked': ring.enabled and not ring.unlocked})
+        if url.path == '/metrics':
+            return self._send(200, metrics.prometheus_text(), 'text/plain; version=0.0.4')
+        if url.path == '/metrics.json':
+            return self._send(200, metrics.snapshot())
+        if url.path == '/accounts':
+            try:
+                start = int(q.get('start', ['0'])[0])
+                limit = min(int(q.get('limit', ['100'])[0]), 1000)
+            except ValueError:
+                return self._send(400, {'error': 'start and limit must be integers'})
+            return self._send(200, {'accounts': d.db.list_accounts(start, limit), 'total': d.db.count_accounts()})
+        if url.path == '/accounts/search':
+            text = q.get('q', [''])[0]
+            try:
+                limit = min(int(q.get('limit', ['50'])[0]), 1000)
+            except ValueError:
+                return self._send(400, {'error': 'limit must be an integer'})
+            rows = d.db.search_accounts(text, limit)
+            if len(rows) < limit:
+                rows += d.db.fuzzy_search_accounts(text, limit - len(rows), [r['id'] for r in rows])
+            return self._send(200, {'accounts': rows})
+        if url.path == '/codes':
+            codes = d.codes.codes()
+            return self._send(200, {'codes': {str(k): v for k, v in codes.items()}, 'seconds_left': d.codes.seconds_left()})
+        m = re.fullmatch(r'/accounts/(\d+)/code', url.path)
+        if m:
+            if self._account_or_404(m.group(1)) is None:
+                return
+            return self._send(200, {'code': d.codes.code(int(m.group(1))), 'seconds_left': d.codes.seconds_left()})
+        m = re.fullmatch(r'/accounts/(\d+)/confirmations', url.path)
+        if m:
+            acc = self._account_or_404(m.group(1))
+            if acc is None:
+                return
+            refresh = q.get('refresh', ['0'])[0] not in ('0', '', 'false')
+            return self._send(200, {'confirmations': d.confirmations(acc, refresh)})
+        self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        d = self.daemon
+        # always drain the body so the kept-alive connection stays in sync
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if not self._authorized(url.path):
+            return
+        # a cross-origin form or fetch without preflight cannot send this type
+        if (self.headers.get('Content-Type') or '').split(';')[0].strip().lower() != 'application/json':
+            return self._send(415, {'error': 'expected Content-Type: application/json'})
+        if url.path == '/reload':
+            d.reload()
+            return self._send(200, {'ok': True})
+        if url.path == '/lock':
+            d.db.keyring.lock()
+            return self._send(200, {'ok': True})
+        if url.path == '/unlock':
+            try:
+                passphrase = str(json.loads(raw or b'{}')['passphrase'])
+            except (ValueError, TypeError, KeyError):
+                return self._send(400, {'error': 'expected {"passphrase": "..."}'})
+            try:
+                d.db.keyring.unlock(passphrase)
+            except BadPassphrase as e:
+                return self._send(403, {'error': str(e)})
+            except Locked as e:
+                # encryption is not enabled
+                return self._send(409, {'error': str(e)})
+            # open the fleet's code secrets now rather than on the first /codes
+            d.codes.codes()
+            return self._send(200, {'ok': True})
+        m = re.fullmatch(r'/accounts/(\d+)/confirmations', url.path)
+        if not m:
+            return self._send(404, {'error': 'not found'})
+        try:
+            body = json.loads(raw or b'{}')
+            wanted = [(str(c['id']), c.get('nonce')) for c in body['confirmations']]
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return self._send(400, {'error': 'expected {"confirmations": [{"id": ..., "nonce": ...}], "accept": bool}'})
+        acc = self._account_or_404(m.group(1))
+        if acc is None:
+            return
+        ok, missing = d.respond(acc, wanted, bool(body.get('accept', True)))
+        if missing:
+            return self._send(409, {'error': 'confirmations not pending', 'missing': missing})
+        self._send(200, {'success': ok})
+
+def _match_confirmations(current, wanted):
+    """Positions in current of the (id, nonce) pairs in wanted, and the ids
+    not found. A nonce must match whenever the pending confirmation has one."""
+    pos = {}
+    for i, c in enumerate(current):
+        if isinstance(c, dict) and c.get('id') is not None:
+            pos[str(c['id'])] = (i, c.get('nonce') or c.get('key'))
+    indices, missing = [], []
+    for conf_id, nonce in wanted:
+        hit = pos.get(conf_id)
+        if hit is None or (hit[1] is not None and str(nonce) != str(hit[1])):
+            missing.append(conf_id)
+        else:
+            indices.append(hit[0])
+    return indices, missing
+
+class _UnixHTTPServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects an (host, port) client address
+        return request, ('local', 0)
+
+def make_server(daemon, host='127.0.0.1', port=8645, unix=None, token=None):
+    """Server for daemon; TCP needs a bearer token, a Unix socket is made owner-only."""
+    if unix:
+        if os.path.exists(unix):
+            os.unlink(unix)
+        # TCP_NODELAY does not apply to Unix sockets
+        handler = type('Handler', (_Handler,), {'daemon': daemon, 'disable_nagle_algorithm': False, 'token': token})
+        old = os.umask(0o177)
+        try:
+            return _UnixHTTPServer(unix, handler)
+        finally:
+            os.umask(old)
+    if not token:
+        raise ValueError('a bearer token is required for a TCP listener')
+    handler = type('Handler', (_Handler,), {'daemon': daemon, 'token': token})
+    srv = ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads = True
+    return srv
+
+def load_token(path):
+    """STEAM_AUTH_TOKEN, else the token in path, created (mode 0600) if missing."""
+    token = os.environ.get('STEAM_AUTH_TOKEN')
+    if token:
+        return token
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            token = f.read().strip()
+    except FileNotFoundError:
+        token = None
+    if not token:
+        token = secrets.token_urlsafe(32)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(token + '\n')
+    return token
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Headless Steam authenticator daemon with a local JSON API.')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8645)
+    ap.add_argument('--unix', help='serve on a Unix socket at this path instead of TCP')
+    ap.add_argument('--db', default=DB_PATH, help='path to accounts.db')
+    ap.add_argument('--metrics', action='store_true', help='record metrics for GET /metrics')
+    ap.add_argument('--watch', action='store_true', help='poll confirmations for every account in the background')
+    ap.add_argument('--lock-after', type=float, help='forget the secrets key after this many idle seconds (0: never)')
+    ap.add_argument('--token-file', help='bearer token file for TCP (default: daemon.token next to the DB)')
+    ap.add_argument('--local-time', action='store_true', help='sign with the local clock, without syncing to Steam')
+    args = ap.parse_args(argv)
+
+    if args.local_time:
+        set_time_source(LocalTime())
+
+    if args.metrics:
+        metrics.enable()
+    daemon = Daemon(args.db, watch=args.watch, lock_after=args.lock_after)
+    daemon.start()
+    token = None
+    if not args.unix:
+        token_file = args.token_file or os.path.join(os.path.dirname(os.path.abspath(args.db)), 'daemon.token')
+        token = load_token(token_file)
+        if not os.environ.get('STEAM_AUTH_TOKEN'):
+            print(f'bearer token in {token_file}', flush=True)
+    srv = make_server(daemon, args.host, args.port, args.unix, token)
+    print(f'listening on {args.unix or f"http://{args.host}:{args.port}"}', flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        daemon.stop()
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,57 +1,350 @@
 import sqlite3
 import os
+import sys
 import time
+import threading
+from contextlib import contextmanager
+
+import metrics
+from secure_store import KeyRing, SETTING as KEY_SETTING
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'accounts.db')
 
+# schema migrations, applied in order and tracked with PRAGMA user_version.
+# each entry is (version, callable(cursor)).
+def _migrate_1(cur):
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_name TEXT NOT NULL,
+        password TEXT,
+        shared_secret TEXT,
+        identity_secret TEXT,
+        session_data TEXT,
+        created_at INTEGER,
+        mafile_path TEXT
+    )
+    ''')
+
+def _migrate_2(cur):
+    # add columns if missing (for DBs created before identity/session support)
+    cur.execute("PRAGMA table_info(accounts)")
+    cols = [r[1] for r in cur.fetchall()]
+    if 'identity_secret' not in cols:
+        cur.execute('ALTER TABLE accounts ADD COLUMN identity_secret TEXT')
+    if 'session_data' not in cols:
+        cur.execute('ALTER TABLE accounts ADD COLUMN session_data TEXT')
+
+def _migrate_3(cur):
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_accounts_name ON accounts(account_name)')
+
+def _migrate_4(cur):
+    # append-only log of handled confirmations (moved out of the maFiles)
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS confirmation_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER,
+        conf_id TEXT,
+        title TEXT,
+        accepted INTEGER NOT NULL,
+        handled_at INTEGER NOT NULL,
+        data TEXT
+    )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_history_account_time ON confirmation_history(account_id, handled_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_history_time ON confirmation_history(handled_at)')
+
+def _migrate_5(cur):
+    # case-insensitive prefix search over names
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_accounts_name_nocase ON accounts(account_name COLLATE NOCASE)')
+    # trigram index for substring and fuzzy search, kept in sync by triggers
+    try:
+        cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS accounts_fts USING fts5(account_name, content='accounts', content_rowid='id', tokenize='trigram')")
+        cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS accounts_fts_vocab USING fts5vocab(accounts_fts, 'row')")
+    except sqlite3.OperationalError:
+        # sqlite built without FTS5 (or older than 3.34): search uses LIKE only
+        return
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS accounts_fts_ai AFTER INSERT ON accounts BEGIN
+        INSERT INTO accounts_fts(rowid, account_name) VALUES (new.id, new.account_name);
+    END''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS accounts_fts_ad AFTER DELETE ON accounts BEGIN
+        INSERT INTO accounts_fts(accounts_fts, rowid, account_name) VALUES ('delete', old.id, old.account_name);
+    END''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS accounts_fts_au AFTER UPDATE OF account_name ON accounts BEGIN
+        INSERT INTO accounts_fts(accounts_fts, rowid, account_name) VALUES ('delete', old.id, old.account_name);
+        INSERT INTO accounts_fts(rowid, account_name) VALUES (new.id, new.account_name);
+    END''')
+    cur.execute("INSERT INTO accounts_fts(accounts_fts) VALUES ('rebuild')")
+
+def _migrate_6(cur):
+    # the per-row FTS insert trigger is slow for large imports: bulk inserts
+    # set a row in search_index_paused and index the new range in one statement
+    cur.execute('CREATE TABLE IF NOT EXISTS search_index_paused (flag INTEGER)')
+    if not cur.execute("SELECT 1 FROM sqlite_master WHERE name='accounts_fts'").fetchone():
+        return
+    cur.execute('DROP TRIGGER IF EXISTS accounts_fts_ai')
+    cur.execute('''
+    CREATE TRIGGER accounts_fts_ai AFTER INSERT ON accounts
+    WHEN NOT EXISTS (SELECT 1 FROM search_index_paused) BEGIN
+        INSERT INTO accounts_fts(rowid, account_name) VALUES (new.id, new.account_name);
+    END''')
+
+def _migrate_7(cur):
+    # change journal for incremental backups: one row per account write
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS change_journal (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        key INTEGER NOT NULL,
+        op TEXT NOT NULL
+    )
+    ''')
+    for name, event, row in (('ai', 'INSERT', 'new'), ('au', 'UPDATE', 'new'), ('ad', 'DELETE', 'old')):
+        cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS accounts_journal_{name} AFTER {event} ON accounts BEGIN
+            INSERT INTO change_journal(entity, key, op) VALUES ('account', {row}.id, '{event.lower()}');
+        END''')
+
+def _migrate_8(cur):
+    # small key/value store, e.g. the KDF parameters of encrypted secrets
+    cur.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+
+MIGRATIONS = [
+    (1, _migrate_1),
+    (2, _migrate_2),
+    (3, _migrate_3),
+    (4, _migrate_4),
+    (5, _migrate_5),
+    (6, _migrate_6),
+    (7, _migrate_7),
+    (8, _migrate_8),
+]
+
+# add_accounts_bulk batches at least this large skip the per-row FTS trigger
+BULK_INDEX_THRESHOLD = 256
+
+def _trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# paths already migrated in this process
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def get_database(path=DB_PATH):
+    """Return the process-wide Database for path, creating it on first use."""
+    key = os.path.abspath(path) if path != ':memory:' else None
+    if key is None:
+        return Database(path)
+    with _shared_lock:
+        db = _shared.get(key)
+        if db is None:
+            db = Database(path)
+            _shared[key] = db
+        return db
+
 class Database:
+    """Long-lived SQLite connection shared between threads.
+
+    All access goes through one connection guarded by a lock; sqlite3 keeps
+    prepared statements in its per-connection cache so repeated queries skip
+    re-parsing.
+    """
+
     def __init__(self, path=DB_PATH):
         self.path = path
+        self._lock = threading.RLock()
+        # row count, loaded lazily and then kept current by add/delete
+        self._count = None
+        # whether the trigram search index exists, checked on first search
+        self._fts = None
+        self._keyring = None
+        self._db = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
         self._ensure()
 
+    @contextmanager
     def _conn(self):
-        return sqlite3.connect(self.path)
+        # serialize access and commit/rollback like sqlite3's own context manager
+        if not metrics.enabled():
+            with self._lock:
+                with self._db:
+                    yield self._db
+            return
+        # labelled with the calling Database method; includes waiting for the lock
+        op = sys._getframe(2).f_code.co_name
+        with metrics.timed('db_query', op=op):
+            with self._lock:
+                with self._db:
+                    yield self._db
+
+    def close(self):
+        with self._lock:
+            self._db.close()
 
     def _ensure(self):
+        key = os.path.abspath(self.path) if self.path != ':memory:' else None
+        with _migrate_lock:
+            if key is not None and key in _migrated:
+                return
+            with self._conn() as c:
+                cur = c.cursor()
+                version = cur.execute('PRAGMA user_version').fetchone()[0]
+                for v, migrate in MIGRATIONS:
+                    if v > version:
+                        migrate(cur)
+                        cur.execute(f'PRAGMA user_version = {int(v)}')
+                c.commit()
+            if key is not None:
+                _migrated.add(key)
+
+    @property
+    def keyring(self):
+        """secure_store.KeyRing for this database's encrypted secrets."""
+        if self._keyring is None:
+            import json
+            raw = self.get_setting(KEY_SETTING)
+            self._keyring = KeyRing(json.loads(raw) if raw else None)
+        return self._keyring
+
+    def reload_keyring(self):
+        """Re-read the key parameters after encryption was switched on or off elsewhere."""
+        import json
+        raw = self.get_setting(KEY_SETTING)
+        self.keyring.set_params(json.loads(raw) if raw else None)
+
+    def get_setting(self, key, default=None):
         with self._conn() as c:
-            cur = c.cursor()
-            cur.execute('''
-            CREATE TABLE IF NOT EXISTS accounts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                account_name TEXT NOT NULL,
-                password TEXT,
-                shared_secret TEXT,
-                identity_secret TEXT,
-                session_data TEXT,
-                created_at INTEGER,
-                mafile_path TEXT
-            )
-            ''')
-            c.commit()
-            # migrate: add columns if missing (for older DBs)
-            cur.execute("PRAGMA table_info(accounts)")
-            cols = [r[1] for r in cur.fetchall()]
-            if 'identity_secret' not in cols:
-                cur.execute('ALTER TABLE accounts ADD COLUMN identity_secret TEXT')
-            if 'session_data' not in cols:
-                cur.execute('ALTER TABLE accounts ADD COLUMN session_data TEXT')
+            r = c.execute('SELECT value FROM settings WHERE key=?', (key,)).fetchone()
+            return r[0] if r else default
+
+    def get_settings(self, prefix):
+        """{key: value} for every setting whose key starts with prefix."""
+        with self._conn() as c:
+            rows = c.execute("SELECT key, value FROM settings WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            return dict(rows.fetchall())
+
+    def set_setting(self, key, value):
+        with self._conn() as c:
+            c.execute('INSERT INTO settings (key, value) VALUES (?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value', (key, value))
             c.commit()
 
+    def delete_setting(self, key):
+        with self._conn() as c:
+            return c.execute('DELETE FROM settings WHERE key=?', (key,)).rowcount > 0
+
+    def _seal(self, password, shared_secret, identity_secret):
+        # no-op unless encryption is on; raises secure_store.Locked while locked
+        ring = self.keyring
+        if not ring.enabled:
+            return password, shared_secret, identity_secret
+        return (ring.seal('password', password), ring.seal('shared_secret', shared_secret),
+                ring.seal('identity_secret', identity_secret))
+
     def add_account(self, account_name, password, shared_secret, identity_secret=None):
         ts = int(time.time())
+        password, shared_secret, identity_secret = self._seal(password, shared_secret, identity_secret)
         with self._conn() as c:
             cur = c.cursor()
             cur.execute('INSERT INTO accounts (account_name, password, shared_secret, identity_secret, created_at) VALUES (?,?,?,?,?)',
                         (account_name, password, shared_secret, identity_secret, ts))
             c.commit()
+            self._adjust_count(1)
             return cur.lastrowid
 
+    def add_accounts_bulk(self, accounts, path_for=None):
+        """Insert many accounts in a single transaction and return their ids.
+
+        accounts: iterable of dicts with account_name and optionally password,
+        shared_secret, identity_secret, mafile_path, created_at.
+        path_for: optional callable(acc_id, account) -> mafile_path, used for
+        rows without a mafile_path once their id is known.
+        """
+        ts = int(time.time())
+        seal = self._seal if self.keyring.enabled else None
+        with self._conn() as c:
+            cur = c.cursor()
+            # ids are assigned here so mafile paths can be stored in the same insert
+            cur.execute("SELECT seq FROM sqlite_sequence WHERE name='accounts'")
+            r = cur.fetchone()
+            next_id = (r[0] if r else cur.execute('SELECT COALESCE(MAX(id), 0) FROM accounts').fetchone()[0]) + 1
+            rows = []
+            ids = []
+            for a in accounts:
+                acc_id = next_id
+                next_id += 1
+                path = a.get('mafile_path')
+                if not path and path_for is not None:
+                    path = path_for(acc_id, a)
+                secrets = (a.get('password'), a.get('shared_secret'), a.get('identity_secret'))
+                if seal is not None:
+                    secrets = seal(*secrets)
+                rows.append((acc_id, a['account_name'], *secrets, a.get('created_at') or ts, path))
+                ids.append(acc_id)
+            bulk_index = len(rows) >= BULK_INDEX_THRESHOLD and self._has_fts(cur)
+            if bulk_index:
+                cur.execute('INSERT INTO search_index_paused VALUES (1)')
+            cur.executemany('INSERT INTO accounts (id, account_name, password, shared_secret, identity_secret, created_at, mafile_path) VALUES (?,?,?,?,?,?,?)', rows)
+            if bulk_index:
+                cur.execute('INSERT INTO accounts_fts(rowid, account_name) SELECT id, account_name FROM accounts WHERE id BETWEEN ? AND ?',
+                            (ids[0], ids[-1]))
+                cur.execute('DELETE FROM search_index_paused')
+            c.commit()
+            self._adjust_count(len(rows))
+            return ids
+
+    def get_shared_secrets(self):
+        """(id, shared_secret) for every account with a secret."""
+        with self._conn() as c:
+            cur = c.cursor()
+            cur.execute("SELECT id, shared_secret FROM accounts WHERE shared_secret IS NOT NULL AND shared_secret != ''")
+            return cur.fetchall()
+
+    def account_names(self):
+        with self._conn() as c:
+            cur = c.cursor()
+            cur.execute('SELECT account_name FROM accounts')
+            return {r[0] for r in cur.fetchall()}
+
     def set_mafile_path(self, acc_id, path):
         with self._conn() as c:
             cur = c.cursor()
             cur.execute('UPDATE accounts SET mafile_path=? WHERE id=?', (path, acc_id))
             c.commit()
 
+    def get_mafile_paths(self):
+        with self._conn() as c:
+            return c.execute('SELECT id, account_name, mafile_path FROM accounts ORDER BY id').fetchall()
+
+    def set_mafile_paths(self, items):
+        """Set mafile_path for many accounts in one transaction; items: (acc_id, path)."""
+        with self._conn() as c:
+            c.executemany('UPDATE accounts SET mafile_path=? WHERE id=?', [(p, acc_id) for acc_id, p in items])
+            c.commit()
+
+    def get_secrets(self):
+        """(id, password, shared_secret, identity_secret) for every account, as stored."""
+        with self._conn() as c:
+            return [list(r) for r in c.execute('SELECT id, password, shared_secret, identity_secret FROM accounts ORDER BY id')]
+
+    def set_secrets(self, items, clear_setting=None):
+        """Rewrite secrets in one transaction; items: (acc_id, password, shared_secret, identity_secret).
+        clear_setting is deleted in the same transaction."""
+        with self._conn() as c:
+            c.executemany('UPDATE accounts SET password=?, shared_secret=?, identity_secret=? WHERE id=?',
+                          [(p, s, i, acc_id) for acc_id, p, s, i in items])
+            if clear_setting is not None:
+                c.execute('DELETE FROM settings WHERE key=?', (clear_setting,))
+            c.commit()
+
     def set_session_data(self, acc_id, session_dict):
         import json
         with self._conn() as c:
@@ -59,14 +352,16 @@ class Database:
             cur.execute('UPDATE accounts SET session_data=? WHERE id=?', (json.dumps(session_dict), acc_id))
             c.commit()
 
-    def update_account(self, acc_id, account_name, password, shared_secret):
+    def set_session_data_bulk(self, items):
+        """Set session_data for many accounts in one transaction; items: (acc_id, dict)."""
+        import json
+        rows = [(json.dumps(d), acc_id) for acc_id, d in items]
         with self._conn() as c:
-            cur = c.cursor()
-            cur.execute('UPDATE accounts SET account_name=?, password=?, shared_secret=? WHERE id=?',
-                        (account_name, password, shared_secret, acc_id))
+            c.executemany('UPDATE accounts SET session_data=? WHERE id=?', rows)
             c.commit()
 
     def update_account(self, acc_id, account_name, password, shared_secret, identity_secret=None):
+        password, shared_secret, identity_secret = self._seal(password, shared_secret, identity_secret)
         with self._conn() as c:
             cur = c.cursor()
             cur.execute('UPDATE accounts SET account_name=?, password=?, shared_secret=?, identity_secret=? WHERE id=?',
@@ -77,21 +372,120 @@ class Database:
         with self._conn() as c:
             cur = c.cursor()
             cur.execute('DELETE FROM accounts WHERE id=?', (acc_id,))
+            deleted = cur.rowcount
+            cur.execute('DELETE FROM confirmation_history WHERE account_id=?', (acc_id,))
             c.commit()
+            self._adjust_count(-deleted)
 
-    def get_accounts_paginated(self, start, count):
+    def list_accounts(self, start_id=0, count=4):
+        """Keyset page of accounts with id >= start_id (id and account_name only)."""
         with self._conn() as c:
             cur = c.cursor()
-            cur.execute('SELECT id, account_name, password, shared_secret, created_at, mafile_path FROM accounts ORDER BY id LIMIT ? OFFSET ?', (count, start))
+            cur.execute('SELECT id, account_name FROM accounts WHERE id >= ? ORDER BY id LIMIT ?', (start_id, count))
+            return [{'id': r[0], 'account_name': r[1]} for r in cur.fetchall()]
+
+    def list_accounts_before(self, before_id, count=4):
+        """Keyset page of the accounts right before before_id, in ascending order."""
+        with self._conn() as c:
+            cur = c.cursor()
+            cur.execute('SELECT id, account_name FROM accounts WHERE id < ? ORDER BY id DESC LIMIT ?', (before_id, count))
             rows = cur.fetchall()
-            keys = ['id','account_name','password','shared_secret','created_at','mafile_path']
-            return [dict(zip(keys, r)) for r in rows]
+            rows.reverse()
+            return [{'id': r[0], 'account_name': r[1]} for r in rows]
 
-    def count_accounts(self):
+    def _has_fts(self, cur):
+        if self._fts is None:
+            cur.execute("SELECT 1 FROM sqlite_master WHERE name='accounts_fts_vocab'")
+            self._fts = cur.fetchone() is not None
+        return self._fts
+
+    def search_accounts(self, query, limit=50):
+        """Accounts whose name starts with query (in name order), then those
+        containing it; case-insensitive. Returns id and account_name."""
+        q = query.strip()
+        if not q:
+            return []
         with self._conn() as c:
             cur = c.cursor()
-            cur.execute('SELECT COUNT(*) FROM accounts')
-            return cur.fetchone()[0]
+            lo = q.lower()
+            cur.execute('SELECT id, account_name FROM accounts WHERE account_name >= ? COLLATE NOCASE AND account_name < ? COLLATE NOCASE '
+                        'ORDER BY account_name COLLATE NOCASE LIMIT ?', (lo, lo + chr(0x10ffff), limit))
+            rows = [{'id': r[0], 'account_name': r[1]} for r in cur.fetchall()]
+            if len(rows) >= limit:
+                return rows
+            seen = {r['id'] for r in rows}
+            want = limit - len(rows) + len(seen)
+            if len(q) >= 3 and self._has_fts(cur):
+                # a quoted trigram phrase matches substrings
+                cur.execute('SELECT rowid, account_name FROM accounts_fts WHERE accounts_fts MATCH ? LIMIT ?',
+                            ('"' + q.replace('"', '""') + '"', want))
+            else:
+                pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                cur.execute("SELECT id, account_name FROM accounts WHERE account_name LIKE ? ESCAPE '\\' LIMIT ?", (pattern, want))
+            for r in cur.fetchall():
+                if r[0] not in seen and len(rows) < limit:
+                    rows.append({'id': r[0], 'account_name': r[1]})
+            return rows
+
+    def fuzzy_search_accounts(self, query, limit=20, exclude=(), min_score=0.3, candidates=500):
+        """Accounts whose names share enough trigrams with query (typos,
+        transpositions), best first. Candidates come from the query's rarest
+        trigrams, at most candidates rows. Empty without the FTS5 index or for
+        queries shorter than 3 characters."""
+        q = query.strip()
+        if len(q) < 3:
+            return []
+        want = _trigrams(q)
+        with self._conn() as c:
+            cur = c.cursor()
+            if not self._has_fts(cur):
+                return []
+            df = []
+            for t in want:
+                r = cur.execute('SELECT doc FROM accounts_fts_vocab WHERE term=?', (t,)).fetchone()
+                if r:
+                    df.append((r[0], t))
+            df.sort()
+            names = {}
+            for _, t in df:
+                cur.execute('SELECT rowid, account_name FROM accounts_fts WHERE accounts_fts MATCH ? LIMIT ?',
+                            ('"' + t.replace('"', '""') + '"', candidates))
+                names.update(cur.fetchall())
+                if len(names) >= candidates:
+                    break
+        exclude = set(exclude)
+        scored = []
+        for acc_id, name in names.items():
+            if acc_id in exclude:
+                continue
+            have = _trigrams(name)
+            # Dice coefficient over trigram sets
+            score = 2 * len(want & have) / (len(want) + len(have)) if have else 0.0
+            if score >= min_score:
+                scored.append((-score, name, acc_id))
+        scored.sort()
+        return [{'id': acc_id, 'account_name': name} for _, name, acc_id in scored[:limit]]
+
+    def prune_change_journal(self, upto_seq):
+        """Drop journal entries already covered by a backup."""
+        with self._conn() as c:
+            c.execute('DELETE FROM change_journal WHERE seq <= ?', (upto_seq,))
+            c.commit()
+
+    def _adjust_count(self, delta):
+        with self._lock:
+            if self._count is not None:
+                self._count += delta
+
+    def count_accounts(self, refresh=False):
+        with self._lock:
+            if self._count is not None and not refresh:
+                return self._count
+            with self._conn() as c:
+                cur = c.cursor()
+                cur.execute('SELECT COUNT(*) FROM accounts')
+                self._count = cur.fetchone()[0]
+            return self._count
 
     def get_account_by_id(self, acc_id):
         with self._conn() as c:
@@ -102,3 +496,73 @@ class Database:
                 return None
             keys = ['id','account_name','password','shared_secret','created_at','mafile_path']
             return dict(zip(keys, r))
+
+    def add_confirmation_history(self, acc_id, items):
+        """Append handled confirmations (dicts with accepted/handled_at) for an account."""
+        import json
+        rows = []
+        for it in items:
+            extra = {k: v for k, v in it.items() if k not in ('id', 'title', 'accepted', 'handled_at')}
+            rows.append((acc_id, None if it.get('id') is None else str(it.get('id')), it.get('title'),
+                         1 if it.get('accepted') else 0, int(it.get('handled_at') or time.time()),
+                         json.dumps(extra, separators=(',', ':')) if extra else None))
+        if not rows:
+            return
+        with self._conn() as c:
+            c.executemany('INSERT INTO confirmation_history (account_id, conf_id, title, accepted, handled_at, data) VALUES (?,?,?,?,?,?)', rows)
+            c.commit()
+
+    def get_confirmation_history(self, acc_id=None, since=None, until=None, limit=None):
+        """Handled confirmations, newest first, filtered by account and time range."""
+        import json
+        where = []
+        args = []
+        if acc_id is not None:
+            where.append('account_id=?')
+            args.append(acc_id)
+        if since is not None:
+            where.append('handled_at>=?')
+            args.append(int(since))
+        if until is not None:
+            where.append('handled_at<?')
+            args.append(int(until))
+        sql = 'SELECT account_id, conf_id, title, accepted, handled_at, data FROM confirmation_history'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY handled_at DESC, id DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(int(limit))
+        with self._conn() as c:
+            rows = c.execute(sql, args).fetchall()
+        out = []
+        for acc, conf_id, title, accepted, handled_at, data in rows:
+            item = json.loads(data) if data else {}
+            item.update({'account_id': acc, 'id': conf_id, 'title': title,
+                         'accepted': bool(accepted), 'handled_at': handled_at})
+            out.append(item)
+        return out
+
+    def prune_confirmation_history(self, older_than=None, keep_per_account=None, vacuum=False):
+        """Retention: drop entries handled before older_than and/or beyond the newest
+        keep_per_account per account. Returns the number of rows removed."""
+        removed = 0
+        with self._conn() as c:
+            cur = c.cursor()
+            if older_than is not None:
+                cur.execute('DELETE FROM confirmation_history WHERE handled_at<?', (int(older_than),))
+                removed += cur.rowcount
+            if keep_per_account is not None:
+                cur.execute('''
+                DELETE FROM confirmation_history WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY account_id ORDER BY handled_at DESC, id DESC) AS rn
+                        FROM confirmation_history
+                    ) WHERE rn > ?
+                )''', (int(keep_per_account),))
+                removed += cur.rowcount
+            c.commit()
+        if vacuum and removed:
+            with self._lock:
+                self._db.execute('VACUUM')
+        return removed
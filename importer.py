@@ -0,0 +1,176 @@
+"""Bulk account import: a directory of .maFile files or a CSV file.
+
+Sources are streamed through parse -> validate -> dedupe -> insert. Parsing
+runs on a thread pool, and all accepted rows go into the database with one
+executemany in a single transaction.
+
+CLI:
+    python importer.py PATH [--db accounts.db] [--workers N]
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from db import DB_PATH, get_database
+from secure_store import SECRET_FIELDS, BadPassphrase, Locked, unlock_interactive
+
+CSV_FIELDS = ('account_name', 'password', 'shared_secret', 'identity_secret')
+
+def _parse_mafile(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        return path, None, f'unreadable: {e}'
+    if not isinstance(data, dict):
+        return path, None, 'not a JSON object'
+    return path, {
+        'account_name': data.get('account_name'),
+        'password': data.get('password'),
+        'shared_secret': data.get('shared_secret'),
+        'identity_secret': data.get('identity_secret'),
+        'mafile_path': os.path.abspath(path),
+        # the whole file, for the sealed copy written on an encrypted DB
+        'mafile': data,
+    }, None
+
+def _iter_csv(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for n, row in enumerate(csv.DictReader(f), start=2):
+            yield f'{path}:{n}', {k: (row.get(k) or '').strip() for k in CSV_FIELDS}, None
+
+def _validate(acc):
+    name = acc.get('account_name')
+    if not isinstance(name, str) or not name.strip():
+        return 'missing account_name'
+    if os.sep in name or (os.altsep and os.altsep in name):
+        return 'invalid account_name'
+    return None
+
+def _write_sealed_copies(accepted, ids, ring, store, report):
+    """Write each imported maFile into MAFILES_DIR with its secrets sealed,
+    so no plaintext copy is referenced by the DB; the sources are left as they are."""
+    from steam_wrapper import _ensure_mafiles_dir, mafile_path_for
+    _ensure_mafiles_dir()
+    for done, (acc, acc_id) in enumerate(zip(accepted, ids), start=1):
+        data = dict(acc['mafile'])
+        for field in SECRET_FIELDS:
+            if data.get(field):
+                data[field] = ring.seal(field, data[field])
+        store.save(mafile_path_for(acc['account_name'], acc_id), data)
+        if done % 500 == 0 or done == len(accepted):
+            report('mafiles', done, len(accepted))
+    store.flush()
+
+def import_accounts(source, db=None, workers=None, progress=None, store=None):
+    """Import accounts from a directory of .maFile files or a CSV file.
+
+    progress: optional callable(stage, done, total) where stage is one of
+    'parse', 'insert', 'mafiles'.
+
+    On an encrypted database db.keyring must be unlocked (secure_store.Locked
+    otherwise); secrets are sealed in the rows and in the maFiles the rows
+    point to: new ones for CSV rows, sealed copies in MAFILES_DIR (written
+    through store) for a directory, whose own files are left untouched.
+
+    Returns a dict with 'imported', 'ids', 'duplicates' and 'invalid'
+    (a list of (source, reason) pairs).
+    """
+    db = db or get_database()
+    report = progress or (lambda stage, done, total: None)
+    from_csv = os.path.isfile(source)
+
+    if from_csv:
+        parsed = list(_iter_csv(source))
+        report('parse', len(parsed), len(parsed))
+    else:
+        files = sorted(
+            os.path.join(source, n) for n in os.listdir(source)
+            if n.lower().endswith('.mafile')
+        )
+        parsed = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for item in pool.map(_parse_mafile, files):
+                parsed.append(item)
+                if len(parsed) % 500 == 0 or len(parsed) == len(files):
+                    report('parse', len(parsed), len(files))
+
+    invalid = []
+    duplicates = []
+    seen = db.account_names()
+    accepted = []
+    for src, acc, err in parsed:
+        err = err or _validate(acc)
+        if err:
+            invalid.append((src, err))
+            continue
+        acc['account_name'] = acc['account_name'].strip()
+        if acc['account_name'] in seen:
+            duplicates.append(src)
+            continue
+        seen.add(acc['account_name'])
+        accepted.append(acc)
+
+    ring = db.keyring
+    # plaintext source maFiles must not stay referenced by an encrypted DB
+    copy_sealed = not from_csv and ring.enabled
+    report('insert', 0, len(accepted))
+    if from_csv or copy_sealed:
+        from steam_wrapper import mafile_path_for
+        if copy_sealed:
+            for acc in accepted:
+                acc['mafile_path'] = None
+        ids = db.add_accounts_bulk(accepted, path_for=lambda acc_id, a: mafile_path_for(a['account_name'], acc_id))
+    else:
+        ids = db.add_accounts_bulk(accepted)
+    report('insert', len(ids), len(accepted))
+
+    if copy_sealed and accepted:
+        from mafile_store import default_store
+        _write_sealed_copies(accepted, ids, ring, store or default_store, report)
+
+    if from_csv and accepted:
+        # CSV rows have no maFile yet; write them now that ids are known
+        from steam_wrapper import SteamWrapper
+        # the db's keyring seals the secrets written into the new maFiles
+        wrapper = SteamWrapper(history=db)
+        for acc, acc_id in zip(accepted, ids):
+            acc['id'] = acc_id
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # real accounts: no demo confirmations in their maFiles
+            for _ in pool.map(lambda acc: wrapper.create_mafile(acc, demo_confirmations=False), accepted):
+                done += 1
+                if done % 500 == 0 or done == len(accepted):
+                    report('mafiles', done, len(accepted))
+
+    return {'imported': len(ids), 'ids': ids, 'duplicates': duplicates, 'invalid': invalid}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Bulk import accounts from .maFile files or a CSV file.')
+    ap.add_argument('source', help='directory with .maFile files, or a CSV with columns ' + ','.join(CSV_FIELDS))
+    ap.add_argument('--db', default=DB_PATH, help='path to accounts.db')
+    ap.add_argument('--workers', type=int, default=None, help='parser threads')
+    args = ap.parse_args(argv)
+
+    def progress(stage, done, total):
+        print(f'{stage}: {done}/{total}', flush=True)
+
+    db = get_database(args.db)
+    try:
+        # encrypted database: new rows and maFiles are sealed, which needs the key
+        unlock_interactive(db.keyring)
+        res = import_accounts(args.source, db=db, workers=args.workers, progress=progress)
+    except (BadPassphrase, Locked) as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 1
+    print(f"imported {res['imported']}, duplicates {len(res['duplicates'])}, invalid {len(res['invalid'])}")
+    for src, reason in res['invalid']:
+        print(f'  {src}: {reason}')
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+class RowModel:
+    """Keyed row model for a RecycleView.
+
+    Rows are dicts stored in ``view.data``; each mutation touches only the
+    affected rows so the RecycleView refreshes those and reuses its pool of
+    view widgets instead of rebuilding the list.
+    """
+
+    def __init__(self, view, key='key'):
+        self.view = view
+        self.key = key
+        self._index = {}
+        self._reindex()
+
+    @property
+    def data(self):
+        return self.view.data
+
+    def _reindex(self, start=0):
+        data = self.data
+        for i in range(start, len(data)):
+            self._index[data[i][self.key]] = i
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def index_of(self, key):
+        return self._index.get(key, -1)
+
+    def get(self, key):
+        i = self._index.get(key)
+        return None if i is None else self.data[i]
+
+    def keys(self):
+        return [r[self.key] for r in self.data]
+
+    def reset(self, rows):
+        self.view.data = list(rows)
+        self._index = {}
+        self._reindex()
+
+    def extend(self, rows):
+        start = len(self.data)
+        self.data.extend(rows)
+        self._reindex(start)
+
+    def insert(self, row, index=None):
+        if index is None or index >= len(self.data):
+            self.data.append(row)
+            self._index[row[self.key]] = len(self.data) - 1
+            return
+        self.data.insert(index, row)
+        self._reindex(index)
+
+    def remove(self, key):
+        i = self._index.pop(key, None)
+        if i is None:
+            return None
+        row = self.data.pop(i)
+        self._reindex(i)
+        return row
+
+    def patch(self, key, **fields):
+        i = self._index.get(key)
+        if i is None:
+            return False
+        row = dict(self.data[i])
+        row.update(fields)
+        self.data[i] = row
+        if row[self.key] != key:
+            del self._index[key]
+            self._index[row[self.key]] = i
+        return True
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from steam_wrapper import SteamWrapper, STEAM_COMMUNITY
+from sessions import SessionManager
+
+class FleetLogin:
+    """Concurrent web re-login for many accounts.
+
+    Logins run on a bounded worker pool, each in its account's own session
+    (so the steam wrapper needs a SessionManager), and go through the
+    wrapper's network layer for rate limits and backoff. RSA keys come from
+    the wrapper's RsaKeyCache. Resulting cookies and steamids are written
+    at the end in one batch: maFiles through a single store flush and
+    session_data through one DB transaction.
+    """
+
+    def __init__(self, steam=None, db=None, max_workers=8, base_url=STEAM_COMMUNITY, sessions=None):
+        if steam is None:
+            steam = SteamWrapper(sessions=sessions or SessionManager(), base_url=base_url, history=db)
+        elif steam.sessions is None:
+            raise ValueError('steam needs a SessionManager so each login gets its own cookie jar')
+        self.steam = steam
+        self.db = db
+        self.max_workers = max_workers
+
+    def _login_one(self, account):
+        username = account.get('username') or account.get('account_name')
+        password = account.get('password') or ''
+        twofactor = account.get('twofactor')
+        generated = twofactor is None and account.get('shared_secret')
+        if generated:
+            try:
+                twofactor = self.steam.generate_guard_code(account['shared_secret'])
+            except Exception:
+                twofactor = generated = None
+        result = self.steam.login_session(account, username, password, twofactor=twofactor)
+        # a rejected generated code may be clock drift: resync and try a fresh one, once
+        if generated and result[0].get('requires_twofactor') and self.steam._resync():
+            twofactor = self.steam.generate_guard_code(account['shared_secret'])
+            result = self.steam.login_session(account, username, password, twofactor=twofactor)
+        return result
+
+    def relogin(self, accounts, progress=None):
+        """Log accounts in; returns {account id: Steam response JSON}.
+
+        accounts are dicts with id, account_name, password, mafile_path and
+        optionally shared_secret (used for the Steam Guard code), username or
+        twofactor. progress(done, total) is called as logins finish.
+        """
+        accounts = list(accounts)
+        results = {}
+        logged_in = []
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='login') as pool:
+            futures = {pool.submit(self._login_one, acc): acc for acc in accounts}
+            for n, fut in enumerate(as_completed(futures), start=1):
+                acc = futures[fut]
+                try:
+                    j, cookies, steamid = fut.result()
+                except Exception as e:
+                    j, cookies, steamid = {'success': False, 'message': 'Login failed', 'error': str(e)}, {}, None
+                results[acc.get('id')] = j
+                if j.get('success'):
+                    logged_in.append((acc, cookies, steamid))
+                if progress is not None:
+                    progress(n, len(accounts))
+        self._commit(logged_in)
+        return results
+
+    def _commit(self, logged_in):
+        if not logged_in:
+            return
+        for acc, cookies, steamid in logged_in:
+            self.steam.save_login(acc, cookies, steamid, defer=True)
+        self.steam.store.flush()
+        if self.db is not None:
+            self.db.set_session_data_bulk([
+                (acc['id'], {'cookies': cookies, 'steamid': steamid})
+                for acc, cookies, steamid in logged_in if acc.get('id') is not None
+            ])
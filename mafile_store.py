@@ -0,0 +1,182 @@
+import os
+import json
+import atexit
+import tempfile
+import threading
+from collections import OrderedDict
+
+import metrics
+
+VAULT_PREFIX = 'vault:'
+
+def _norm(path):
+    return path if path.startswith(VAULT_PREFIX) else os.path.abspath(path)
+
+def _backend(key):
+    return 'vault' if key.startswith(VAULT_PREFIX) else 'file'
+
+def _vault_record(path):
+    from vault import open_vault, split_vault_path
+    vault_file, key = split_vault_path(path)
+    return open_vault(vault_file), key
+
+def _stat_key(path):
+    if path.startswith(VAULT_PREFIX):
+        # a rewritten record always moves, so its location identifies the version
+        vault, key = _vault_record(path)
+        try:
+            return vault.locate(key)
+        except KeyError:
+            raise FileNotFoundError(path)
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def _read(path):
+    if path.startswith(VAULT_PREFIX):
+        vault, key = _vault_record(path)
+        try:
+            return vault.get(key)
+        except KeyError:
+            raise FileNotFoundError(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def exists(path):
+    """os.path.exists that also understands vault: record paths."""
+    if not path:
+        return False
+    if path.startswith(VAULT_PREFIX):
+        vault, key = _vault_record(path)
+        return key in vault
+    return os.path.exists(path)
+
+def write_atomic(path, data):
+    """Serialize data compactly and replace path via write-then-rename."""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    d = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=d)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+class _Entry:
+    __slots__ = ('data', 'stat', 'dirty')
+
+    def __init__(self, data, stat, dirty=False):
+        self.data = data
+        self.stat = stat
+        self.dirty = dirty
+
+class MaFileStore:
+    """Cache of parsed maFiles keyed by path.
+
+    Entries are revalidated against the file's mtime/size on every load and
+    evicted least-recently-used beyond max_entries. save() coalesces writes:
+    the file is rewritten once, flush_delay seconds after the last change.
+
+    Paths may also be vault:<file>#<key> records of a packed vault.Vault.
+    """
+
+    def __init__(self, max_entries=1024, flush_delay=0.25):
+        self.max_entries = max_entries
+        self.flush_delay = flush_delay
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def load(self, path):
+        """Return the parsed maFile at path (shared dict; save() after mutating)."""
+        key = _norm(path)
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None:
+                if e.dirty:
+                    self._entries.move_to_end(key)
+                    metrics.inc('mafile_cache_total', result='hit')
+                    return e.data
+                try:
+                    st = _stat_key(key)
+                except OSError:
+                    st = None
+                if st == e.stat:
+                    self._entries.move_to_end(key)
+                    metrics.inc('mafile_cache_total', result='hit')
+                    return e.data
+            metrics.inc('mafile_cache_total', result='miss')
+            with metrics.timed('mafile_read', backend=_backend(key)):
+                st = _stat_key(key)
+                data = _read(key)
+            self._put(key, _Entry(data, st))
+            return data
+
+    def save(self, path, data, defer=True):
+        """Store data for path; written atomically now or after flush_delay."""
+        key = _norm(path)
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                e = _Entry(data, None)
+                self._put(key, e)
+            else:
+                e.data = data
+                self._entries.move_to_end(key)
+            if defer and self.flush_delay > 0:
+                e.dirty = True
+                self._schedule()
+            else:
+                self._write(key, e)
+
+    def exists(self, path):
+        return exists(path)
+
+    def invalidate(self, path):
+        key = _norm(path)
+        with self._lock:
+            e = self._entries.pop(key, None)
+            if e is not None and e.dirty:
+                self._write(key, e)
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for key, e in list(self._entries.items()):
+                if e.dirty:
+                    self._write(key, e)
+
+    def _write(self, key, e):
+        with metrics.timed('mafile_write', backend=_backend(key)):
+            if key.startswith(VAULT_PREFIX):
+                vault, rkey = _vault_record(key)
+                vault.put(rkey, e.data)
+            else:
+                write_atomic(key, e.data)
+            e.stat = _stat_key(key)
+        e.dirty = False
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            old_key, old = self._entries.popitem(last=False)
+            if old.dirty:
+                self._write(old_key, old)
+
+default_store = MaFileStore()
+atexit.register(default_store.flush)
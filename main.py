@@ -1,78 +1,293 @@
 from kivy.app import App
 from kivy.lang import Builder
+from kivy.clock import Clock
 from kivy.uix.screenmanager import ScreenManager, Screen
-from kivy.properties import NumericProperty, ObjectProperty, ListProperty
-from db import Database
-from steam_wrapper import SteamWrapper
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.properties import NumericProperty, ObjectProperty, ListProperty, StringProperty, BooleanProperty
+from db import get_database
+from list_model import RowModel
+from poller import FleetPoller
+from watcher import ConfirmationWatcher, conf_key
+from sessions import SessionManager
+from steam_time import get_time_source
+from steam_wrapper import SteamWrapper, SteamGuardCodes
+from secure_store import BadPassphrase, Locked
+import metrics
 import os
 
 KV_FILE = os.path.join(os.path.dirname(__file__), 'ui.kv')
 
+class LazyScreenManager(ScreenManager):
+    """ScreenManager that builds registered screens on first use.
+
+    register(name, factory) records factory(name) -> Screen; the screen is
+    created and added the first time it is looked up or navigated to.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._factories = {}
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def has_screen(self, name):
+        return name in self._factories or super().has_screen(name)
+
+    def get_screen(self, name):
+        factory = self._factories.pop(name, None)
+        if factory is not None:
+            self.add_widget(factory(name))
+        return super().get_screen(name)
+
+def _ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.1f}'
+
+class MetricsOverlay(Label):
+    """Debug overlay with live latencies; shown when metrics are enabled."""
+
+    _ev = None
+
+    def start(self, window):
+        self._window = window
+        self.refresh(0)
+        self._ev = Clock.schedule_interval(self.refresh, 1)
+
+    def stop(self):
+        if self._ev is not None:
+            self._ev.cancel()
+            self._ev = None
+
+    def refresh(self, dt):
+        r = metrics.registry
+        http = r.histogram('http_request_seconds')
+        conf = r.histogram('steam_op_seconds', op='fetch_confirmations')
+        db = r.histogram('db_query_seconds')
+        io = r.histogram('mafile_read_seconds')
+        hits = r.total('mafile_cache_total', result='hit')
+        misses = r.total('mafile_cache_total', result='miss')
+        errors = r.total('steam_errors_total') + r.total('http_request_errors_total')
+        self.text = '\n'.join([
+            f'http  {http.count}  p50 {_ms(http.quantile(0.5))}  p90 {_ms(http.quantile(0.9))} ms',
+            f'conf  {conf.count}  p50 {_ms(conf.quantile(0.5))}  p90 {_ms(conf.quantile(0.9))} ms',
+            f'db    {db.count}  p50 {_ms(db.quantile(0.5))}  p90 {_ms(db.quantile(0.9))} ms',
+            f'mafile  hit {hits}/{hits + misses}  read p90 {_ms(io.quantile(0.9))} ms',
+            f'errors  {errors}',
+        ])
+        self.x = 0
+        self.top = self._window.height
+
+def _reveal(db, field, value, locked=None):
+    """Plaintext of a possibly sealed secret, or locked while the keyring is locked."""
+    try:
+        return db.keyring.open(field, value)
+    except Locked:
+        return locked
+
 class MainScreen(Screen):
-    pass
+    db = ObjectProperty(None)
+    # encrypted secrets and no key in memory: the passphrase row is shown
+    locked = BooleanProperty(False)
+
+    def on_kv_post(self, base_widget):
+        self.db.keyring.on_lock(self._on_lock)
+
+    def on_enter(self):
+        self.ids.accounts_count.text = str(self.db.count_accounts())
+        ring = self.db.keyring
+        self.locked = ring.enabled and not ring.unlocked
+
+    def _on_lock(self):
+        # may run on the keyring's idle timer thread
+        Clock.schedule_once(lambda dt: setattr(self, 'locked', True))
+
+    def unlock(self):
+        field = self.ids.passphrase
+        try:
+            self.db.keyring.unlock(field.text)
+        except BadPassphrase:
+            field.text = ''
+            field.hint_text = 'Wrong passphrase'
+            return
+        field.text = ''
+        field.hint_text = 'Passphrase'
+        self.locked = False
+
+class AccountRow(Button):
+    acc_id = NumericProperty(0)
+
+    def on_release(self):
+        sm = App.get_running_app().root
+        sm.get_screen('account').account_id = self.acc_id
+        sm.current = 'account'
+
+class ConfirmationRow(BoxLayout):
+    text = StringProperty('')
+    conf_key = ObjectProperty(None)
+    selected = BooleanProperty(False)
 
 class AccountsScreen(Screen):
-    page = NumericProperty(0)
+    db = ObjectProperty(None)
+    codes = ObjectProperty(None)
     per_page = NumericProperty(4)
-    accounts = ListProperty([])
+    # rows fetched per keyset query while scrolling
+    chunk_size = NumericProperty(50)
+    # search runs once typing pauses this long (seconds)
+    search_delay = NumericProperty(0.15)
+    search_limit = NumericProperty(50)
+    model = None
+
+    def on_kv_post(self, base_widget):
+        self.model = RowModel(self.ids.accounts_list, key='acc_id')
+        self._exhausted = False
+        self._query = ''
+        self._search_ev = None
 
     def on_enter(self):
-        self.load()
+        self.update_count()
+        if not len(self.model) and not self._query:
+            self.load()
+        self._window = self.codes.window()
+        self._tick_ev = Clock.schedule_interval(self._tick, 1)
 
-    def load(self):
-        db = Database()
-        total = db.count_accounts()
+    def on_leave(self):
+        if getattr(self, '_tick_ev', None) is not None:
+            self._tick_ev.cancel()
+            self._tick_ev = None
+
+    def _tick(self, dt):
+        # codes change once per window; relabel all loaded rows in one reset
+        w = self.codes.window()
+        if w != self._window:
+            self._window = w
+            self.model.reset([self._row({'id': r['acc_id'], 'account_name': r['name']}) for r in self.model.data])
+
+    def update_count(self):
+        total = self.db.count_accounts()
         self.manager.get_screen('main').ids.accounts_count.text = str(total)
-        start = self.page * self.per_page
-        self.accounts = db.get_accounts_paginated(start, self.per_page)
-        # populate grid
-        try:
-            grid = self.ids.accounts_grid
-            grid.clear_widgets()
-            from kivy.uix.button import Button
-            for a in self.accounts:
-                btn = Button(text=f"{a['account_name']}", size_hint_y=None)
-                def _open(acc_id, *l):
-                    self.manager.get_screen('account').account_id = acc_id
-                    self.manager.current = 'account'
-                # bind with default arg
-                btn.bind(on_release=lambda inst, aid=a['id']: _open(aid))
-                grid.add_widget(btn)
-        except Exception:
-            pass
 
-    def next_page(self):
-        db = Database()
-        if (self.page + 1) * self.per_page < db.count_accounts():
-            self.page += 1
+    def _row(self, acc):
+        code = self.codes.code(acc['id']) if self.codes is not None else None
+        text = f"{acc['account_name']}    {code}" if code else acc['account_name']
+        return {'acc_id': acc['id'], 'name': acc['account_name'], 'text': text}
+
+    def on_search_text(self, text):
+        if self._search_ev is not None:
+            self._search_ev.cancel()
+        self._search_ev = Clock.schedule_once(lambda dt: self.search(text), self.search_delay)
+
+    def search(self, text):
+        self._search_ev = None
+        self._query = text.strip()
+        if not self._query:
             self.load()
+            return
+        rows = self.db.search_accounts(self._query, self.search_limit)
+        # search results are not keyset-paged
+        self._exhausted = True
+        self.model.reset([self._row(a) for a in rows])
+        if len(rows) < self.search_limit:
+            # close (fuzzy) matches follow in the next frame
+            query = self._query
+            exclude = [a['id'] for a in rows]
+            Clock.schedule_once(lambda dt: self._search_fuzzy(query, exclude, self.search_limit - len(rows)))
+
+    def _search_fuzzy(self, query, exclude, limit):
+        if query != self._query:
+            return
+        rows = self.db.fuzzy_search_accounts(query, limit, exclude)
+        self.model.extend([self._row(a) for a in rows if a['id'] not in self.model])
+
+    def load(self):
+        self._query = ''
+        rows = self.db.list_accounts(0, self.chunk_size)
+        self._exhausted = len(rows) < self.chunk_size
+        self.model.reset([self._row(a) for a in rows])
+
+    def load_more(self):
+        if self.model is None or self._exhausted or not len(self.model):
+            return
+        last_id = self.model.data[-1]['acc_id']
+        rows = self.db.list_accounts(last_id + 1, self.chunk_size)
+        self._exhausted = len(rows) < self.chunk_size
+        self.model.extend([self._row(a) for a in rows])
+
+    def on_list_scroll(self, rv):
+        # fetch the next keyset chunk before the user reaches the end
+        if rv.scroll_y <= 0.1:
+            self.load_more()
+
+    def account_added(self, acc):
+        self.codes.set_secret(acc['id'], acc.get('shared_secret'))
+        # ids grow monotonically, so a new account belongs at the end
+        if self._exhausted and not self._query:
+            self.model.insert(self._row(acc))
+        self.update_count()
+
+    def account_updated(self, acc):
+        self.codes.set_secret(acc['id'], acc.get('shared_secret'))
+        row = self._row(acc)
+        self.model.patch(acc['id'], name=row['name'], text=row['text'])
+
+    def account_deleted(self, acc_id):
+        self.codes.remove(acc_id)
+        self.model.remove(acc_id)
+        self.update_count()
+
+    def _scroll_rows(self, rows):
+        rv = self.ids.accounts_list
+        _, dy = rv.convert_distance_to_scroll(0, rows * rv.layout_manager.default_size[1])
+        rv.scroll_y = min(1.0, max(0.0, rv.scroll_y - dy))
+        self.on_list_scroll(rv)
+
+    def next_page(self):
+        self._scroll_rows(self.per_page)
 
     def prev_page(self):
-        if self.page > 0:
-            self.page -= 1
-            self.load()
+        self._scroll_rows(-self.per_page)
 
 class AccountScreen(Screen):
+    db = ObjectProperty(None)
+    codes = ObjectProperty(None)
     account_id = NumericProperty(0)
 
     def on_enter(self):
         self.load()
+        self._tick(0)
+        self._tick_ev = Clock.schedule_interval(self._tick, 1)
+
+    def on_leave(self):
+        if getattr(self, '_tick_ev', None) is not None:
+            self._tick_ev.cancel()
+            self._tick_ev = None
+
+    def _tick(self, dt):
+        code = self.codes.code(self.account_id)
+        self.ids.account_code.text = f'{code}  ({self.codes.seconds_left()}s)' if code else '-'
 
     def load(self):
-        db = Database()
+        db = self.db
         acc = db.get_account_by_id(self.account_id)
         if acc:
             self.ids.account_name.text = acc['account_name']
-            self.ids.account_password.text = acc['password'] or ''
-            self.ids.account_shared.text = acc['shared_secret'] or ''
+            for field, label in (('password', self.ids.account_password), ('shared_secret', self.ids.account_shared)):
+                label.text = _reveal(db, field, acc[field], '(locked)') or ''
             self._acc = acc
 
     def delete(self):
-        db = Database()
+        db = self.db
         db.delete_account(self.account_id)
+        self.manager.get_screen('accounts').account_deleted(self.account_id)
         self.manager.current = 'accounts'
 
     def edit(self):
+        ring = self.db.keyring
+        if ring.enabled and not ring.unlocked:
+            # secrets cannot be shown for editing; unlock on the main screen
+            self.manager.current = 'main'
+            return
         self.manager.get_screen('edit_account').set_account(self._acc)
         self.manager.current = 'edit_account'
 
@@ -88,6 +303,8 @@ class AddAccountScreen(Screen):
         self.manager.current = 'add_manual'
 
 class AddManualScreen(Screen):
+    db = ObjectProperty(None)
+    steam = ObjectProperty(None)
     def add_account(self):
         name = self.ids.input_name.text.strip()
         pwd = self.ids.input_password.text.strip()
@@ -97,28 +314,35 @@ class AddManualScreen(Screen):
             identity = self.ids.input_identity.text.strip()
         if not name:
             return
-        db = Database()
-        acc_id = db.add_account(name, pwd, shared, identity_secret=identity)
+        db = self.db
+        try:
+            acc_id = db.add_account(name, pwd, shared, identity_secret=identity)
+        except Locked:
+            self.manager.current = 'main'
+            return
         # create mafile and save path
-        wrapper = SteamWrapper()
         try:
-            path = wrapper.create_mafile({'id': acc_id, 'account_name': name, 'password': pwd, 'shared_secret': shared})
+            path = self.steam.create_mafile({'id': acc_id, 'account_name': name, 'password': pwd, 'shared_secret': shared})
             if path:
                 db.set_mafile_path(acc_id, path)
         except Exception:
             pass
+        # the code cache gets the secret as stored (sealed when encrypted)
+        stored = db.get_account_by_id(acc_id)
+        self.manager.get_screen('accounts').account_added({'id': acc_id, 'account_name': name, 'shared_secret': stored['shared_secret']})
         self.manager.current = 'accounts'
 
 class EditAccountScreen(Screen):
+    db = ObjectProperty(None)
     acc = ObjectProperty(None)
 
     def set_account(self, acc):
         self.acc = acc
         self.ids.edit_name.text = acc['account_name']
-        self.ids.edit_password.text = acc['password'] or ''
-        self.ids.edit_shared.text = acc['shared_secret'] or ''
+        self.ids.edit_password.text = _reveal(self.db, 'password', acc['password']) or ''
+        self.ids.edit_shared.text = _reveal(self.db, 'shared_secret', acc['shared_secret']) or ''
         if hasattr(self.ids, 'edit_identity'):
-            self.ids.edit_identity.text = acc.get('identity_secret') or ''
+            self.ids.edit_identity.text = _reveal(self.db, 'identity_secret', acc.get('identity_secret')) or ''
 
     def save(self):
         name = self.ids.edit_name.text.strip()
@@ -127,66 +351,187 @@ class EditAccountScreen(Screen):
         identity = ''
         if hasattr(self.ids, 'edit_identity'):
             identity = self.ids.edit_identity.text.strip()
-        db = Database()
-        db.update_account(self.acc['id'], name, pwd, shared, identity)
+        db = self.db
+        try:
+            db.update_account(self.acc['id'], name, pwd, shared, identity)
+        except Locked:
+            self.manager.current = 'main'
+            return
+        stored = db.get_account_by_id(self.acc['id'])
+        self.manager.get_screen('accounts').account_updated({'id': self.acc['id'], 'account_name': name, 'shared_secret': stored['shared_secret']})
         self.manager.current = 'account'
 
 class ConfirmationsScreen(Screen):
+    db = ObjectProperty(None)
+    steam = ObjectProperty(None)
+    watcher = ObjectProperty(None)
     account = ObjectProperty(None)
     confirmations = ListProperty([])
+    _unsubscribe = None
 
     def set_account(self, acc):
         self.account = acc
         self.load_confirmations()
 
+    def on_kv_post(self, base_widget):
+        self.model = RowModel(self.ids.conf_list, key='conf_key')
+
+    @staticmethod
+    def _row(c, i):
+        return {'conf_key': conf_key(c, i), 'text': str(c), 'selected': False}
+
     def load_confirmations(self):
-        wrapper = SteamWrapper()
-        try:
-            self.confirmations = wrapper.fetch_confirmations(self.account)
-        except Exception:
-            self.confirmations = []
-        # populate confirmations grid
-        try:
-            grid = self.ids.conf_grid
-            grid.clear_widgets()
-            from kivy.uix.label import Label
-            from kivy.uix.boxlayout import BoxLayout
-            from kivy.uix.button import Button
-            for i, c in enumerate(self.confirmations):
-                box = BoxLayout(size_hint_y=None, height='72dp')
-                box.add_widget(Label(text=str(c)))
-                b1 = Button(text='Accept', size_hint_x=None, width='100dp')
-                b1.bind(on_release=lambda inst, idx=i: self.accept(idx))
-                b2 = Button(text='Decline', size_hint_x=None, width='100dp')
-                b2.bind(on_release=lambda inst, idx=i: self.decline(idx))
-                box.add_widget(b1)
-                box.add_widget(b2)
-                grid.add_widget(box)
-        except Exception:
-            pass
+        # the watcher polls off the UI thread and publishes changes via Clock
+        if self._unsubscribe is None:
+            self._unsubscribe = self.watcher.subscribe(self._on_change)
+        self.watcher.watch(self.account)
+        self.confirmations = self.watcher.snapshot(self.account) or []
+        self.model.reset([self._row(c, i) for i, c in enumerate(self.confirmations)])
+        self.watcher.note_activity(self.account)
 
-    def accept(self, idx):
-        wrapper = SteamWrapper()
-        wrapper.respond_confirmation(self.account, idx, True)
-        self.load_confirmations()
+    def on_leave(self):
+        # only the open account is polled for the UI
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self.account is not None:
+            self.watcher.unwatch(self.account)
 
-    def decline(self, idx):
-        wrapper = SteamWrapper()
-        wrapper.respond_confirmation(self.account, idx, False)
-        self.load_confirmations()
+    def _on_change(self, account, added, removed, current):
+        if self.account is None or account.get('id') != self.account.get('id'):
+            return
+        # patch only the rows that changed
+        for k in removed:
+            self.model.remove(k)
+        if added:
+            pos = {id(c): i for i, c in enumerate(current)}
+            for c in added:
+                i = pos[id(c)]
+                row = self._row(c, i)
+                if row['conf_key'] not in self.model:
+                    self.model.insert(row, min(i, len(self.model)))
+        self.confirmations = list(current)
+
+    def set_selected(self, key, value):
+        row = self.model.get(key)
+        if row is not None and row['selected'] != value:
+            self.model.patch(key, selected=value)
+
+    def _respond(self, key, accept):
+        idx = self.model.index_of(key)
+        if idx < 0:
+            return
+        # sent with the confirmation's id and nonce, not its position
+        if self.steam.respond_confirmations(self.account, [idx], accept, confirmations=self.confirmations):
+            # drop just this row; the view keeps its widgets
+            self.model.remove(key)
+            self.confirmations.pop(idx)
+            self.watcher.note_activity(self.account)
+
+    def accept(self, key):
+        self._respond(key, True)
+
+    def decline(self, key):
+        self._respond(key, False)
+
+    def _respond_batch(self, keys, accept):
+        indices = [self.model.index_of(k) for k in keys]
+        indices = [i for i in indices if i >= 0]
+        if not indices:
+            return
+        if self.steam.respond_confirmations(self.account, indices, accept, confirmations=self.confirmations):
+            # one model reset for the whole batch
+            done = set(indices)
+            keep = [i for i in range(len(self.confirmations)) if i not in done]
+            self.confirmations = [self.confirmations[i] for i in keep]
+            self.model.reset([self.model.data[i] for i in keep])
+            self.watcher.note_activity(self.account)
+
+    def accept_all(self):
+        self._respond_batch(self.model.keys(), True)
+
+    def accept_selected(self):
+        self._respond_batch([r['conf_key'] for r in self.model.data if r['selected']], True)
+
+    def decline_selected(self):
+        self._respond_batch([r['conf_key'] for r in self.model.data if r['selected']], False)
 
 class AuthApp(App):
+    # created on first use so launch does not pay for them
+    _sessions = None
+    _steam = None
+    _poller = None
+    _watcher = None
+
+    @property
+    def sessions(self):
+        if self._sessions is None:
+            self._sessions = SessionManager()
+        return self._sessions
+
+    @property
+    def steam(self):
+        # one wrapper for the app; HTTP sessions are pooled per account
+        if self._steam is None:
+            self._steam = SteamWrapper(history=self.db, sessions=self.sessions)
+        return self._steam
+
+    @property
+    def poller(self):
+        if self._poller is None:
+            self._poller = FleetPoller(dispatch=self._ui, keyring=self.db.keyring)
+        return self._poller
+
+    @property
+    def watcher(self):
+        # background polling; screens get only added/removed confirmations
+        if self._watcher is None:
+            self._watcher = ConfirmationWatcher(self.poller, dispatch=self._ui)
+            self._watcher.start()
+        return self._watcher
+
+    @staticmethod
+    def _ui(fn):
+        Clock.schedule_once(lambda dt: fn())
+
     def build(self):
         Builder.load_file(KV_FILE)
-        sm = ScreenManager()
-        sm.add_widget(MainScreen(name='main'))
-        sm.add_widget(AccountsScreen(name='accounts'))
-        sm.add_widget(AccountScreen(name='account'))
-        sm.add_widget(AddAccountScreen(name='add'))
-        sm.add_widget(AddManualScreen(name='add_manual'))
-        sm.add_widget(EditAccountScreen(name='edit_account'))
-        sm.add_widget(ConfirmationsScreen(name='confirmations'))
+        # align signing and codes to Steam's clock, once the first frame is up
+        Clock.schedule_once(lambda dt: get_time_source().start())
+        # one long-lived connection shared by every screen
+        self.db = get_database()
+        db = self.db
+        # Steam Guard codes for the fleet, secrets loaded on first use
+        self.codes = SteamGuardCodes(loader=db.get_shared_secrets, keyring=db.keyring)
+        codes = self.codes
+        sm = LazyScreenManager()
+        sm.add_widget(MainScreen(name='main', db=db))
+        # everything else is built on first navigation
+        sm.register('accounts', lambda name: AccountsScreen(name=name, db=db, codes=codes))
+        sm.register('account', lambda name: AccountScreen(name=name, db=db, codes=codes))
+        sm.register('add', lambda name: AddAccountScreen(name=name))
+        sm.register('add_manual', lambda name: AddManualScreen(name=name, db=db, steam=self.steam))
+        sm.register('edit_account', lambda name: EditAccountScreen(name=name, db=db))
+        sm.register('confirmations', lambda name: ConfirmationsScreen(name=name, db=db, steam=self.steam, watcher=self.watcher))
         return sm
 
+    def on_start(self):
+        if metrics.enabled():
+            from kivy.core.window import Window
+            self.overlay = MetricsOverlay()
+            Window.add_widget(self.overlay)
+            self.overlay.start(Window)
+
+    def on_stop(self):
+        if getattr(self, 'overlay', None) is not None:
+            self.overlay.stop()
+        if self._watcher is not None:
+            self._watcher.stop()
+        if self._poller is not None:
+            self._poller.shutdown()
+        if self._sessions is not None:
+            self._sessions.close()
+        get_time_source().stop()
+
 if __name__ == '__main__':
     AuthApp().run()
@@ -0,0 +1,210 @@
+"""Counters and latency histograms for network calls, DB queries and maFile I/O.
+
+Off by default: while disabled, timed() hands back a shared no-op context
+manager and inc()/observe() return after one flag check, so the hooks in
+the hot paths cost close to nothing. Enable with enable() or the
+STEAM_AUTH_METRICS environment variable (1 for per-endpoint series,
+"account" to also keep per-account series, which can be many).
+
+Export with prometheus_text() or snapshot() (JSON-able).
+"""
+import os
+import time
+import json
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        # last slot is +Inf
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (None if empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return float('inf')
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _Noop()
+
+class Registry:
+    def __init__(self, enabled=False, per_account=False):
+        self.enabled = enabled
+        self.per_account = per_account
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, labels):
+        if not self.per_account:
+            labels.pop('account', None)
+        return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, self._labels(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = Histogram()
+            h.observe(seconds)
+
+    def timed(self, name, **labels):
+        """Context manager recording name_seconds; exceptions also count name_errors_total."""
+        if not self.enabled:
+            return _NOOP
+        return self._timed(name, labels)
+
+    @contextmanager
+    def _timed(self, name, labels):
+        t = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.inc(name + '_errors_total', error=type(e).__name__, **labels)
+            raise
+        finally:
+            self.observe(name + '_seconds', time.perf_counter() - t, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """{'counters': [...], 'histograms': [...]} with plain JSON values."""
+        with self._lock:
+            counters = [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self._counters.items())]
+            histograms = [{
+                'name': n, 'labels': dict(l), 'count': h.count, 'sum': h.sum,
+                'p50': h.quantile(0.5), 'p90': h.quantile(0.9), 'p99': h.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts)),
+            } for (n, l), h in sorted(self._histograms.items())]
+        return {'counters': counters, 'histograms': histograms}
+
+    def histogram(self, name, **labels):
+        """Merged Histogram of every series of name matching labels."""
+        want = set((k, str(v)) for k, v in labels.items())
+        merged = Histogram()
+        with self._lock:
+            for (n, l), h in self._histograms.items():
+                if n == name and want <= set(l):
+                    merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                    merged.sum += h.sum
+                    merged.count += h.count
+        return merged
+
+    def total(self, name, **labels):
+        """Sum of every series of counter name matching labels."""
+        want = set((k, str(v)) for k, v in labels.items())
+        with self._lock:
+            return sum(v for (n, l), v in self._counters.items() if n == name and want <= set(l))
+
+    def prometheus_text(self, prefix='steam_auth_'):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join('%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (list(h.counts), h.sum, h.count)) for k, h in self._histograms.items())
+        typed = set()
+        for (name, labels), v in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {prefix}{name} counter')
+                typed.add(name)
+            lines.append(f'{prefix}{name}{fmt(labels)} {v}')
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {prefix}{name} histogram')
+                typed.add(name)
+            cum = 0
+            for bound, n in zip([repr(b) for b in BUCKETS] + ['+Inf'], counts):
+                cum += n
+                lines.append(f'{prefix}{name}_bucket{fmt(labels, [("le", bound)])} {cum}')
+            lines.append(f'{prefix}{name}_sum{fmt(labels)} {total}')
+            lines.append(f'{prefix}{name}_count{fmt(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+_env = os.environ.get('STEAM_AUTH_METRICS', '').lower()
+registry = Registry(enabled=_env not in ('', '0', 'false'), per_account=_env == 'account')
+
+def enabled():
+    return registry.enabled
+
+def enable(flag=True, per_account=None):
+    registry.enabled = flag
+    if per_account is not None:
+        registry.per_account = per_account
+
+def inc(name, value=1, **labels):
+    if registry.enabled:
+        registry.inc(name, value, **labels)
+
+def observe(name, seconds, **labels):
+    if registry.enabled:
+        registry.observe(name, seconds, **labels)
+
+def timed(name, **labels):
+    if not registry.enabled:
+        return _NOOP
+    return registry._timed(name, labels)
+
+def instrumented(name, **labels):
+    """Decorator: time every call like timed(name, **labels)."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return fn(*args, **kwargs)
+            with registry._timed(name, dict(labels)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def snapshot():
+    return registry.snapshot()
+
+def to_json():
+    return json.dumps(registry.snapshot())
+
+def prometheus_text():
+    return registry.prometheus_text()
@@ -0,0 +1,262 @@
+"""Request coalescing, rate limiting, retries and circuit breaking for Steam calls."""
+import time
+import random
+import threading
+
+import metrics
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while an endpoint's breaker is open."""
+
+class RateLimitTimeout(Exception):
+    """Raised when a token could not be acquired within the wait limit."""
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, bursts up to capacity."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.clock = clock
+        self._tokens = self.capacity
+        self._stamp = clock()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Take a token if available; otherwise return seconds until one is."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; after reset_timeout
+    one trial call is let through (half-open) and its outcome decides."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+    def release(self):
+        """End an allowed call that neither succeeded nor failed (e.g. never sent)."""
+        with self._lock:
+            self._trial = False
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        if not leader:
+            metrics.inc('http_coalesced_total')
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+class NetworkLayer:
+    """Policy wrapper around session calls made by SteamWrapper.
+
+    request() coalesces identical in-flight GETs, takes a token from the
+    global and the per-account bucket, retries idempotent requests on
+    connection errors and RETRY_STATUS responses with full-jitter
+    exponential backoff, and keeps a circuit breaker per endpoint.
+    """
+
+    def __init__(self, global_rate=50.0, global_burst=100, account_rate=1.0, account_burst=3,
+                 max_retries=3, backoff_base=0.5, backoff_max=16.0,
+                 failure_threshold=5, reset_timeout=30.0, acquire_timeout=30.0):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.acquire_timeout = acquire_timeout
+        self._accounts = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def _account_bucket(self, key):
+        with self._lock:
+            b = self._accounts.get(key)
+            if b is None:
+                b = self._accounts[key] = TokenBucket(self.account_rate, self.account_burst)
+            return b
+
+    def breaker(self, endpoint):
+        with self._lock:
+            b = self._breakers.get(endpoint)
+            if b is None:
+                b = self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return b
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _acquire(self, account_key):
+        with metrics.timed('rate_limit_wait'):
+            self._acquire_tokens(account_key)
+
+    def _acquire_tokens(self, account_key):
+        if account_key is not None and not self._account_bucket(account_key).acquire(self.acquire_timeout):
+            raise RateLimitTimeout(f'account {account_key} rate limit')
+        if not self.global_bucket.acquire(self.acquire_timeout):
+            raise RateLimitTimeout('global rate limit')
+
+    def _send(self, session, method, url, endpoint, account_key, kwargs, idempotent):
+        breaker = self.breaker(endpoint)
+        # tokens first: a rate-limit timeout must not strand a half-open trial
+        self._acquire(account_key)
+        if not breaker.allow():
+            metrics.inc('http_circuit_open_total', endpoint=endpoint)
+            raise CircuitOpenError(endpoint)
+        # the breaker sees one outcome per logical call, not per attempt
+        ok = None
+        try:
+            resp = self._attempts(session, method, url, endpoint, account_key, kwargs,
+                                  self.max_retries if idempotent else 0)
+            ok = resp.status_code not in RETRY_STATUS
+            return resp
+        except RateLimitTimeout:
+            raise
+        except Exception:
+            ok = False
+            raise
+        finally:
+            if ok is True:
+                breaker.success()
+            elif ok is False:
+                breaker.failure()
+            else:
+                breaker.release()
+
+    def _attempts(self, session, method, url, endpoint, account_key, kwargs, retries):
+        attempt = 0
+        while True:
+            if attempt:
+                self._acquire(account_key)
+                metrics.inc('http_retries_total', endpoint=endpoint)
+            try:
+                with metrics.timed('http_request', endpoint=endpoint, account=account_key):
+                    resp = session.request(method, url, **kwargs)
+            except Exception:
+                if attempt >= retries:
+                    raise
+            else:
+                if metrics.enabled():
+                    metrics.inc('http_responses_total', endpoint=endpoint, status=resp.status_code)
+                    # time to response headers: Steam's own latency, without the body transfer
+                    metrics.observe('http_ttfb_seconds', resp.elapsed.total_seconds(), endpoint=endpoint)
+                if resp.status_code not in RETRY_STATUS or attempt >= retries:
+                    return resp
+                retry_after = resp.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    time.sleep(min(self.backoff_max, int(retry_after)))
+                    attempt += 1
+                    continue
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def request(self, session, method, url, endpoint=None, account_key=None, coalesce_key=None, idempotent=None, **kwargs):
+        """Send through session with the layer's policies.
+
+        GETs are coalesced per account on coalesce_key, or on url + params
+        when not given (pass a key that ignores per-call signatures to merge
+        requests that differ only in k/t). Only idempotent requests are
+        retried: GET/HEAD by default, others when idempotent=True.
+        """
+        endpoint = endpoint or url
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD')
+        if method.upper() != 'GET':
+            return self._send(session, method, url, endpoint, account_key, kwargs, idempotent)
+        key = (account_key, coalesce_key)
+        if coalesce_key is None:
+            params = kwargs.get('params') or {}
+            key = (url, account_key, tuple(sorted((k, str(v)) for k, v in params.items())))
+        return self._flight.do(key, lambda: self._send(session, method, url, endpoint, account_key, kwargs, idempotent))
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_network():
+    """Process-wide NetworkLayer, so every SteamWrapper shares limits and breakers."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = NetworkLayer()
+        return _default
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from steam_wrapper import SteamWrapper, STEAM_COMMUNITY
+from sessions import pooled_session
+
+class FleetPoller:
+    """Fetch mobileconf confirmations for many accounts concurrently.
+
+    Requests run on a bounded thread pool sharing one pooled session that
+    never stores cookies (each request carries its account's cookies), each
+    with its own timeout. Results are handed to callbacks through dispatch,
+    a callable(fn) that runs fn on the consumer's thread (for Kivy, wrap
+    Clock.schedule_once); by default callbacks run on the worker thread.
+    """
+
+    def __init__(self, max_workers=32, timeout=10, base_url=STEAM_COMMUNITY, dispatch=None, store=None, session=None, keyring=None):
+        self.timeout = timeout
+        self.dispatch = dispatch or (lambda fn: fn())
+        self.session = session or pooled_session(max_workers, store_cookies=False)
+        # keyring opens sealed identity secrets for signing
+        self.wrapper = SteamWrapper(store=store, session=self.session, base_url=base_url, timeout=timeout, keyring=keyring)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='poller')
+
+    def fetch_one(self, account):
+        """Return (confirmations, error) for one account."""
+        try:
+            return self.wrapper.fetch_confirmations(account, timeout=self.timeout), None
+        except Exception as e:
+            return [], e
+
+    def poll_async(self, accounts, on_result=None, on_done=None, dispatch=None):
+        """Start polling accounts; returns immediately.
+
+        on_result(account, confirmations, error) is dispatched as each account
+        finishes, on_done(results) once all have, where results maps
+        account id to its confirmations. dispatch overrides self.dispatch.
+        """
+        dispatch = dispatch or self.dispatch
+        accounts = list(accounts)
+        results = {}
+        lock = threading.Lock()
+        remaining = [len(accounts)]
+
+        def finished(account, fut):
+            confs, err = fut.result()
+            if on_result is not None:
+                dispatch(lambda: on_result(account, confs, err))
+            # counted after dispatching so on_done is always the last callback
+            with lock:
+                results[account.get('id')] = confs
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and on_done is not None:
+                dispatch(lambda: on_done(results))
+
+        if not accounts:
+            if on_done is not None:
+                dispatch(lambda: on_done(results))
+            return
+        for acc in accounts:
+            fut = self._pool.submit(self.fetch_one, acc)
+            fut.add_done_callback(lambda f, a=acc: finished(a, f))
+
+    def poll(self, accounts):
+        """Poll accounts and block until all are done; returns {id: confirmations}."""
+        accounts = list(accounts)
+        futures = [(acc, self._pool.submit(self.fetch_one, acc)) for acc in accounts]
+        return {acc.get('id'): fut.result()[0] for acc, fut in futures}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,324 @@
+"""Encryption at rest for account secrets (password, shared_secret, identity_secret).
+
+Sealed values replace the plaintext in the same DB columns and maFile
+fields as 'enc1:' + base64(nonce | ciphertext | tag), ChaCha20-Poly1305
+with the field name as associated data. The key is derived from a
+passphrase with scrypt once per unlock and kept in a KeyRing until lock()
+or idle_timeout seconds without use. Nothing is decrypted up front: the DB
+stores and returns sealed values as they are, and SteamWrapper opens one
+when it needs it for a code, a signature or a login.
+
+Plaintext values pass through open() unchanged, so a partly migrated
+fleet keeps working.
+
+CLI:
+    python secure_store.py encrypt [--db PATH]    seal every row and maFile (asks for a passphrase)
+    python secure_store.py decrypt [--db PATH]    back to plaintext
+"""
+import os
+import sys
+import json
+import time
+import base64
+import getpass
+import hashlib
+import weakref
+import argparse
+import threading
+
+PREFIX = 'enc1:'
+SECRET_FIELDS = ('password', 'shared_secret', 'identity_secret')
+# settings row holding the KDF parameters and the passphrase check value
+SETTING = 'secret_key'
+# seconds without use before the key is dropped
+IDLE_TIMEOUT = 900
+_CHECK = 'secure_store'
+
+class Locked(Exception):
+    """A sealed secret was needed while the keyring is locked."""
+
+class BadPassphrase(ValueError):
+    pass
+
+def is_sealed(value):
+    return isinstance(value, str) and value.startswith(PREFIX)
+
+def new_params(n=1 << 15, r=8, p=1):
+    return {'kdf': 'scrypt', 'salt': base64.b64encode(os.urandom(16)).decode(), 'n': n, 'r': r, 'p': p}
+
+def derive_key(passphrase, params):
+    if params.get('kdf') != 'scrypt':
+        raise ValueError(f"unsupported kdf {params.get('kdf')!r}")
+    n, r, p = params['n'], params['r'], params['p']
+    return hashlib.scrypt(passphrase.encode('utf-8'), salt=base64.b64decode(params['salt']),
+                          n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20), dklen=32)
+
+def _seal(key, field, text):
+    from Crypto.Cipher import ChaCha20_Poly1305
+    nonce = os.urandom(12)
+    c = ChaCha20_Poly1305.new(key=key, nonce=nonce)
+    c.update(field.encode())
+    ct, tag = c.encrypt_and_digest(text.encode('utf-8'))
+    return PREFIX + base64.b64encode(nonce + ct + tag).decode()
+
+def _open(key, field, value):
+    from Crypto.Cipher import ChaCha20_Poly1305
+    raw = base64.b64decode(value[len(PREFIX):])
+    c = ChaCha20_Poly1305.new(key=key, nonce=raw[:12])
+    c.update(field.encode())
+    # ValueError when the key is wrong or the value was tampered with
+    return c.decrypt_and_verify(raw[12:-16], raw[-16:]).decode('utf-8')
+
+class KeyRing:
+    """The unlocked key for one database, with an idle timeout.
+
+    params is the stored KDF configuration (None while encryption is off).
+    derived() caches objects built from opened secrets (decoded Steam Guard
+    keys, signers) until the ring locks; on_lock() listeners are told to
+    drop their own copies.
+    """
+
+    def __init__(self, params=None, idle_timeout=IDLE_TIMEOUT, clock=time.monotonic):
+        self.params = params
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._key = None
+        self._last = 0.0
+        self._derived = {}
+        self._listeners = []
+        self._timer = None
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        return self.params is not None
+
+    @property
+    def unlocked(self):
+        with self._lock:
+            self._expire()
+            return self._key is not None
+
+    def set_params(self, params):
+        """Adopt params read back from the DB; locks if they changed."""
+        with self._lock:
+            if params != self.params:
+                self.params = params
+                self.lock()
+
+    def setup(self, passphrase, **kdf):
+        """Start encrypting with a new key for passphrase; returns the params to store."""
+        params = new_params(**kdf)
+        key = derive_key(passphrase, params)
+        params['check'] = _seal(key, 'check', _CHECK)
+        with self._lock:
+            self.lock()
+            self.params = params
+            self._set_key(key)
+        return params
+
+    def unlock(self, passphrase):
+        """Derive the key (the one slow step) and keep it until lock or idle timeout."""
+        if self.params is None:
+            raise Locked('encryption is not enabled')
+        key = derive_key(passphrase, self.params)
+        try:
+            ok = _open(key, 'check', self.params['check']) == _CHECK
+        except ValueError:
+            ok = False
+        if not ok:
+            raise BadPassphrase('wrong passphrase')
+        with self._lock:
+            self._set_key(key)
+
+    def lock(self):
+        with self._lock:
+            was = self._key is not None
+            self._key = None
+            self._derived = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            listeners = [ref() for ref in self._listeners]
+            self._listeners = [ref for ref, fn in zip(self._listeners, listeners) if fn is not None]
+        if was:
+            for fn in listeners:
+                if fn is not None:
+                    fn()
+
+    def on_lock(self, method):
+        """Call method (a bound method, held weakly) whenever the ring locks."""
+        with self._lock:
+            self._listeners.append(weakref.WeakMethod(method))
+
+    def seal(self, field, value):
+        """value sealed for field; unchanged when encryption is off, empty or already sealed."""
+        if self.params is None or not value or is_sealed(value):
+            return value
+        return _seal(self._use(), field, value)
+
+    def open(self, field, value):
+        """Plaintext of value; plaintext passes through. Raises Locked."""
+        if not is_sealed(value):
+            return value
+        return _open(self._use(), field, value)
+
+    def derived(self, field, value, factory):
+        """factory(plaintext) for value, built once per unlock."""
+        if not is_sealed(value):
+            return factory(value)
+        with self._lock:
+            key = self._use()
+            obj = self._derived.get((field, value))
+            if obj is None:
+                obj = self._derived[(field, value)] = factory(_open(key, field, value))
+            return obj
+
+    def _use(self):
+        with self._lock:
+            self._expire()
+            if self._key is None:
+                raise Locked('keyring is locked')
+            self._last = self.clock()
+            return self._key
+
+    def _set_key(self, key):
+        self._key = key
+        self._last = self.clock()
+        self._schedule(self.idle_timeout)
+
+    def _expire(self):
+        if self._key is not None and self.idle_timeout and self.clock() - self._last >= self.idle_timeout:
+            self.lock()
+
+    def _schedule(self, delay):
+        if not self.idle_timeout:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._key is None:
+                return
+            idle = self.clock() - self._last
+            if idle < self.idle_timeout:
+                self._schedule(self.idle_timeout - idle)
+                return
+        self.lock()
+
+def unlock_interactive(ring):
+    """Unlock ring for a CLI run: STEAM_AUTH_PASSPHRASE, else a prompt.
+    No-op when encryption is off or the ring is already unlocked."""
+    if not ring.enabled or ring.unlocked:
+        return
+    ring.unlock(os.environ.get('STEAM_AUTH_PASSPHRASE') or getpass.getpass('Passphrase: '))
+
+def _reseal_mafiles(paths, transform, store, progress):
+    """Apply transform(field, value) to the secret fields of every maFile in paths."""
+    done = 0
+    for path in paths:
+        done += 1
+        if not path or not store.exists(path):
+            continue
+        try:
+            data = store.load(path)
+        except ValueError:
+            continue
+        # the loaded dict is shared with other readers: change a copy
+        sealed = dict(data)
+        for field in SECRET_FIELDS:
+            v = data.get(field)
+            if v:
+                sealed[field] = transform(field, v)
+        if sealed != data:
+            store.save(path, sealed)
+        if done % 500 == 0:
+            progress('mafiles', done, len(paths))
+    store.flush()
+    progress('mafiles', done, len(paths))
+
+def encrypt_all(db, passphrase, store=None, progress=None):
+    """Seal every account row and maFile of db; returns the number of rows.
+
+    The first run sets up the key for passphrase; later runs unlock with it
+    and seal whatever is still plaintext. Rows are rewritten in one
+    transaction before the maFiles, so an interrupted run can be repeated.
+    """
+    from mafile_store import default_store
+    store = store or default_store
+    report = progress or (lambda stage, done, total: None)
+    ring = db.keyring
+    if ring.enabled:
+        ring.unlock(passphrase)
+    else:
+        params = ring.setup(passphrase)
+        db.set_setting(SETTING, json.dumps(params))
+    rows = db.get_secrets()
+    updates = []
+    for n, (acc_id, *values) in enumerate(rows, start=1):
+        sealed = [ring.seal(f, v) for f, v in zip(SECRET_FIELDS, values)]
+        if sealed != values:
+            updates.append((acc_id, *sealed))
+        if n % 5000 == 0:
+            report('rows', n, len(rows))
+    db.set_secrets(updates)
+    report('rows', len(rows), len(rows))
+    _reseal_mafiles([p for _, _, p in db.get_mafile_paths()], ring.seal, store, report)
+    return len(updates)
+
+def decrypt_all(db, passphrase, store=None, progress=None):
+    """Turn encryption off: write every sealed row and maFile back as plaintext."""
+    from mafile_store import default_store
+    store = store or default_store
+    report = progress or (lambda stage, done, total: None)
+    ring = db.keyring
+    if not ring.enabled:
+        return 0
+    ring.unlock(passphrase)
+    # maFiles first: the key stays in the DB until nothing needs it
+    _reseal_mafiles([p for _, _, p in db.get_mafile_paths()], ring.open, store, report)
+    rows = db.get_secrets()
+    updates = []
+    for acc_id, *values in rows:
+        opened = [ring.open(f, v) for f, v in zip(SECRET_FIELDS, values)]
+        if opened != values:
+            updates.append((acc_id, *opened))
+    db.set_secrets(updates, clear_setting=SETTING)
+    report('rows', len(rows), len(rows))
+    ring.set_params(None)
+    return len(updates)
+
+def main(argv=None):
+    from db import DB_PATH, get_database
+    ap = argparse.ArgumentParser(description='Encrypt or decrypt account secrets at rest.')
+    ap.add_argument('action', choices=('encrypt', 'decrypt'))
+    ap.add_argument('--db', default=DB_PATH)
+    args = ap.parse_args(argv)
+
+    db = get_database(args.db)
+    passphrase = os.environ.get('STEAM_AUTH_PASSPHRASE') or getpass.getpass('Passphrase: ')
+    if args.action == 'encrypt' and not db.keyring.enabled and not os.environ.get('STEAM_AUTH_PASSPHRASE'):
+        if getpass.getpass('Repeat passphrase: ') != passphrase:
+            print('error: passphrases differ', file=sys.stderr)
+            return 1
+
+    def progress(stage, done, total):
+        print(f'\r{stage}: {done}/{total}', end='', file=sys.stderr, flush=True)
+
+    t = time.perf_counter()
+    try:
+        fn = encrypt_all if args.action == 'encrypt' else decrypt_all
+        n = fn(db, passphrase, progress=progress)
+    except BadPassphrase as e:
+        print(f'\nerror: {e}', file=sys.stderr)
+        return 1
+    print(f'\n{args.action}ed {n} accounts in {time.perf_counter() - t:.1f} s')
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
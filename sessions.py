@@ -0,0 +1,105 @@
+import os
+import threading
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+
+from mafile_store import default_store
+
+def pooled_session(pool_maxsize=32, pool_connections=4, keepalive=True, store_cookies=True):
+    """requests.Session with a connection pool of pool_maxsize per host.
+
+    With store_cookies=False the session's jar refuses to store anything,
+    for sessions shared between accounts that pass cookies per request.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    if not keepalive:
+        s.headers['Connection'] = 'close'
+    if not store_cookies:
+        s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return s
+
+class SessionManager:
+    """App-wide HTTP sessions: one pooled session per account cookie jar.
+
+    Sessions are created on first use and their jar is restored from the
+    account's maFile (session_cookies). Cookies changed through
+    update_cookies()/persist() are written back to the maFile. At most
+    max_sessions are kept; the least recently used is closed beyond that.
+    """
+
+    def __init__(self, pool_maxsize=4, pool_connections=2, keepalive=True, max_sessions=256, store=None):
+        self.pool_maxsize = pool_maxsize
+        self.pool_connections = pool_connections
+        self.keepalive = keepalive
+        self.max_sessions = max_sessions
+        self.store = store or default_store
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(account):
+        return account.get('id') if account.get('id') is not None else account.get('account_name')
+
+    def session_for(self, account):
+        key = self._key(account)
+        with self._lock:
+            s = self._sessions.get(key)
+            if s is not None:
+                self._sessions.move_to_end(key)
+                return s
+            s = pooled_session(self.pool_maxsize, self.pool_connections, self.keepalive)
+            s.cookies.update(self._saved_cookies(account))
+            self._sessions[key] = s
+            while len(self._sessions) > self.max_sessions:
+                _, old = self._sessions.popitem(last=False)
+                old.close()
+            return s
+
+    def _saved_cookies(self, account):
+        path = account.get('mafile_path')
+        if not path or not self.store.exists(path):
+            return {}
+        try:
+            return dict(self.store.load(path).get('session_cookies') or {})
+        except Exception:
+            return {}
+
+    def update_cookies(self, account, cookies_dict):
+        """Merge cookies into the account's live session (if any)."""
+        with self._lock:
+            s = self._sessions.get(self._key(account))
+        if s is not None:
+            s.cookies.update(cookies_dict)
+
+    def persist(self, account, names=('steamLoginSecure', 'sessionid', 'steamLogin')):
+        """Write the account session's cookies to its maFile."""
+        path = account.get('mafile_path')
+        if not path or not self.store.exists(path):
+            return False
+        s = self.session_for(account)
+        cookies = {n: s.cookies.get(n) for n in names if s.cookies.get(n)}
+        if not cookies:
+            return False
+        # the loaded dict is shared with other readers: change a copy
+        data = dict(self.store.load(path))
+        data['session_cookies'] = dict(data.get('session_cookies') or {}, **cookies)
+        self.store.save(path, data, defer=False)
+        return True
+
+    def drop(self, account):
+        with self._lock:
+            s = self._sessions.pop(self._key(account), None)
+        if s is not None:
+            s.close()
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for s in sessions:
+            s.close()
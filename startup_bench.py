@@ -0,0 +1,107 @@
+"""Cold-start timing for the app, to catch startup regressions.
+
+Each run is a fresh interpreter that imports Kivy, imports main and calls
+AuthApp.build() without opening a window, and reports the time of each
+step plus which heavy modules were loaded by then.
+
+    python startup_bench.py [--runs 10] [--save baseline.json] [--compare baseline.json] [--tolerance 0.25]
+
+Exits with 1 when a step's median is slower than the baseline by more than
+the tolerance, or when a module in LAZY_MODULES was imported at startup.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# must not be imported until they are first used
+LAZY_MODULES = ('requests', 'Crypto', 'steamguard')
+
+STEPS = ('kivy', 'import_main', 'build', 'total')
+
+_CHILD = r'''
+import os, sys, json, time
+t0 = time.perf_counter()
+os.environ['KIVY_NO_ARGS'] = '1'
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+from kivy.app import App
+t1 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main
+t2 = time.perf_counter()
+main.AuthApp().build()
+t3 = time.perf_counter()
+lazy = sys.argv[2].split(',')
+print(json.dumps({
+    'kivy': (t1 - t0) * 1000,
+    'import_main': (t2 - t1) * 1000,
+    'build': (t3 - t2) * 1000,
+    'total': (t3 - t0) * 1000,
+    'loaded': [m for m in lazy if m in sys.modules],
+}))
+'''
+
+def run_once(root=None):
+    root = root or os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run(
+        [sys.executable, '-c', _CHILD, root, ','.join(LAZY_MODULES)],
+        capture_output=True, text=True, check=True, cwd=root,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def measure(runs=10):
+    """{step: {'median', 'p90', 'min'}} in ms, plus the modules loaded eagerly."""
+    samples = [run_once() for _ in range(runs)]
+    report = {}
+    for step in STEPS:
+        vals = sorted(s[step] for s in samples)
+        report[step] = {
+            'median': statistics.median(vals),
+            'p90': vals[min(len(vals) - 1, int(len(vals) * 0.9))],
+            'min': vals[0],
+        }
+    loaded = sorted({m for s in samples for m in s['loaded']})
+    return report, loaded
+
+def compare(report, baseline, tolerance):
+    """List of (step, baseline ms, current ms) slower than allowed."""
+    slow = []
+    for step in STEPS:
+        if step in baseline:
+            base = baseline[step]['median']
+            cur = report[step]['median']
+            if cur > base * (1 + tolerance):
+                slow.append((step, base, cur))
+    return slow
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Measure cold app startup.')
+    ap.add_argument('--runs', type=int, default=10)
+    ap.add_argument('--save', help='write the medians to this JSON file')
+    ap.add_argument('--compare', help='baseline JSON to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, as a fraction')
+    args = ap.parse_args(argv)
+
+    report, loaded = measure(args.runs)
+    for step in STEPS:
+        r = report[step]
+        print(f"{step:<12} median {r['median']:8.1f} ms   p90 {r['p90']:8.1f} ms   min {r['min']:8.1f} ms")
+    status = 0
+    if loaded:
+        print('loaded at startup: ' + ', '.join(loaded))
+        status = 1
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for step, base, cur in compare(report, baseline, args.tolerance):
+            print(f'regression: {step} {base:.1f} ms -> {cur:.1f} ms')
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+
+QUERY_TIME_URL = 'https://api.steampowered.com/ITwoFactorService/QueryTime/v0001'
+
+def query_steam_time(url=QUERY_TIME_URL, timeout=10, session=None):
+    """Ask Steam for its current time; returns server_time as int."""
+    if session is None:
+        import requests
+        session = requests
+    resp = session.post(url, data={'steamid': '0'}, timeout=timeout)
+    return int(resp.json()['response']['server_time'])
+
+class LocalTime:
+    """Time source with no server alignment (tests, offline use)."""
+
+    def __init__(self, offset=0, clock=time.time):
+        self._offset = int(offset)
+        self.clock = clock
+
+    def offset(self):
+        return self._offset
+
+    def now(self):
+        return int(self.clock()) + self._offset
+
+    def invalidate(self, wait=False):
+        return False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+class SteamTime:
+    """Steam server time offset, shared by every signing path.
+
+    The offset (server - local seconds) is fetched once and cached for ttl
+    seconds. Reads never block: when the cached value is missing or stale a
+    background refresh is started and the last known offset (0 before the
+    first sync) is served meanwhile. After a failed fetch the next one waits
+    retry_base seconds, doubling up to retry_max, however often the offset
+    is read. start() also keeps refreshing it in a daemon thread. fetch is
+    a callable returning server time, replaceable with a stub.
+    """
+
+    def __init__(self, fetch=None, ttl=3600, clock=time.time, retry_base=5.0, retry_max=600.0):
+        self.fetch = fetch or query_steam_time
+        self.ttl = ttl
+        self.clock = clock
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._offset = 0
+        self._synced_at = None
+        # consecutive failed fetches and the earliest time for the next one
+        self._failures = 0
+        self._retry_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sync(self):
+        """Fetch the offset now (blocking); returns it, or the old one on failure."""
+        try:
+            before = self.clock()
+            server = self.fetch()
+            local = (before + self.clock()) / 2
+            with self._lock:
+                self._offset = int(round(server - local))
+                self._synced_at = self.clock()
+                self._failures = 0
+                self._retry_at = 0.0
+        except Exception:
+            with self._lock:
+                self._failures += 1
+                self._retry_at = self.clock() + self._backoff()
+        finally:
+            with self._lock:
+                self._refreshing = False
+        return self._offset
+
+    def _backoff(self):
+        return min(self.retry_max, self.retry_base * 2 ** (self._failures - 1))
+
+    def _refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.sync, name='steam-time', daemon=True).start()
+
+    def offset(self):
+        synced = self._synced_at
+        now = self.clock()
+        if (synced is None or now - synced >= self.ttl) and now >= self._retry_at:
+            self._refresh_async()
+        return self._offset
+
+    def now(self):
+        """Local time aligned to Steam, as int seconds."""
+        return int(self.clock()) + self.offset()
+
+    def invalidate(self, wait=False):
+        """Force a refresh on next use (e.g. after a rejected signature).
+
+        With wait, fetch now instead, unless backing off after failures;
+        returns whether the offset changed.
+        """
+        with self._lock:
+            self._synced_at = None
+            old = self._offset
+            if not wait or self.clock() < self._retry_at:
+                return False
+        return self.sync() != old
+
+    def start(self):
+        """Keep the offset fresh from a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                self.sync()
+                self._stop.wait(self._backoff() if self._failures else self.ttl)
+
+        self._thread = threading.Thread(target=loop, name='steam-time', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+# STEAM_AUTH_LOCAL_TIME=1 signs with the local clock alone (offline use)
+_default = LocalTime() if os.environ.get('STEAM_AUTH_LOCAL_TIME', '') not in ('', '0') else SteamTime()
+
+def get_time_source():
+    return _default
+
+def set_time_source(source):
+    """Replace the process-wide time source (e.g. with LocalTime in tests)."""
+    global _default
+    _default = source
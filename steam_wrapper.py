@@ -1,5 +1,4 @@
 import os
-import json
 import time
 import random
 import string
@@ -7,75 +6,419 @@ import base64
 import struct
 import hmac
 import hashlib
-import requests
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_v1_5
+import functools
+import threading
+# requests, Crypto and steamguard are imported on first use: this module is
+# also loaded for Steam Guard codes alone, at app startup
+from mafile_store import default_store
+from steam_time import get_time_source
+from network import get_network
+from secure_store import Locked, is_sealed
+import metrics
 
 MAFILES_DIR = os.path.join(os.path.dirname(__file__), 'mafiles')
+STEAM_COMMUNITY = 'https://steamcommunity.com'
+
+_mafiles_dir_ready = False
+# False until the import has been attempted, then the module or None
+_steamguard = False
 
 def _ensure_mafiles_dir():
+    global _mafiles_dir_ready
+    if _mafiles_dir_ready:
+        return
     if not os.path.exists(MAFILES_DIR):
         os.makedirs(MAFILES_DIR, exist_ok=True)
+    _mafiles_dir_ready = True
 
-class SteamWrapper:
-    def __init__(self):
-        _ensure_mafiles_dir()
+def _load_steamguard():
+    global _steamguard
+    if _steamguard is False:
         try:
             import steamguard
-            self.sg = steamguard
+            _steamguard = steamguard
         except Exception:
-            self.sg = None
-        self.session = requests.Session()
+            _steamguard = None
+    return _steamguard
+
+def _swallowed(op, e):
+    """Count an error that the caller handles by falling back."""
+    metrics.inc('steam_errors_total', op=op, error=type(e).__name__)
+
+def mafile_path_for(name, acc_id):
+    return os.path.join(MAFILES_DIR, f"{name}_{acc_id}.maFile")
+
+GUARD_CODE_CHARS = '23456789BCDFGHJKMNPQRTVWXY'
+GUARD_CODE_PERIOD = 30
+
+def _decode_secret(secret):
+    try:
+        return base64.b64decode(secret)
+    except Exception:
+        # if not base64, try raw bytes
+        return secret.encode()
+
+def _guard_code(key, window):
+    digest = hmac.digest(key, struct.pack('>Q', window), 'sha1')
+    offset = digest[19] & 0x0F
+    n = struct.unpack('>I', digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    chars = []
+    for _ in range(5):
+        n, r = divmod(n, 26)
+        chars.append(GUARD_CODE_CHARS[r])
+    return ''.join(chars)
+
+class ConfirmationSigner:
+    """Confirmation-key signer for one identity_secret.
+
+    The secret is decoded once and kept as a pre-keyed HMAC-SHA1 that is
+    copied for each signature, so signing skips key setup entirely.
+    """
+
+    __slots__ = ('_mac',)
+
+    def __init__(self, identity_secret):
+        self._mac = hmac.new(_decode_secret(identity_secret), digestmod=hashlib.sha1)
+
+    def sign(self, tag, timestamp):
+        """Return the url-safe base64 key (no padding) for tag at timestamp."""
+        m = self._mac.copy()
+        m.update(struct.pack('>Q', int(timestamp)) + tag.encode())
+        return base64.urlsafe_b64encode(m.digest()).rstrip(b'=').decode()
+
+    def sign_many(self, pairs):
+        """Sign a batch of (tag, timestamp) pairs, e.g. conf/details/allow/cancel for a poll cycle."""
+        return [self.sign(tag, ts) for tag, ts in pairs]
+
+@functools.lru_cache(maxsize=4096)
+def signer_for(identity_secret):
+    """Shared ConfirmationSigner per identity_secret."""
+    return ConfirmationSigner(identity_secret)
+
+class RsaKeyCache:
+    """Steam login RSA keys per username.
+
+    A key is identified by its timestamp and reused until the first login
+    with it is rejected, at most ttl seconds: the timestamp Steam returns
+    names the key but carries no expiry, so ttl is only an upper bound.
+    Ciphers are built once per distinct key.
+    """
+
+    def __init__(self, ttl=600, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._keys = {}
+        self._ciphers = {}
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        """Return (rsatimestamp, cipher) or None when missing/expired."""
+        with self._lock:
+            e = self._keys.get(username)
+            if e is None or self.clock() - e[0] >= self.ttl:
+                return None
+            return e[1], e[2]
+
+    def put(self, username, rsa_info):
+        mod_hex = rsa_info.get('publickey_mod')
+        exp_hex = rsa_info.get('publickey_exp')
+        with self._lock:
+            cipher = self._ciphers.get((mod_hex, exp_hex))
+            if cipher is None:
+                from Crypto.PublicKey import RSA
+                from Crypto.Cipher import PKCS1_v1_5
+                rsa_key = RSA.construct((int(mod_hex, 16), int(exp_hex, 16)))
+                cipher = self._ciphers[(mod_hex, exp_hex)] = PKCS1_v1_5.new(rsa_key)
+            self._keys[username] = (self.clock(), rsa_info.get('timestamp'), cipher)
+            return rsa_info.get('timestamp'), cipher
+
+    def invalidate(self, username):
+        with self._lock:
+            self._keys.pop(username, None)
+
+default_rsa_cache = RsaKeyCache()
+
+class SteamGuardCodes:
+    """Steam Guard login codes for a whole fleet, computed once per 30 s window.
+
+    Secrets are decoded once when registered; codes() computes every
+    account's code in one pass on the first call in a window and serves the
+    cached dict until the window rolls over. loader, if given, is a callable
+    returning (acc_id, shared_secret) pairs, used on first access.
+
+    Sealed secrets (secure_store) are opened through keyring only when a
+    code is asked for: code() opens just that account, codes() every one.
+    They yield no code while the keyring is locked, and are forgotten again
+    when it locks.
+    """
+
+    def __init__(self, loader=None, time_source=None, keyring=None):
+        self._loader = loader
+        # None means the process-wide Steam-aligned time source
+        self.time_source = time_source
+        self.keyring = keyring
+        self._keys = {}
+        self._window = None
+        self._codes = {}
+        # acc_id -> sealed secret, not opened yet / already opened into _keys
+        self._sealed = {}
+        self._opened = {}
+        self._relock = False
+        self._lock = threading.Lock()
+        if keyring is not None:
+            keyring.on_lock(self._on_lock)
+
+    def _ensure_loaded(self):
+        if self._loader is None:
+            return
+        with self._lock:
+            # other threads wait here until the first load is complete
+            if self._loader is not None:
+                self._load_locked(self._loader())
+                self._loader = None
+
+    def load(self, pairs):
+        with self._lock:
+            self._load_locked(pairs)
+
+    def set_secret(self, acc_id, shared_secret):
+        self.load(((acc_id, shared_secret),))
+
+    def _load_locked(self, pairs):
+        # copy-on-write, as in _open_locked: readers keep the dicts they got
+        keys, codes = dict(self._keys), dict(self._codes)
+        for acc_id, shared_secret in pairs:
+            self._opened.pop(acc_id, None)
+            if is_sealed(shared_secret):
+                self._sealed[acc_id] = shared_secret
+                keys.pop(acc_id, None)
+            elif shared_secret:
+                self._sealed.pop(acc_id, None)
+                keys[acc_id] = _decode_secret(shared_secret)
+            else:
+                self._sealed.pop(acc_id, None)
+                keys.pop(acc_id, None)
+            codes.pop(acc_id, None)
+            if self._window is not None and acc_id in keys:
+                codes[acc_id] = _guard_code(keys[acc_id], self._window)
+        self._keys, self._codes = keys, codes
+
+    def remove(self, acc_id):
+        with self._lock:
+            keys, codes = dict(self._keys), dict(self._codes)
+            keys.pop(acc_id, None)
+            codes.pop(acc_id, None)
+            self._sealed.pop(acc_id, None)
+            self._opened.pop(acc_id, None)
+            self._keys, self._codes = keys, codes
+
+    def _on_lock(self):
+        # called by the keyring, possibly on its timer thread: only flag it
+        self._relock = True
+
+    def _open(self, acc_ids):
+        """Move sealed secrets of acc_ids (None: all) into _keys while the keyring is unlocked."""
+        if not self._relock and not self._sealed:
+            return
+        with self._lock:
+            self._open_locked(acc_ids)
+
+    def _open_locked(self, acc_ids):
+        # copy-on-write: codes() hands its dict out to other threads
+        keys, codes = self._keys, self._codes
+        if self._relock:
+            self._relock = False
+            keys, codes = dict(keys), dict(codes)
+            for acc_id, sealed in self._opened.items():
+                keys.pop(acc_id, None)
+                codes.pop(acc_id, None)
+                self._sealed[acc_id] = sealed
+            self._opened = {}
+        if self._sealed and self.keyring is not None and (acc_ids is not None or self.keyring.unlocked):
+            opened = {}
+            for acc_id in (list(self._sealed) if acc_ids is None else acc_ids):
+                sealed = self._sealed.get(acc_id)
+                if sealed is None:
+                    continue
+                try:
+                    opened[acc_id] = _decode_secret(self.keyring.open('shared_secret', sealed))
+                except Locked:
+                    break
+                self._opened[acc_id] = self._sealed.pop(acc_id)
+            if opened:
+                keys = dict(keys) if keys is self._keys else keys
+                keys.update(opened)
+                if self._window is not None:
+                    codes = dict(codes) if codes is self._codes else codes
+                    codes.update((a, _guard_code(k, self._window)) for a, k in opened.items())
+        self._keys, self._codes = keys, codes
+
+    def _now(self):
+        return (self.time_source or get_time_source()).now()
+
+    def window(self, timestamp=None):
+        return int(self._now() if timestamp is None else timestamp) // GUARD_CODE_PERIOD
+
+    def seconds_left(self, timestamp=None):
+        t = int(self._now() if timestamp is None else timestamp)
+        return GUARD_CODE_PERIOD - t % GUARD_CODE_PERIOD
+
+    def codes(self, timestamp=None):
+        """Return {acc_id: code} for the window containing timestamp."""
+        self._ensure_loaded()
+        self._open(None)
+        return self._codes_for(timestamp)
+
+    def _codes_for(self, timestamp):
+        w = self.window(timestamp)
+        if w == self._window:
+            return self._codes
+        with self._lock:
+            if w != self._window:
+                if timestamp is not None and self._window is not None and w < self._window:
+                    # historical window: compute without replacing the cache
+                    return {a: _guard_code(k, w) for a, k in self._keys.items()}
+                self._codes = {a: _guard_code(k, w) for a, k in self._keys.items()}
+                self._window = w
+            return self._codes
+
+    def code(self, acc_id, timestamp=None):
+        self._ensure_loaded()
+        self._open((acc_id,))
+        return self._codes_for(timestamp).get(acc_id)
+
+class SteamWrapper:
+    def __init__(self, store=None, history=None, session=None, base_url=STEAM_COMMUNITY, timeout=10, sessions=None, time_source=None, network=None, rsa_cache=None, keyring=None):
+        _ensure_mafiles_dir()
+        # parsed maFiles are served from the shared cache
+        self.store = store or default_store
+        # handled confirmations are appended here (a db.Database) instead of the maFile
+        self.history = history
+        # created on first request when not given
+        self._default_session = session
+        # optional sessions.SessionManager: per-account pooled sessions
+        self.sessions = sessions
+        # Steam-aligned clock for signatures; None means steam_time's default
+        self.time_source = time_source
+        # rate limits, retries and breakers; None means network's shared layer
+        self.network = network
+        self.rsa_cache = rsa_cache or default_rsa_cache
+        # secure_store.KeyRing for sealed secrets; None means history's
+        self._keyring = keyring
+        # overridable so the network paths can run against a local stub server
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    @property
+    def sg(self):
+        return _load_steamguard()
+
+    @property
+    def keyring(self):
+        if self._keyring is None and self.history is not None:
+            self._keyring = self.history.keyring
+        return self._keyring
+
+    def _reveal(self, field, value):
+        """Plaintext of a secret that may be sealed; raises secure_store.Locked."""
+        if not is_sealed(value):
+            return value
+        if self.keyring is None:
+            raise Locked('no keyring for sealed secrets')
+        return self.keyring.open(field, value)
+
+    def _seal(self, field, value):
+        return self.keyring.seal(field, value) if self.keyring is not None else value
+
+    @property
+    def session(self):
+        if self._default_session is None:
+            import requests
+            self._default_session = requests.Session()
+        return self._default_session
+
+    @session.setter
+    def session(self, value):
+        self._default_session = value
+
+    def _now(self):
+        return (self.time_source or get_time_source()).now()
+
+    def _resync(self):
+        """Refetch the Steam time offset; True if it moved (worth re-signing)."""
+        return (self.time_source or get_time_source()).invalidate(wait=True)
+
+    @staticmethod
+    def _rejected(j):
+        # Steam answers a bad signature with success false; needauth means
+        # an expired session, which no clock fix will help
+        return isinstance(j, dict) and not j.get('success') and not j.get('needauth')
+
+    def _request(self, account, method, url, endpoint, **kwargs):
+        net = self.network or get_network()
+        key = account.get('id') if account.get('id') is not None else account.get('account_name')
+        return net.request(self._session(account), method, url, endpoint=endpoint, account_key=key, **kwargs)
+
+    def _session(self, account):
+        if self.sessions is not None and account:
+            return self.sessions.session_for(account)
+        return self.session
 
     def _randstr(self, n=16):
         return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(n))
 
-    def create_mafile(self, account):
+    @metrics.instrumented('steam_op', op='create_mafile')
+    def create_mafile(self, account, demo_confirmations=True):
         # account: dict with keys id, account_name, password, shared_secret
+        # demo_confirmations: seed the local confirmation simulation
         name = account.get('account_name')
         shared = account.get('shared_secret') or ''
         data = {
             'account_name': name,
-            'shared_secret': shared,
-            'identity_secret': account.get('identity_secret', ''),
+            'shared_secret': self._seal('shared_secret', shared),
+            'identity_secret': self._seal('identity_secret', account.get('identity_secret', '')),
             'serial_number': self._randstr(12),
             'revocation_code': self._randstr(20),
             'time_created': int(time.time()),
             'uri': '',
+        }
+        if demo_confirmations:
             # local simulation of confirmations
-            'pending_confirmations': [
+            data['pending_confirmations'] = [
                 {'id': 1, 'title': 'Trade 1', 'time': int(time.time())},
                 {'id': 2, 'title': 'Login 2', 'time': int(time.time())}
-            ],
-            'confirmed_history': []
-        }
+            ]
         # if steamguard lib provides helpers, try to use them (best-effort)
         if self.sg:
             try:
                 # some versions might provide helpers to build mafile bytes
-                if hasattr(self.sg, 'generate_mafile_bytes'):
+                # it would write the secret in plaintext
+                if hasattr(self.sg, 'generate_mafile_bytes') and not (self.keyring and self.keyring.enabled):
                     content = self.sg.generate_mafile_bytes(shared)
-                    path = os.path.join(MAFILES_DIR, f"{name}_{account.get('id')}.maFile")
+                    path = mafile_path_for(name, account.get('id'))
                     with open(path, 'wb') as f:
                         f.write(content)
                     return path
-            except Exception:
-                pass
+            except Exception as e:
+                _swallowed('create_mafile', e)
 
         # fallback: write JSON mafile
-        path = os.path.join(MAFILES_DIR, f"{name}_{account.get('id')}.maFile")
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        path = mafile_path_for(name, account.get('id'))
+        self.store.save(path, data, defer=False)
         return path
 
     def import_mafile(self, path):
         # read JSON (best-effort)
-        with open(path, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-                return data
-            except Exception:
-                return None
+        try:
+            return self.store.load(path)
+        except ValueError:
+            return None
+
+    def _history(self):
+        if self.history is None:
+            from db import get_database
+            self.history = get_database()
+        return self.history
 
     def _generate_confirmation_key(self, identity_secret, tag, timestamp=None):
         """Generate Steam mobile confirmation key (HMAC-SHA1) as used by SDA.
@@ -85,18 +428,24 @@ class SteamWrapper:
         if not identity_secret:
             raise ValueError('identity_secret required')
         if timestamp is None:
-            timestamp = int(time.time())
-        try:
-            key = base64.b64decode(identity_secret)
-        except Exception:
-            # if not base64, try raw bytes
-            key = identity_secret.encode()
-        data = struct.pack('>Q', int(timestamp)) + tag.encode()
-        digest = hmac.new(key, data, hashlib.sha1).digest()
-        b64 = base64.b64encode(digest).decode()
-        # make url-safe and strip padding
-        safe = b64.replace('+', '-').replace('/', '_').rstrip('=')
-        return safe
+            timestamp = self._now()
+        return self._signer(identity_secret).sign(tag, timestamp)
+
+    def _signer(self, identity_secret):
+        if not is_sealed(identity_secret):
+            return signer_for(identity_secret)
+        if self.keyring is None:
+            raise Locked('no keyring for sealed secrets')
+        # opened once per unlock, dropped when the keyring locks
+        return self.keyring.derived('identity_secret', identity_secret, ConfirmationSigner)
+
+    def generate_guard_code(self, shared_secret, timestamp=None):
+        """Generate the 5-character Steam Guard login code for shared_secret."""
+        if not shared_secret:
+            raise ValueError('shared_secret required')
+        if timestamp is None:
+            timestamp = self._now()
+        return _guard_code(_decode_secret(self._reveal('shared_secret', shared_secret)), int(timestamp) // GUARD_CODE_PERIOD)
 
     def set_session_cookies(self, account, cookies_dict):
         """Save session cookies (e.g., steamLoginSecure, sessionid) into mafile or provided account dict.
@@ -104,52 +453,60 @@ class SteamWrapper:
         cookies_dict should be a dict mapping cookie names to values.
         """
         path = account.get('mafile_path') or account.get('path')
-        if not path or not os.path.exists(path):
+        if not path or not self.store.exists(path):
             raise FileNotFoundError('mafile not found')
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        data.setdefault('session_cookies', {}).update(cookies_dict)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # the loaded dict is shared with other readers: change a copy
+        data = dict(self.store.load(path))
+        data['session_cookies'] = dict(data.get('session_cookies') or {}, **cookies_dict)
+        self.store.save(path, data, defer=False)
+        if self.sessions is not None:
+            self.sessions.update_cookies(account, cookies_dict)
         return True
 
-    def _get_rsa_key(self, username):
+    def _get_rsa_key(self, username, account=None):
         """Request RSA public key from Steam for username."""
-        url = 'https://steamcommunity.com/login/getrsakey/'
+        url = self.base_url + '/login/getrsakey/'
         headers = {'User-Agent': 'Python/requests'}
         try:
-            resp = self.session.post(url, data={'username': username}, headers=headers, timeout=10)
+            # a read despite being a POST, so safe to retry
+            resp = self._request(account or {'account_name': username}, 'POST', url, 'login/getrsakey',
+                                 data={'username': username}, headers=headers, timeout=self.timeout, idempotent=True)
             j = resp.json()
             if j.get('success'):
                 return j
-        except Exception:
+        except Exception as e:
+            _swallowed('getrsakey', e)
             return None
         return None
 
-    def web_login(self, account, username, password, emailauth=None, twofactor=None, remember_login=True):
+    @metrics.instrumented('steam_op', op='login_session')
+    def login_session(self, account, username, password, emailauth=None, twofactor=None, remember_login=True):
         """
-        Perform web login to Steam: getrsakey -> encrypt password -> dologin.
-        On success, saves session cookies and steamid into mafile and returns response JSON.
+        Perform web login to Steam: getrsakey -> encrypt password -> dologin,
+        without saving anything. The RSA key is reused from the cache while valid.
+        Returns (response JSON, cookies dict, steamid or None).
         """
-        rsa_info = self._get_rsa_key(username)
-        if not rsa_info:
-            return {'success': False, 'message': 'Failed to get RSA key'}
-
-        mod_hex = rsa_info.get('publickey_mod')
-        exp_hex = rsa_info.get('publickey_exp')
-        ts = rsa_info.get('timestamp')
         try:
-            mod_int = int(mod_hex, 16)
-            exp_int = int(exp_hex, 16)
-            rsa_key = RSA.construct((mod_int, exp_int))
-        except Exception:
-            return {'success': False, 'message': 'Invalid RSA key'}
+            password = self._reveal('password', password)
+        except Locked:
+            return {'success': False, 'message': 'Secrets are locked'}, {}, None
+        session = self._session(account)
+        cached = self.rsa_cache.get(username)
+        if cached is None:
+            rsa_info = self._get_rsa_key(username, account)
+            if not rsa_info:
+                return {'success': False, 'message': 'Failed to get RSA key'}, {}, None
+            try:
+                cached = self.rsa_cache.put(username, rsa_info)
+            except Exception as e:
+                _swallowed('rsa_key', e)
+                return {'success': False, 'message': 'Invalid RSA key'}, {}, None
+        ts, cipher = cached
 
-        cipher = PKCS1_v1_5.new(rsa_key)
         encrypted = cipher.encrypt(password.encode('utf-8'))
         encrypted_b64 = base64.b64encode(encrypted).decode()
 
-        url = 'https://steamcommunity.com/login/dologin/'
+        url = self.base_url + '/login/dologin/'
         data = {
             'username': username,
             'password': encrypted_b64,
@@ -163,44 +520,54 @@ class SteamWrapper:
 
         headers = {'User-Agent': 'Mozilla/5.0'}
         try:
-            resp = self.session.post(url, data=data, headers=headers, timeout=10)
+            resp = self._request(account, 'POST', url, 'login/dologin', data=data, headers=headers, timeout=self.timeout)
             j = resp.json()
         except Exception as e:
-            return {'success': False, 'message': 'Login request failed', 'error': str(e)}
+            _swallowed('dologin', e)
+            return {'success': False, 'message': 'Login request failed', 'error': str(e)}, {}, None
 
-        # on success, store cookies and steamid if available
-        if j.get('success'):
-            cookies = {}
-            for name in ('steamLoginSecure', 'sessionid', 'steamLogin'):
-                v = self.session.cookies.get(name)
-                if v:
-                    cookies[name] = v
-            # try extract steamid
-            steamid = None
-            tp = j.get('transfer_parameters') or {}
-            steamid = tp.get('steamid') or j.get('steamid')
-
-            # update mafile
-            path = account.get('mafile_path')
-            if path and os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    data_ma = json.load(f)
-                data_ma['session_cookies'] = data_ma.get('session_cookies', {})
-                data_ma['session_cookies'].update(cookies)
-                if steamid:
-                    data_ma['steamid'] = steamid
-                with open(path, 'w', encoding='utf-8') as f:
-                    json.dump(data_ma, f, ensure_ascii=False, indent=2)
-            return j
+        if not j.get('success'):
+            # any rejection may mean a rotated key; fetch a fresh one next time
+            self.rsa_cache.invalidate(username)
+            return j, {}, None
 
+        cookies = {}
+        for name in ('steamLoginSecure', 'sessionid', 'steamLogin'):
+            v = session.cookies.get(name)
+            if v:
+                cookies[name] = v
+        # try extract steamid
+        tp = j.get('transfer_parameters') or {}
+        steamid = tp.get('steamid') or j.get('steamid')
+        return j, cookies, steamid
+
+    def save_login(self, account, cookies, steamid, defer=False):
+        """Store session cookies and steamid into the account's maFile."""
+        path = account.get('mafile_path')
+        if not path or not self.store.exists(path):
+            return False
+        data_ma = dict(self.store.load(path))
+        data_ma['session_cookies'] = dict(data_ma.get('session_cookies') or {}, **cookies)
+        if steamid:
+            data_ma['steamid'] = steamid
+        self.store.save(path, data_ma, defer=defer)
+        return True
+
+    def web_login(self, account, username, password, emailauth=None, twofactor=None, remember_login=True):
+        """
+        Perform web login to Steam: getrsakey -> encrypt password -> dologin.
+        On success, saves session cookies and steamid into mafile and returns response JSON.
+        """
+        j, cookies, steamid = self.login_session(account, username, password, emailauth, twofactor, remember_login)
+        if j.get('success'):
+            self.save_login(account, cookies, steamid)
         return j
 
-    def fetch_confirmations(self, account):
-        # Prefer real Steam mobileconf API when session cookies and identity_secret available.
+    def _auth_context(self, account):
+        """Return (path, maFile data, identity, serial, steamid, cookies) for account."""
         path = account.get('mafile_path')
-        if path and os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+        if path and self.store.exists(path):
+            data = self.store.load(path)
         else:
             data = {}
 
@@ -208,78 +575,92 @@ class SteamWrapper:
         serial = data.get('serial_number') or account.get('serial_number')
         steamid = data.get('steamid') or account.get('steamid')
         cookies = data.get('session_cookies') or {}
+        return path, data, identity, serial, steamid, cookies
+
+    @staticmethod
+    def _has_session(identity, steamid, cookies):
+        return bool(identity and steamid and cookies.get('steamLoginSecure') and cookies.get('sessionid'))
+
+    @metrics.instrumented('steam_op', op='fetch_confirmations')
+    def fetch_confirmations(self, account, timeout=None):
+        # Prefer real Steam mobileconf API when session cookies and identity_secret available.
+        path, data, identity, serial, steamid, cookies = self._auth_context(account)
 
         # If we have session cookies and identity_secret, try real API
-        if identity and steamid and cookies.get('steamLoginSecure') and cookies.get('sessionid'):
+        if self._has_session(identity, steamid, cookies):
             try:
-                t = int(time.time())
-                k = self._generate_confirmation_key(identity, 'conf', t)
-                params = {
-                    'p': serial or '',
-                    'a': steamid,
-                    'k': k,
-                    't': t,
-                    'tag': 'conf'
-                }
-                url = 'https://steamcommunity.com/mobileconf/conf'
+                url = self.base_url + '/mobileconf/conf'
                 headers = {
-                    'Referer': 'https://steamcommunity.com/mobileauth',
+                    'Referer': self.base_url + '/mobileauth',
                     'User-Agent': 'Mozilla/5.0'
                 }
-                resp = self.session.get(url, params=params, headers=headers, cookies=cookies, timeout=10)
-                # try parse JSON
-                try:
-                    j = resp.json()
-                    if 'conf' in j:
-                        return j['conf']
-                    # some responses may embed html; fallback below
-                except Exception:
-                    pass
+                for attempt in range(2):
+                    t = self._now()
+                    k = self._generate_confirmation_key(identity, 'conf', t)
+                    params = {
+                        'p': serial or '',
+                        'a': steamid,
+                        'k': k,
+                        't': t,
+                        'tag': 'conf'
+                    }
+                    # identical refreshes of one account share a single request
+                    resp = self._request(account, 'GET', url, 'mobileconf/conf', params=params, headers=headers, cookies=cookies,
+                                         timeout=timeout or self.timeout, coalesce_key=('conf', self.base_url, steamid))
+                    # try parse JSON
+                    try:
+                        j = resp.json()
+                        if 'conf' in j:
+                            return j['conf']
+                        # some responses may embed html; fallback below
+                    except Exception as e:
+                        _swallowed('fetch_confirmations_parse', e)
+                        break
+                    # a rejected key may be clock drift: resync and sign again, once
+                    if attempt or not self._rejected(j) or not self._resync():
+                        break
                 # fallback: return mafile pending_confirmations if exists
-                return data.get('pending_confirmations', [])
-            except Exception:
-                return data.get('pending_confirmations', [])
+                return list(data.get('pending_confirmations', []))
+            except Exception as e:
+                _swallowed('fetch_confirmations', e)
+                return list(data.get('pending_confirmations', []))
 
         # fallback: local mafile-based confirmations
-        return data.get('pending_confirmations', [])
+        return list(data.get('pending_confirmations', []))
 
-    def respond_confirmation(self, account, idx, accept=True):
+    @metrics.instrumented('steam_op', op='respond_confirmation')
+    def respond_confirmation(self, account, idx, accept=True, timeout=None):
         # Prefer real Steam mobileconf API when session cookies and identity_secret available.
-        path = account.get('mafile_path')
-        if path and os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        else:
-            data = {}
-
-        identity = data.get('identity_secret') or account.get('identity_secret') or account.get('identity')
-        serial = data.get('serial_number') or account.get('serial_number')
-        steamid = data.get('steamid') or account.get('steamid')
-        cookies = data.get('session_cookies') or {}
+        path, data, identity, serial, steamid, cookies = self._auth_context(account)
 
-        if identity and steamid and cookies.get('steamLoginSecure') and cookies.get('sessionid'):
+        if self._has_session(identity, steamid, cookies):
             # attempt real API call
             try:
-                t = int(time.time())
-                k = self._generate_confirmation_key(identity, 'allow', t) if accept else self._generate_confirmation_key(identity, 'cancel', t)
-                url = 'https://steamcommunity.com/mobileconf/ajaxop'
+                url = self.base_url + '/mobileconf/ajaxop'
+                endpoint = 'mobileconf/ajaxop'
                 headers = {
-                    'Referer': 'https://steamcommunity.com/mobileauth',
+                    'Referer': self.base_url + '/mobileauth',
                     'User-Agent': 'Mozilla/5.0'
                 }
-                data_post = {
-                    'op': 'allow' if accept else 'cancel',
-                    'cid': idx,
-                    'k': k,
-                    't': t
-                }
-                resp = self.session.post(url, data=data_post, headers=headers, cookies=cookies, timeout=10)
-                try:
-                    j = resp.json()
-                    return j.get('success', False)
-                except Exception:
-                    return False
-            except Exception:
+                for attempt in range(2):
+                    t = self._now()
+                    k = self._generate_confirmation_key(identity, 'allow', t) if accept else self._generate_confirmation_key(identity, 'cancel', t)
+                    data_post = {
+                        'op': 'allow' if accept else 'cancel',
+                        'cid': idx,
+                        'k': k,
+                        't': t
+                    }
+                    resp = self._request(account, 'POST', url, endpoint, data=data_post, headers=headers, cookies=cookies, timeout=timeout or self.timeout)
+                    try:
+                        j = resp.json()
+                    except Exception as e:
+                        _swallowed('respond_confirmation_parse', e)
+                        return False
+                    if attempt or not self._rejected(j) or not self._resync():
+                        return j.get('success', False)
+            except Exception as e:
+                _swallowed('respond_confirmation', e)
                 return False
 
         # fallback: local mafile handling
@@ -287,16 +668,88 @@ class SteamWrapper:
             confs = data.get('pending_confirmations', [])
             if idx < 0 or idx >= len(confs):
                 return False
-            item = confs.pop(idx)
-            history = data.get('confirmed_history', [])
+            return self._handle_local(account, path, data, [idx], accept)
+        except Exception as e:
+            _swallowed('respond_confirmation_local', e)
+            return False
+
+    def _handle_local(self, account, path, data, indices, accept):
+        """Move the pending confirmations at sorted indices to the history.
+
+        data is the store's cached dict, shared with other readers, so the
+        change is made on a copy; the history is appended before the maFile
+        is saved, so a failed append leaves both untouched.
+        """
+        data = dict(data)
+        confs = list(data.get('pending_confirmations', []))
+        now = int(time.time())
+        handled = []
+        for i in reversed(indices):
+            item = dict(confs.pop(i))
             item['accepted'] = bool(accept)
-            item['handled_at'] = int(time.time())
-            history.append(item)
-            data['pending_confirmations'] = confs
-            data['confirmed_history'] = history
-            if path:
-                with open(path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+            item['handled_at'] = now
+            handled.append(item)
+        handled.reverse()
+        data['pending_confirmations'] = confs
+        # the maFile keeps only auth data; history (including any legacy
+        # in-file confirmed_history) goes to the append-only log
+        legacy = data.pop('confirmed_history', None) or []
+        self._history().add_confirmation_history(account.get('id'), legacy + handled)
+        if path:
+            # coalesced: a burst of responses is written once
+            self.store.save(path, data)
+        return True
+
+    @metrics.instrumented('steam_op', op='respond_confirmations')
+    def respond_confirmations(self, account, indices, accept=True, confirmations=None, timeout=None):
+        """Accept or decline several confirmations at once.
+
+        indices are positions in the list returned by fetch_confirmations;
+        confirmations is that list, needed by the Steam API path for ids and
+        nonces. Uses one mobileconf/multiajaxop request, or for the local
+        fallback a single maFile update. Returns True on success.
+        """
+        indices = sorted(set(indices))
+        if not indices:
             return True
-        except Exception:
+        path, data, identity, serial, steamid, cookies = self._auth_context(account)
+
+        if self._has_session(identity, steamid, cookies):
+            try:
+                op = 'allow' if accept else 'cancel'
+                ids = []
+                for i in indices:
+                    c = confirmations[i] if confirmations and isinstance(confirmations[i], dict) else {}
+                    ids.append(('cid[]', c.get('id', i)))
+                    ids.append(('ck[]', c.get('nonce') or c.get('key') or ''))
+                url = self.base_url + '/mobileconf/multiajaxop'
+                endpoint = 'mobileconf/multiajaxop'
+                headers = {
+                    'Referer': self.base_url + '/mobileauth',
+                    'User-Agent': 'Mozilla/5.0'
+                }
+                for attempt in range(2):
+                    t = self._now()
+                    k = self._generate_confirmation_key(identity, op, t)
+                    data_post = [('op', op), ('p', serial or ''), ('a', steamid), ('k', k), ('t', t), ('m', 'android'), ('tag', op)] + ids
+                    resp = self._request(account, 'POST', url, endpoint, data=data_post, headers=headers, cookies=cookies, timeout=timeout or self.timeout)
+                    try:
+                        j = resp.json()
+                    except Exception as e:
+                        _swallowed('respond_confirmations_parse', e)
+                        return False
+                    if attempt or not self._rejected(j) or not self._resync():
+                        return j.get('success', False)
+            except Exception as e:
+                _swallowed('respond_confirmations', e)
+                return False
+
+        # fallback: local mafile handling, one history append and one write
+        try:
+            confs = data.get('pending_confirmations', [])
+            if indices[0] < 0 or indices[-1] >= len(confs):
+                return False
+            return self._handle_local(account, path, data, indices, accept)
+        except Exception as e:
+            _swallowed('respond_confirmations_local', e)
             return False
@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import time
+import sqlite3
+
+import pytest
+
+import backup
+from db import Database
+
+ACCOUNTS = 'SELECT id, account_name, password, shared_secret, identity_secret, session_data FROM accounts ORDER BY id'
+HISTORY = 'SELECT * FROM confirmation_history ORDER BY id'
+
+@pytest.fixture
+def env(tmp_path):
+    db_path = str(tmp_path / 'a.db')
+    maf = tmp_path / 'maf'
+    maf.mkdir()
+    db = Database(db_path)
+    db.add_accounts_bulk([{'account_name': f'user{i}', 'password': 'pw', 'shared_secret': 's'} for i in range(300)])
+    for i in range(5):
+        (maf / f'user{i}.maFile').write_text(json.dumps({'n': i}))
+    db.add_confirmation_history(1, [{'id': 1, 'title': 't', 'accepted': True}])
+    yield db, db_path, str(maf), str(tmp_path / 'bk'), tmp_path
+    db.close()
+
+def _rows(path, q):
+    con = sqlite3.connect(path)
+    try:
+        return con.execute(q).fetchall()
+    finally:
+        con.close()
+
+def test_full_incremental_restore_round_trip(env):
+    db, db_path, maf, bk, tmp = env
+    assert backup.create_backup(bk, db_path, maf)['type'] == 'full'
+    db.update_account(5, 'renamed5', 'pw2', 's', 'i')
+    db.delete_account(7)
+    new_id = db.add_account('fresh', 'p', 's')
+    db.add_confirmation_history(2, [{'id': 2, 'title': 'x', 'accepted': False}])
+    time.sleep(0.01)
+    with open(os.path.join(maf, 'user3.maFile'), 'w') as f:
+        f.write('{"changed": 1}')
+    os.remove(os.path.join(maf, 'user4.maFile'))
+    second = backup.create_backup(bk, db_path, maf)
+    assert second['type'] == 'incremental'
+    db.set_session_data(new_id, {'a': 1})
+    assert backup.create_backup(bk, db_path, maf)['type'] == 'incremental'
+    assert len(backup.verify(bk)) == 3
+
+    out = tmp / 'restored'
+    out.mkdir()
+    rdb, rmaf = str(out / 'a.db'), str(out / 'maf')
+    assert backup.restore(bk, rdb, rmaf) == 4
+    assert _rows(rdb, ACCOUNTS) == _rows(db_path, ACCOUNTS)
+    assert _rows(rdb, HISTORY) == _rows(db_path, HISTORY)
+    assert sorted(os.listdir(rmaf)) == sorted(os.listdir(maf))
+    restored = Database(rdb)
+    assert restored.search_accounts('renamed')[0]['id'] == 5
+    restored.close()
+
+    # up to the second backup: without the later session data
+    backup.restore(bk, rdb, rmaf, second['id'])
+    assert _rows(rdb, f'SELECT session_data FROM accounts WHERE id={new_id}') == [(None,)]
+
+def test_archives_are_private(env):
+    _, db_path, maf, bk, _ = env
+    e = backup.create_backup(bk, db_path, maf)
+    assert os.stat(os.path.join(bk, e['file'])).st_mode & 0o777 == 0o600
+
+def test_tampered_archive_is_rejected(env):
+    _, db_path, maf, bk, tmp = env
+    e = backup.create_backup(bk, db_path, maf)
+    path = os.path.join(bk, e['file'])
+    data = bytearray(open(path, 'rb').read())
+    data[len(data) // 2] ^= 1
+    open(path, 'wb').write(data)
+    with pytest.raises(backup.BackupError):
+        backup.verify(bk)
+    with pytest.raises(backup.BackupError):
+        backup.restore(bk, str(tmp / 'r.db'), str(tmp / 'rmaf'))
+    assert not os.path.exists(tmp / 'r.db')
+
+def _journal(path):
+    return _rows(path, 'SELECT COUNT(*) FROM change_journal')[0][0]
+
+def test_journal_is_kept_unless_pruning_is_asked_for(env):
+    db, db_path, maf, bk, _ = env
+    backup.create_backup(bk, db_path, maf)
+    db.update_account(1, 'x', 'p', 's', 'i')
+    backup.create_backup(bk, db_path, maf)
+    assert _journal(db_path) > 0
+
+def test_prune_respects_every_chain(env):
+    db, db_path, maf, bk, tmp = env
+    other = str(tmp / 'other')
+    backup.create_backup(bk, db_path, maf)
+    backup.create_backup(other, db_path, maf)
+    db.update_account(1, 'x', 'p', 's', 'i')
+    backup.create_backup(bk, db_path, maf, prune=True)
+    # the other chain has not seen that update yet
+    assert _journal(db_path) == 1
+    e = backup.create_backup(other, db_path, maf, prune=True)
+    assert e['type'] == 'incremental' and _journal(db_path) == 0
+
+def test_chain_behind_a_prune_goes_full(env):
+    db, db_path, maf, bk, tmp = env
+    stale = str(tmp / 'stale')
+    backup.create_backup(stale, db_path, maf)
+    backup.create_backup(bk, db_path, maf)
+    db.update_account(1, 'x', 'p', 's', 'i')
+    backup.create_backup(bk, db_path, maf)
+    # stale is forgotten: pruning no longer waits for it
+    assert backup.main(['forget', stale, '--db', db_path]) == 0
+    assert not backup.forget_chain(stale, db_path)
+    backup.prune_journal(db)
+    assert backup.create_backup(stale, db_path, maf)['type'] == 'full'
+
+def test_deleted_backup_dir_stops_holding_pruning_back(env):
+    db, db_path, maf, bk, tmp = env
+    gone = str(tmp / 'gone')
+    backup.create_backup(gone, db_path, maf)
+    backup.create_backup(bk, db_path, maf)
+    db.update_account(1, 'x', 'p', 's', 'i')
+    backup.create_backup(bk, db_path, maf, prune=True)
+    assert _journal(db_path) == 1
+    shutil.rmtree(gone)
+    backup.prune_journal(db)
+    assert _journal(db_path) == 0
+    assert list(db.get_settings(backup.CHAIN_MARK)) == [backup.CHAIN_MARK + os.path.abspath(bk)]
@@ -0,0 +1,25 @@
+from bench import compare
+
+def _report(**ops):
+    return {'results': {'sign/1000': {'ops': ops}}}
+
+def _op(p50, p90=None, runs=None):
+    s = {'n': 1000, 'p50': p50, 'p90': p90 if p90 is not None else p50 * 1.1}
+    if runs:
+        s['p50_runs'] = sorted(runs)
+    return s
+
+def test_doubling_of_a_microsecond_op_is_flagged():
+    base = _report(confirmation_key_cached=_op(2.6, 2.9, [2.5, 2.6, 2.7]))
+    slow = compare(_report(confirmation_key_cached=_op(5.2)), base)
+    assert slow == [('sign/1000', 'confirmation_key_cached', 2.6, 5.2)]
+
+def test_jitter_within_tolerance_is_not_flagged():
+    base = _report(count_accounts=_op(5.9, 6.4))
+    assert compare(_report(count_accounts=_op(6.9)), base) == []
+
+def test_noisy_op_gets_its_own_slack():
+    # p50 wandered 9-13 ms across repeats, so 14 ms is within noise
+    base = _report(fetch=_op(9000, 20000, [9000, 11000, 13000]))
+    assert compare(_report(fetch=_op(14000)), base) == []
+    assert compare(_report(fetch=_op(18000)), base) != []
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import socket
+import threading
+import http.client
+
+import pytest
+
+import daemon
+import steam_time
+from steam_time import LocalTime
+
+SECRET = 'c2VjcmV0c2VjcmV0c2VjcmV0'
+TOKEN = 'test-token'
+
+@pytest.fixture
+def local_time():
+    old = steam_time.get_time_source()
+    steam_time.set_time_source(LocalTime())
+    yield
+    steam_time.set_time_source(old)
+
+@pytest.fixture
+def served(tmp_path, local_time):
+    db_path = str(tmp_path / 'a.db')
+    d = daemon.Daemon(db_path)
+    for i in range(3):
+        d.db.add_account(f'acc{i}', 'pw', SECRET)
+    mafile = tmp_path / 'acc0.maFile'
+    mafile.write_text(json.dumps({'account_name': 'acc0', 'shared_secret': SECRET, 'pending_confirmations': [
+        {'id': 1, 'title': 'Trade'}, {'id': 2, 'title': 'Login'}]}))
+    d.db.set_mafile_path(1, str(mafile))
+    d.start()
+    srv = daemon.make_server(d, port=0, token=TOKEN)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    shared = http.client.HTTPConnection('127.0.0.1', srv.server_address[1], timeout=10)
+
+    def call(method, path, body=None, token=TOKEN, content_type='application/json', own_connection=False):
+        conn = http.client.HTTPConnection('127.0.0.1', srv.server_address[1], timeout=10) if own_connection else shared
+        headers = {}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        if content_type:
+            headers['Content-Type'] = content_type
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        conn.request(method, path, body=body, headers=headers)
+        r = conn.getresponse()
+        result = r.status, json.loads(r.read())
+        if own_connection:
+            conn.close()
+        return result
+
+    yield d, call
+    shared.close()
+    srv.shutdown()
+    srv.server_close()
+    d.stop()
+
+def test_tcp_listener_needs_a_token(tmp_path, local_time):
+    with pytest.raises(ValueError):
+        daemon.make_server(daemon.Daemon(str(tmp_path / 'a.db')), port=0)
+
+def test_auth_and_content_type(served):
+    _, call = served
+    assert call('GET', '/health', token=None) == (200, {'ok': True, 'locked': False})
+    assert call('GET', '/codes', token=None)[0] == 401
+    assert call('GET', '/codes', token='wrong')[0] == 401
+    assert call('POST', '/reload', {}, token=None)[0] == 401
+    assert call('POST', '/reload', b'{}', content_type='text/plain')[0] == 415
+    assert call('POST', '/reload', b'{}', content_type=None)[0] == 415
+    assert call('POST', '/reload', {}) == (200, {'ok': True})
+
+def test_codes_and_accounts(served):
+    _, call = served
+    status, body = call('GET', '/codes')
+    assert status == 200 and sorted(body['codes']) == ['1', '2', '3']
+    assert all(len(c) == 5 for c in body['codes'].values())
+    assert 0 < body['seconds_left'] <= 30
+    assert call('GET', '/accounts/2/code')[1]['code'] == body['codes']['2']
+    assert call('GET', '/accounts/99/code')[0] == 404
+    status, body = call('GET', '/accounts?start=2&limit=1')
+    assert status == 200 and body == {'accounts': [{'id': 2, 'account_name': 'acc1'}], 'total': 3}
+    assert call('GET', '/accounts?start=x')[0] == 400
+
+def test_confirmations_are_matched_against_a_fresh_fetch(served):
+    _, call = served
+    assert call('GET', '/accounts/1/confirmations')[1]['confirmations'][1]['id'] == 2
+    assert call('POST', '/accounts/1/confirmations', {'indices': [0]})[0] == 400
+    status, body = call('POST', '/accounts/1/confirmations', {'confirmations': [{'id': 7}]})
+    assert status == 409 and body['missing'] == ['7']
+    assert call('POST', '/accounts/1/confirmations', {'confirmations': [{'id': 2}], 'accept': True}) == (200, {'success': True})
+    # already handled: rejected instead of acting on whatever is at its old position
+    assert call('POST', '/accounts/1/confirmations', {'confirmations': [{'id': 2}]})[0] == 409
+    assert call('GET', '/accounts/1/confirmations?refresh=1')[1]['confirmations'] == [{'id': 1, 'title': 'Trade'}]
+
+def test_concurrent_posts_act_on_a_confirmation_once(served):
+    d, call = served
+    fetch_one = d.poller.fetch_one
+
+    def slow_fetch(acc):
+        # widen the window between fetching and responding
+        result = fetch_one(acc)
+        time.sleep(0.02)
+        return result
+    d.poller.fetch_one = slow_fetch
+    statuses = []
+
+    def post():
+        statuses.append(call('POST', '/accounts/1/confirmations', {'confirmations': [{'id': 1}]}, own_connection=True)[0])
+    threads = [threading.Thread(target=post) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(statuses) == [200] + [409] * 5
+    # the confirmation after it was left alone
+    assert call('GET', '/accounts/1/confirmations?refresh=1')[1]['confirmations'] == [{'id': 2, 'title': 'Login'}]
+
+def test_match_requires_the_nonce_when_known():
+    current = [{'id': '5', 'nonce': 'n5'}, {'id': '6'}]
+    assert daemon._match_confirmations(current, [('5', 'n5'), ('6', None)]) == ([0, 1], [])
+    assert daemon._match_confirmations(current, [('5', 'bad'), ('9', None)]) == ([], ['5', '9'])
+
+def test_unlock_and_lock(served):
+    from secure_store import encrypt_all
+    d, call = served
+    encrypt_all(d.db, 'pass')
+    d.db.keyring.lock()
+    assert call('POST', '/reload', {})[0] == 200
+    assert call('GET', '/health', token=None)[1]['locked'] is True
+    assert call('GET', '/codes')[1]['codes'] == {}
+    assert call('POST', '/unlock', {'passphrase': 'nope'})[0] == 403
+    assert call('POST', '/unlock', {'passphrase': 'pass'})[0] == 200
+    assert len(call('GET', '/codes')[1]['codes']) == 3
+    assert call('POST', '/lock', {})[0] == 200
+    assert call('GET', '/accounts/1/code')[1]['code'] is None
+
+def test_unix_socket_is_owner_only(tmp_path, local_time):
+    d = daemon.Daemon(str(tmp_path / 'a.db'))
+    path = str(tmp_path / 'd.sock')
+    srv = daemon.make_server(d, unix=path)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        s = socket.socket(socket.AF_UNIX)
+        s.connect(path)
+        # no bearer token on the socket
+        s.sendall(b'GET /accounts HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+        assert s.recv(100).split(b'\r\n')[0].endswith(b' 200 OK')
+        s.close()
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+def test_load_token(tmp_path, monkeypatch):
+    monkeypatch.delenv('STEAM_AUTH_TOKEN', raising=False)
+    path = str(tmp_path / 'daemon.token')
+    token = daemon.load_token(path)
+    assert len(token) > 20 and os.stat(path).st_mode & 0o777 == 0o600
+    assert daemon.load_token(path) == token
+    monkeypatch.setenv('STEAM_AUTH_TOKEN', 'from-env')
+    assert daemon.load_token(path) == 'from-env'
+
+def test_concurrent_first_codes_calls_see_every_account():
+    import base64
+    from steam_wrapper import SteamGuardCodes
+    pairs = [(i, base64.b64encode(i.to_bytes(20, 'big')).decode()) for i in range(5000)]
+    codes = SteamGuardCodes(loader=lambda: pairs, time_source=LocalTime())
+    sizes, errors = [], []
+    barrier = threading.Barrier(8)
+
+    def first_call():
+        barrier.wait()
+        try:
+            sizes.append(len(codes.codes()))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=first_call) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and sizes == [5000] * 8
@@ -0,0 +1,85 @@
+import os
+import json
+
+import pytest
+
+import steam_wrapper
+from db import Database
+from importer import import_accounts
+from mafile_store import MaFileStore
+from secure_store import encrypt_all, is_sealed
+
+SHARED = 'c2hhcmVkc2VjcmV0c2hhcmVk'
+IDENTITY = 'aWRlbnRpdHlzZWNyZXRpZGVu'
+
+@pytest.fixture
+def mafiles_dir(tmp_path, monkeypatch):
+    d = tmp_path / 'mafiles'
+    d.mkdir()
+    monkeypatch.setattr(steam_wrapper, 'MAFILES_DIR', str(d))
+    return d
+
+@pytest.fixture
+def encrypted_db(tmp_path):
+    db = Database(str(tmp_path / 'a.db'))
+    encrypt_all(db, 'pass', store=MaFileStore())
+    yield db
+    db.close()
+
+def _source_dir(tmp_path, n=3):
+    src = tmp_path / 'src'
+    src.mkdir()
+    for i in range(n):
+        (src / f'user{i}.maFile').write_text(json.dumps({
+            'account_name': f'user{i}', 'shared_secret': SHARED, 'identity_secret': IDENTITY,
+            'serial_number': str(i)}))
+    return src
+
+def _plaintext_on_disk(root):
+    found = []
+    for dirpath, _, names in os.walk(root):
+        for n in names:
+            with open(os.path.join(dirpath, n), 'rb') as f:
+                body = f.read()
+            if SHARED.encode() in body or IDENTITY.encode() in body:
+                found.append(n)
+    return found
+
+def test_directory_import_into_encrypted_db_seals_copies(tmp_path, mafiles_dir, encrypted_db):
+    src = _source_dir(tmp_path)
+    store = MaFileStore()
+    res = import_accounts(str(src), db=encrypted_db, store=store)
+    assert res['imported'] == 3
+    # nothing the DB points at, and nothing in the DB, holds a plaintext secret
+    assert _plaintext_on_disk(mafiles_dir) == []
+    for suffix in ('', '-wal'):
+        if os.path.exists(encrypted_db.path + suffix):
+            assert SHARED.encode() not in open(encrypted_db.path + suffix, 'rb').read()
+    ring = encrypted_db.keyring
+    for acc_id, name, path in encrypted_db.get_mafile_paths():
+        assert os.path.dirname(path) == str(mafiles_dir)
+        data = json.load(open(path))
+        assert is_sealed(data['shared_secret']) and is_sealed(data['identity_secret'])
+        assert ring.open('shared_secret', data['shared_secret']) == SHARED
+        assert data['serial_number'] == name[-1]
+    # the user's source files are left alone
+    assert json.load(open(src / 'user0.maFile'))['shared_secret'] == SHARED
+
+def test_directory_import_into_plain_db_keeps_source_paths(tmp_path, mafiles_dir):
+    src = _source_dir(tmp_path, 2)
+    db = Database(str(tmp_path / 'plain.db'))
+    import_accounts(str(src), db=db)
+    assert sorted(p for _, _, p in db.get_mafile_paths()) == sorted(str(p) for p in src.iterdir())
+    assert list(mafiles_dir.iterdir()) == []
+    db.close()
+
+def test_csv_import_writes_maFiles_without_demo_confirmations(tmp_path, mafiles_dir):
+    src = tmp_path / 'accounts.csv'
+    src.write_text('account_name,password,shared_secret\nalpha,pw,' + SHARED + '\nbeta,pw,' + SHARED + '\n')
+    db = Database(str(tmp_path / 'csv.db'))
+    assert import_accounts(str(src), db=db)['imported'] == 2
+    for _, name, path in db.get_mafile_paths():
+        data = json.load(open(path))
+        assert data['account_name'] == name and data['shared_secret'] == SHARED
+        assert 'pending_confirmations' not in data
+    db.close()
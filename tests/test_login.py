@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from bench import stub_steam_server
+from db import Database
+from login import FleetLogin
+from mafile_store import MaFileStore
+from network import NetworkLayer
+from sessions import SessionManager
+from steam_time import LocalTime
+from steam_wrapper import RsaKeyCache, SteamWrapper
+
+@pytest.fixture
+def stub():
+    srv, base_url = stub_steam_server()
+    yield srv, base_url
+    srv.shutdown()
+    srv.server_close()
+
+class CountingStore(MaFileStore):
+    def __init__(self):
+        super().__init__(flush_delay=60)
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+        super().flush()
+
+class CountingDatabase(Database):
+    bulk_calls = 0
+
+    def set_session_data_bulk(self, items):
+        self.bulk_calls += 1
+        super().set_session_data_bulk(items)
+
+def _fleet(tmp_path, base_url, n):
+    store = CountingStore()
+    db = CountingDatabase(str(tmp_path / 'a.db'))
+    accounts = []
+    for i in range(n):
+        name = f'bot{i}'
+        acc_id = db.add_account(name, f'pw-{name}', None)
+        path = str(tmp_path / f'{name}.maFile')
+        store.save(path, {'account_name': name}, defer=False)
+        db.set_mafile_path(acc_id, path)
+        accounts.append({'id': acc_id, 'account_name': name, 'password': f'pw-{name}', 'mafile_path': path})
+    network = NetworkLayer(global_rate=1e6, global_burst=1e6, account_rate=1e6, account_burst=1e6, backoff_base=0)
+    steam = SteamWrapper(store=store, history=db, base_url=base_url, network=network, time_source=LocalTime(),
+                         sessions=SessionManager(store=store), rsa_cache=RsaKeyCache())
+    return FleetLogin(steam=steam, db=db, max_workers=4), store, db, accounts
+
+def test_batched_relogin_saves_once(tmp_path, stub):
+    srv, base_url = stub
+    fleet, store, db, accounts = _fleet(tmp_path, base_url, 6)
+    # one account with a wrong password
+    accounts[5]['password'] = 'nope'
+    done = []
+    results = fleet.relogin(accounts, progress=lambda n, total: done.append((n, total)))
+    assert [results[a['id']]['success'] for a in accounts] == [True] * 5 + [False], results
+    assert done[-1] == (6, 6)
+    assert srv.calls['/login/dologin/'] == 6
+    # maFiles: one flush for the whole batch, cookies and steamid in each
+    assert store.flushes == 1
+    for acc in accounts[:5]:
+        with open(acc['mafile_path']) as f:
+            data = json.load(f)
+        assert data['session_cookies']['sessionid'] == f"sid-{acc['account_name']}"
+        assert data['steamid'].startswith('7656')
+    with open(accounts[5]['mafile_path']) as f:
+        assert 'session_cookies' not in json.load(f)
+    # DB: one transaction for every successful login
+    assert db.bulk_calls == 1
+    rows = dict(db._db.execute('SELECT id, session_data FROM accounts').fetchall())
+    assert json.loads(rows[accounts[0]['id']])['cookies']['steamLoginSecure'].endswith('token-bot0')
+    assert rows[accounts[5]['id']] is None
+    db.close()
+
+def test_rsa_key_is_cached_and_dropped_on_rejection(tmp_path, stub):
+    srv, base_url = stub
+    fleet, store, db, accounts = _fleet(tmp_path, base_url, 1)
+    acc = accounts[0]
+    steam = fleet.steam
+    assert steam.login_session(acc, 'bot0', acc['password'])[0]['success']
+    assert steam.login_session(acc, 'bot0', acc['password'])[0]['success']
+    assert srv.calls['/login/getrsakey/'] == 1
+    assert not steam.login_session(acc, 'bot0', 'wrong')[0]['success']
+    assert steam.rsa_cache.get('bot0') is None
+    assert steam.login_session(acc, 'bot0', acc['password'])[0]['success']
+    assert srv.calls['/login/getrsakey/'] == 2
+    db.close()
+
+def test_rsa_cache_ttl_is_an_upper_bound():
+    now = [0.0]
+    cache = RsaKeyCache(ttl=10, clock=lambda: now[0])
+    cache._ciphers[('ab', '3')] = object()
+    cache.put('u', {'publickey_mod': 'ab', 'publickey_exp': '3', 'timestamp': '1'})
+    assert cache.get('u')[0] == '1'
+    now[0] = 10
+    assert cache.get('u') is None
+
+def test_saving_cookies_leaves_loaded_dicts_alone(tmp_path):
+    store = MaFileStore(flush_delay=0)
+    path = str(tmp_path / 'a.maFile')
+    store.save(path, {'account_name': 'a', 'session_cookies': {'sessionid': 'old'}})
+    before = store.load(path)
+    steam = SteamWrapper(store=store)
+    steam.save_login({'mafile_path': path}, {'sessionid': 'new'}, '7656')
+    steam.set_session_cookies({'mafile_path': path}, {'steamLoginSecure': 'x'})
+    assert before == {'account_name': 'a', 'session_cookies': {'sessionid': 'old'}}
+    assert store.load(path)['session_cookies'] == {'sessionid': 'new', 'steamLoginSecure': 'x'}
+    with open(path) as f:
+        assert json.load(f)['steamid'] == '7656'
+
+def test_persisting_a_session_leaves_loaded_dicts_alone(tmp_path):
+    store = MaFileStore(flush_delay=0)
+    path = str(tmp_path / 'a.maFile')
+    store.save(path, {'session_cookies': {'sessionid': 'old'}})
+    before = store.load(path)
+    sessions = SessionManager(store=store)
+    acc = {'id': 1, 'mafile_path': path}
+    sessions.session_for(acc).cookies.set('sessionid', 'new')
+    assert sessions.persist(acc)
+    assert before == {'session_cookies': {'sessionid': 'old'}}
+    assert store.load(path)['session_cookies'] == {'sessionid': 'new'}
+    sessions.close()
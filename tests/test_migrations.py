@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+import db as dbmod
+from db import MIGRATIONS, Database
+
+LATEST = MIGRATIONS[-1][0]
+
+def _db_at(path, version):
+    """A DB file migrated by hand up to version, with one account."""
+    con = sqlite3.connect(path)
+    cur = con.cursor()
+    for v, migrate in MIGRATIONS:
+        if v <= version:
+            migrate(cur)
+    cur.execute(f'PRAGMA user_version = {version}')
+    if version:
+        cur.execute("INSERT INTO accounts (account_name, password, shared_secret) VALUES ('old', 'pw', 'c2VjcmV0')")
+    con.commit()
+    con.close()
+
+def _names(path, kind):
+    con = sqlite3.connect(path)
+    try:
+        return {r[0] for r in con.execute('SELECT name FROM sqlite_master WHERE type=?', (kind,))}
+    finally:
+        con.close()
+
+@pytest.mark.parametrize('version', range(LATEST))
+def test_migrates_from_every_version(tmp_path, version):
+    path = str(tmp_path / 'a.db')
+    _db_at(path, version)
+    db = Database(path)
+    try:
+        assert db._db.execute('PRAGMA user_version').fetchone()[0] == LATEST
+        tables = _names(path, 'table')
+        assert {'accounts', 'confirmation_history', 'change_journal', 'settings', 'search_index_paused'} <= tables
+        assert {'idx_accounts_name', 'idx_accounts_name_nocase'} <= _names(path, 'index')
+        if version:
+            assert [a['account_name'] for a in db.list_accounts(0, 10)] == ['old']
+            if 'accounts_fts' in tables:
+                assert [a['account_name'] for a in db.search_accounts('ol')] == ['old']
+        new_id = db.add_account('fresh', 'pw', 'c2VjcmV0')
+        assert db.get_account_by_id(new_id)['account_name'] == 'fresh'
+        journal = db._db.execute('SELECT key FROM change_journal').fetchall()
+        assert (new_id,) in journal
+    finally:
+        db.close()
+
+def test_pre_migration_schema_gains_columns(tmp_path):
+    # the original table, before identity_secret and session_data
+    path = str(tmp_path / 'legacy.db')
+    con = sqlite3.connect(path)
+    con.execute('CREATE TABLE accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, account_name TEXT NOT NULL, '
+                'password TEXT, shared_secret TEXT, created_at INTEGER, mafile_path TEXT)')
+    con.execute("INSERT INTO accounts (account_name, password, shared_secret) VALUES ('legacy', 'pw', 's')")
+    con.commit()
+    con.close()
+    db = Database(path)
+    try:
+        cols = {r[1] for r in db._db.execute('PRAGMA table_info(accounts)')}
+        assert {'identity_secret', 'session_data'} <= cols
+        assert db.count_accounts() == 1
+    finally:
+        db.close()
+
+def test_migrations_run_once_per_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'a.db')
+    Database(path).close()
+    calls = []
+    monkeypatch.setattr(dbmod, 'MIGRATIONS', [(v, lambda cur, f=f: calls.append(f) or f(cur)) for v, f in MIGRATIONS])
+    Database(path).close()
+    assert calls == []
@@ -0,0 +1,120 @@
+import datetime
+
+import pytest
+
+from network import CircuitBreaker, CircuitOpenError, NetworkLayer, RateLimitTimeout
+
+class FakeClock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status_code = status
+        self.headers = {}
+        self.elapsed = datetime.timedelta(0)
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        out = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(out, Exception):
+            raise out
+        return FakeResponse(out)
+
+def test_breaker_opens_after_threshold_and_recovers():
+    clock = FakeClock()
+    b = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+    for _ in range(2):
+        assert b.allow()
+        b.failure()
+    assert b.state == 'closed'
+    b.failure()
+    assert b.state == 'open' and not b.allow()
+    clock.t = 10
+    assert b.state == 'half-open'
+    # exactly one trial call in half-open
+    assert b.allow()
+    assert not b.allow()
+    b.success()
+    assert b.state == 'closed' and b.failures == 0 and b.allow()
+
+def test_failed_trial_reopens():
+    clock = FakeClock()
+    b = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=clock)
+    b.failure()
+    clock.t = 5
+    assert b.allow()
+    b.failure()
+    assert b.state == 'open'
+    clock.t = 9
+    assert not b.allow()
+    clock.t = 10
+    assert b.allow()
+
+def test_release_frees_the_trial():
+    clock = FakeClock()
+    b = CircuitBreaker(failure_threshold=1, reset_timeout=1, clock=clock)
+    b.failure()
+    clock.t = 1
+    assert b.allow()
+    b.release()
+    assert b.state == 'half-open' and b.allow()
+
+def _layer(**kw):
+    return NetworkLayer(global_rate=1000, global_burst=1000, account_rate=1000, account_burst=1000,
+                        backoff_base=0, failure_threshold=5, **kw)
+
+def test_get_is_retried_and_counts_one_failure():
+    net = _layer(max_retries=2)
+    s = FakeSession(503)
+    resp = net.request(s, 'GET', 'http://x/a', endpoint='a')
+    assert resp.status_code == 503 and s.calls == 3
+    assert net.breaker('a').failures == 1
+
+def test_post_is_not_retried_unless_idempotent():
+    net = _layer(max_retries=2)
+    s = FakeSession(ConnectionError('reset'))
+    with pytest.raises(ConnectionError):
+        net.request(s, 'POST', 'http://x/b', endpoint='b')
+    assert s.calls == 1 and net.breaker('b').failures == 1
+    s = FakeSession(502, 200)
+    assert net.request(s, 'POST', 'http://x/c', endpoint='c', idempotent=True).status_code == 200
+    assert s.calls == 2 and net.breaker('c').failures == 0
+
+def test_open_breaker_rejects_without_sending():
+    net = _layer(max_retries=0)
+    s = FakeSession(500)
+    for _ in range(5):
+        net.request(s, 'GET', 'http://x/d', endpoint='d')
+    with pytest.raises(CircuitOpenError):
+        net.request(s, 'GET', 'http://x/d', endpoint='d')
+    assert s.calls == 5
+
+def test_rate_limit_timeout_does_not_strand_the_trial():
+    net = _layer(max_retries=0)
+    clock = FakeClock()
+    b = net._breakers['e'] = CircuitBreaker(1, 1, clock=clock)
+    b.failure()
+    clock.t = 1
+
+    calls = []
+
+    def refuse_retry(account_key):
+        # the first token is granted, the one for the retry is not
+        calls.append(account_key)
+        if len(calls) > 1:
+            raise RateLimitTimeout('global rate limit')
+    net._acquire = refuse_retry
+    net.max_retries = 1
+    with pytest.raises(RateLimitTimeout):
+        net.request(FakeSession(503), 'GET', 'http://x/e', endpoint='e')
+    assert len(calls) == 2
+    assert b.allow()
@@ -0,0 +1,64 @@
+import pytest
+
+from db import Database
+
+@pytest.fixture
+def db(tmp_path):
+    d = Database(str(tmp_path / 'a.db'))
+    d.add_accounts_bulk([{'account_name': f'user{i:02d}', 'password': 'pw'} for i in range(10)])
+    yield d
+    d.close()
+
+def _walk_forward(db, count):
+    pages, start = [], 0
+    while True:
+        page = db.list_accounts(start, count)
+        if not page:
+            return pages
+        pages.append([a['id'] for a in page])
+        start = page[-1]['id'] + 1
+
+def test_forward_pages_cover_every_row_once(db):
+    pages = _walk_forward(db, 4)
+    assert [len(p) for p in pages] == [4, 4, 2]
+    assert sum(pages, []) == list(range(1, 11))
+
+def test_backward_page_is_ascending_and_stops_at_start(db):
+    assert [a['id'] for a in db.list_accounts_before(9, 4)] == [5, 6, 7, 8]
+    assert [a['id'] for a in db.list_accounts_before(3, 4)] == [1, 2]
+    assert db.list_accounts_before(1, 4) == []
+
+def test_pages_skip_gaps_left_by_deletes(db):
+    db.delete_account(3)
+    db.delete_account(4)
+    assert [a['id'] for a in db.list_accounts(2, 3)] == [2, 5, 6]
+    assert [a['id'] for a in db.list_accounts_before(5, 3)] == [1, 2]
+
+def test_count_is_cached_and_kept_current(db):
+    assert db.count_accounts() == 10
+    db.add_account('extra', 'pw', 's')
+    db.delete_account(1)
+    assert db.count_accounts() == 10
+    # a write from another connection is only seen on refresh
+    db._db.execute('DELETE FROM accounts WHERE id = 2')
+    db._db.commit()
+    assert db.count_accounts() == 10
+    assert db.count_accounts(refresh=True) == 9
+
+def _plans(db, page):
+    """EXPLAIN QUERY PLAN for each statement page() sends."""
+    sent = []
+    db._db.set_trace_callback(sent.append)
+    try:
+        page()
+    finally:
+        db._db.set_trace_callback(None)
+    selects = [s for s in sent if s.lstrip().upper().startswith('SELECT')]
+    assert selects
+    return [db._db.execute('EXPLAIN QUERY PLAN ' + s).fetchall() for s in selects]
+
+@pytest.mark.parametrize('page', [lambda db: db.list_accounts(3, 4), lambda db: db.list_accounts_before(9, 4)])
+def test_page_queries_use_the_primary_key(db, page):
+    for plan in _plans(db, lambda: page(db)):
+        details = ' '.join(row[-1] for row in plan)
+        assert 'INTEGER PRIMARY KEY' in details and 'TEMP B-TREE' not in details
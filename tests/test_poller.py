@@ -0,0 +1,95 @@
+import os
+import threading
+
+import pytest
+
+from bench import stub_steam_server
+from mafile_store import MaFileStore
+from poller import FleetPoller
+
+@pytest.fixture
+def stub():
+    srv, base_url = stub_steam_server()
+    yield srv, base_url
+    srv.shutdown()
+    srv.server_close()
+
+def _accounts(tmp_path, store, n):
+    accounts = []
+    for i in range(1, n + 1):
+        path = str(tmp_path / f'acc{i}.maFile')
+        store.save(path, {
+            'account_name': f'acc{i}', 'identity_secret': 'aWRlbnRpdHlzZWNyZXQ=', 'serial_number': str(i),
+            'steamid': str(76561197960265728 + i),
+            'session_cookies': {'steamLoginSecure': f'token{i}', 'sessionid': f'sid{i}'},
+        }, defer=False)
+        accounts.append({'id': i, 'account_name': f'acc{i}', 'mafile_path': path})
+    return accounts
+
+def _poller(base_url, store, **kw):
+    poller = FleetPoller(base_url=base_url, store=store, **kw)
+    sent = []
+    request = poller.session.request
+
+    def counting(*args, **kwargs):
+        sent.append(threading.get_ident())
+        return request(*args, **kwargs)
+    poller.session.request = counting
+    return poller, sent
+
+def test_results_per_account_through_one_session(tmp_path, stub):
+    srv, base_url = stub
+    store = MaFileStore()
+    accounts = _accounts(tmp_path, store, 12)
+    poller, sent = _poller(base_url, store, max_workers=4)
+    try:
+        results = poller.poll(accounts)
+        assert sorted(results) == list(range(1, 13))
+        for acc_id, confs in results.items():
+            assert [c['id'] for c in confs] == ['0', '1', '2']
+            assert confs[0]['creator_id'] == str(76561197960265728 + acc_id)
+        # every request went through the poller's one session, which keeps no cookies
+        assert len(sent) == 12 and poller.wrapper.session is poller.session
+        assert len(poller.session.cookies) == 0
+    finally:
+        poller.shutdown()
+
+def test_pool_bounds_concurrency(tmp_path, stub):
+    srv, base_url = stub
+    srv.delay = 0.05
+    store = MaFileStore()
+    accounts = _accounts(tmp_path, store, 16)
+    poller, sent = _poller(base_url, store, max_workers=3)
+    try:
+        poller.poll(accounts)
+        assert srv.max_inflight == 3
+        assert len(set(sent)) <= 3
+    finally:
+        poller.shutdown()
+
+def test_poll_async_reports_errors_per_account(tmp_path, stub):
+    srv, base_url = stub
+    store = MaFileStore()
+    accounts = _accounts(tmp_path, store, 3)
+    broken = str(tmp_path / 'broken.maFile')
+    with open(broken, 'w') as f:
+        f.write('{not json')
+    accounts.append({'id': 99, 'account_name': 'broken', 'mafile_path': broken})
+    poller, _ = _poller(base_url, store, max_workers=2)
+    got, done = {}, threading.Event()
+    final = {}
+
+    def on_result(account, confs, error):
+        got[account['id']] = (len(confs), error)
+
+    def on_done(results):
+        final.update(results)
+        done.set()
+    try:
+        poller.poll_async(accounts, on_result, on_done)
+        assert done.wait(10)
+        assert [got[i] for i in (1, 2, 3)] == [(3, None)] * 3
+        assert got[99][0] == 0 and isinstance(got[99][1], ValueError)
+        assert sorted(final) == [1, 2, 3, 99] and final[99] == []
+    finally:
+        poller.shutdown()
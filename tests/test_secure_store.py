@@ -0,0 +1,110 @@
+import json
+import sqlite3
+
+import pytest
+
+from db import Database
+from mafile_store import MaFileStore
+from secure_store import (BadPassphrase, KeyRing, Locked, SECRET_FIELDS, decrypt_all, encrypt_all,
+                          is_sealed)
+
+# cheap KDF settings; the format is the same as with the defaults
+FAST = {'n': 1 << 10}
+
+class FakeClock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+def _ring(**kw):
+    ring = KeyRing(idle_timeout=0, **kw)
+    ring.setup('pass', **FAST)
+    return ring
+
+def test_seal_and_open_round_trip():
+    ring = _ring()
+    sealed = ring.seal('password', 'hunter2')
+    assert is_sealed(sealed) and 'hunter2' not in sealed
+    assert ring.open('password', sealed) == 'hunter2'
+    # a fresh nonce each time
+    assert ring.seal('password', 'hunter2') != sealed
+    assert ring.seal('password', sealed) == sealed
+    assert ring.open('password', 'plain') == 'plain'
+
+def test_field_is_bound_and_tampering_detected():
+    ring = _ring()
+    sealed = ring.seal('password', 'hunter2')
+    with pytest.raises(ValueError):
+        ring.open('shared_secret', sealed)
+    raw = sealed[:-6] + ('A' if sealed[-6] != 'A' else 'B') + sealed[-5:]
+    with pytest.raises(ValueError):
+        ring.open('password', raw)
+
+def test_lock_and_unlock():
+    ring = _ring()
+    sealed = ring.seal('shared_secret', 'abc')
+    ring.lock()
+    assert not ring.unlocked
+    with pytest.raises(Locked):
+        ring.open('shared_secret', sealed)
+    with pytest.raises(BadPassphrase):
+        ring.unlock('wrong')
+    ring.unlock('pass')
+    assert ring.open('shared_secret', sealed) == 'abc'
+
+def test_idle_timeout_locks_and_notifies():
+    clock = FakeClock()
+    ring = KeyRing(idle_timeout=10, clock=clock)
+    ring.setup('pass', **FAST)
+    events = []
+
+    class Listener:
+        def dropped(self):
+            events.append('locked')
+    listener = Listener()
+    ring.on_lock(listener.dropped)
+    built = ring.derived('shared_secret', ring.seal('shared_secret', 'abc'), str.upper)
+    assert built == 'ABC'
+    clock.t = 9
+    assert ring.unlocked
+    clock.t = 19.5
+    assert not ring.unlocked and events == ['locked']
+    ring.lock()
+    assert events == ['locked']
+
+def test_encrypt_and_decrypt_all(tmp_path):
+    db = Database(str(tmp_path / 'a.db'))
+    store = MaFileStore()
+    path = str(tmp_path / 'a.maFile')
+    with open(path, 'w') as f:
+        json.dump({'account_name': 'a', 'shared_secret': 'c2VjcmV0', 'identity_secret': 'aWQ='}, f)
+    acc_id = db.add_account('a', 'pw', 'c2VjcmV0', 'aWQ=')
+    db.set_mafile_path(acc_id, path)
+    loaded = store.load(path)
+
+    assert encrypt_all(db, 'pass', store=store) == 1
+    # readers holding the cached dict never see it change underneath them
+    assert loaded['shared_secret'] == 'c2VjcmV0'
+    row = sqlite3.connect(db.path).execute('SELECT password, shared_secret, identity_secret FROM accounts').fetchone()
+    assert all(is_sealed(v) for v in row)
+    with open(path) as f:
+        on_disk = json.load(f)
+    assert is_sealed(on_disk['shared_secret']) and is_sealed(on_disk['identity_secret'])
+    ring = db.keyring
+    assert [ring.open(f, v) for f, v in zip(SECRET_FIELDS, row)] == ['pw', 'c2VjcmV0', 'aWQ=']
+    # new rows are sealed on the way in while unlocked, and refused while locked
+    assert is_sealed(db.get_account_by_id(db.add_account('b', 'pw2', 's'))['password'])
+    ring.lock()
+    with pytest.raises(Locked):
+        db.add_account('c', 'pw3', 's')
+
+    with pytest.raises(BadPassphrase):
+        decrypt_all(db, 'wrong', store=store)
+    assert decrypt_all(db, 'pass', store=store) == 2
+    assert not ring.enabled
+    assert db.get_account_by_id(acc_id)['password'] == 'pw'
+    with open(path) as f:
+        assert json.load(f)['shared_secret'] == 'c2VjcmV0'
+    db.close()
@@ -0,0 +1,131 @@
+from mafile_store import MaFileStore
+from network import NetworkLayer
+from steam_time import LocalTime, SteamTime
+from steam_wrapper import SteamWrapper
+
+class FakeClock:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+def test_sync_measures_the_offset():
+    clock = FakeClock()
+    st = SteamTime(fetch=lambda: 1042, clock=clock)
+    assert st.sync() == 42
+    assert st.now() == 1042
+
+def test_failed_sync_backs_off_exponentially():
+    clock = FakeClock()
+    calls = []
+
+    def down():
+        calls.append(clock.t)
+        raise OSError('down')
+    st = SteamTime(fetch=down, clock=clock, retry_base=5, retry_max=20)
+    # offset() would start a background thread; drive sync() directly
+    st._refresh_async = st.sync
+    for _ in range(100):
+        assert st.offset() == 0
+    assert calls == [1000.0]
+    clock.t += 5
+    st.offset()
+    clock.t += 5
+    st.offset()
+    assert len(calls) == 2
+    clock.t += 5
+    st.offset()
+    assert len(calls) == 3
+    # capped at retry_max
+    clock.t += 20
+    st.offset()
+    clock.t += 20
+    st.offset()
+    assert len(calls) == 5
+
+def test_success_resets_the_backoff():
+    clock = FakeClock()
+    results = [OSError('down'), 1010]
+
+    def fetch():
+        r = results.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+    st = SteamTime(fetch=fetch, clock=clock, retry_base=5)
+    st.sync()
+    assert st._retry_at == 1005
+    clock.t = 1005
+    assert st.sync() == 5
+    assert st._failures == 0 and st._retry_at == 0
+
+def test_local_time_can_stand_in_for_the_default():
+    lt = LocalTime(offset=3, clock=lambda: 100)
+    lt.start()
+    lt.invalidate()
+    lt.stop()
+    assert lt.now() == 103
+
+def test_invalidate_wait_refetches_unless_backing_off():
+    clock = FakeClock()
+    server = [1000]
+    st = SteamTime(fetch=lambda: server[0], clock=clock, retry_base=5)
+    st.sync()
+    assert st.invalidate(wait=True) is False
+    server[0] = 1030
+    assert st.invalidate(wait=True) is True and st.offset() == 30
+    st._retry_at = clock.t + 5
+    server[0] = 1090
+    assert st.invalidate(wait=True) is False and st._offset == 30
+
+class SteamClockSession:
+    """Accepts a mobileconf key only when it is signed with Steam's time."""
+
+    def __init__(self, steam_now):
+        self.steam_now = steam_now
+        self.sent = []
+
+    def request(self, method, url, **kwargs):
+        fields = dict(kwargs.get('params') or kwargs.get('data') or {})
+        self.sent.append(int(fields['t']))
+        ok = int(fields['t']) == self.steam_now
+        body = {'success': ok, 'conf': [{'id': '1'}]} if ok and 'conf' in url else {'success': ok}
+
+        class Resp:
+            status_code = 200
+
+            def json(self):
+                return body
+        return Resp()
+
+def _drifted_wrapper(tmp_path, clock):
+    server = [int(clock()) + 60]
+    ts = SteamTime(fetch=lambda: server[0], clock=clock)
+    ts.sync()
+    server[0] += 30
+    store = MaFileStore(flush_delay=0)
+    path = str(tmp_path / 'a.maFile')
+    store.save(path, {'identity_secret': 'aWRlbnRpdHk=', 'steamid': '7656', 'serial_number': '1',
+                      'session_cookies': {'steamLoginSecure': 'x', 'sessionid': 'y'}})
+    network = NetworkLayer(global_rate=1e6, global_burst=1e6, account_rate=1e6, account_burst=1e6, backoff_base=0)
+    steam = SteamWrapper(store=store, time_source=ts, network=network)
+    steam.session = SteamClockSession(int(clock()) + 90)
+    return steam, {'id': 1, 'mafile_path': path}
+
+def test_rejected_signature_resyncs_and_retries_once(tmp_path):
+    clock = FakeClock()
+    steam, acc = _drifted_wrapper(tmp_path, clock)
+    assert steam.fetch_confirmations(acc) == [{'id': '1'}]
+    assert steam.session.sent == [1060, 1090]
+    assert steam.respond_confirmations(acc, [0], True, confirmations=[{'id': '1', 'nonce': '2'}])
+    assert steam.session.sent[2:] == [1090]
+
+def test_rejection_with_a_good_clock_is_not_retried(tmp_path):
+    clock = FakeClock()
+    steam, acc = _drifted_wrapper(tmp_path, clock)
+    steam.session.steam_now = 1
+    assert not steam.respond_confirmation(acc, 0, True)
+    # the resync moved the clock, so one retry, then the clock holds still
+    assert not steam.respond_confirmation(acc, 0, True)
+    assert steam.session.sent == [1060, 1090, 1090]
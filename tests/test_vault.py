@@ -0,0 +1,113 @@
+import json
+import multiprocessing
+
+import pytest
+
+import vault
+from vault import Vault
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'a.vault')
+
+def _rec(i, **extra):
+    return {'account_name': f'user{i}', 'shared_secret': 's' * 28, **extra}
+
+def test_put_get_and_reopen(path):
+    v = Vault(path)
+    v.put_many([(i, _rec(i), None) for i in range(100)])
+    v.put(5, _rec(5, changed=True))
+    assert v.delete(7) and not v.delete(7)
+    v.close()
+    v = Vault(path)
+    assert len(v) == 99 and '7' not in v
+    assert v.get(5) == _rec(5, changed=True)
+    assert v.get(6) == _rec(6)
+    assert v.names()['5'] == 'user5'
+    v.close()
+
+def test_put_appends_only_the_batch(path):
+    v = Vault(path, min_compact_size=1 << 40)
+    v.put_many([(i, _rec(i), None) for i in range(1000)])
+    before = v._end
+    v.put(1, _rec(1, v=2))
+    grown = v._end - before
+    # the record and a one-entry delta, not another copy of the index
+    assert grown < len(json.dumps(_rec(1, v=2))) + 200
+    v.close()
+
+def test_compact_reclaims_space_and_keeps_data(path):
+    v = Vault(path, min_compact_size=1 << 40)
+    for n in range(20):
+        v.put_many([(i, _rec(i, n=n), None) for i in range(50)])
+    size = v._end
+    v.compact()
+    assert v._end < size / 10 and v._dead == 0
+    assert v.get(3) == _rec(3, n=19)
+    v.close()
+    assert Vault(path).get(49) == _rec(49, n=19)
+
+def test_compacts_automatically(path):
+    v = Vault(path, min_compact_size=1 << 12)
+    for n in range(200):
+        v.put(1, _rec(1, n=n))
+    assert v._end < 1 << 13
+    assert v.get(1)['n'] == 199
+    v.close()
+
+def test_torn_tail_is_ignored_and_overwritten(path):
+    v = Vault(path)
+    v.put(1, _rec(1))
+    v.close()
+    with open(path, 'ab') as f:
+        f.write(vault.BATCH.pack(vault.BATCH_MAGIC, 100, 10, 0) + b'partial')
+    v = Vault(path)
+    assert v.keys() == ['1']
+    v.put(2, _rec(2))
+    v.close()
+    v = Vault(path)
+    assert v.get(2) == _rec(2) and len(v) == 2
+    v.close()
+
+def test_v1_file_opens_and_is_upgraded(path):
+    rec = json.dumps(_rec(1)).encode()
+    index = json.dumps({'1': [vault.HEADER.size, len(rec), 'user1']}).encode()
+    with open(path, 'wb') as f:
+        f.write(vault.HEADER.pack(vault.MAGIC_V1, vault.HEADER.size + len(rec), len(index)) + rec + index)
+    v = Vault(path)
+    assert v.get(1) == _rec(1)
+    v.put(2, _rec(2))
+    v.close()
+    with open(path, 'rb') as f:
+        assert f.read(8) == vault.MAGIC
+    assert Vault(path).get(2) == _rec(2)
+
+def test_second_instance_sees_writes_and_compaction(path):
+    a, b = Vault(path), Vault(path)
+    a.put(1, _rec(1))
+    assert b.locate(1) and b.get(1) == _rec(1)
+    a.compact()
+    b.put(2, _rec(2))
+    assert a.locate(2) and a.get(2) == _rec(2) and a.get(1) == _rec(1)
+    a.close()
+    b.close()
+
+def _writer(path, base):
+    v = Vault(path, min_compact_size=1 << 12)
+    for n in range(100):
+        v.put(base + n % 10, {'account_name': 'x', 'n': n, 'pad': 'p' * 200})
+    v.close()
+
+@pytest.mark.skipif(vault.fcntl is None, reason='needs flock')
+def test_concurrent_writer_processes(path):
+    Vault(path).close()
+    procs = [multiprocessing.Process(target=_writer, args=(path, k * 100)) for k in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+    v = Vault(path)
+    assert len(v) == 30
+    assert {v.get(k)['n'] for k in v.keys()} == set(range(90, 100))
+    v.close()
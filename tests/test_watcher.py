@@ -0,0 +1,92 @@
+from watcher import ConfirmationWatcher, auto_accept, conf_key
+
+class FakeClock:
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+def _watcher():
+    clock = FakeClock()
+    w = ConfirmationWatcher(poller=None, min_interval=5, max_interval=40, backoff=2, clock=clock)
+    return w, clock
+
+ACC = {'id': 1}
+
+def _poll(w, confs, error=None):
+    due, _ = w._due()
+    assert due == [ACC]
+    w._on_result(ACC, confs, error)
+
+def test_quiet_polls_back_off_and_activity_resets():
+    w, clock = _watcher()
+    w.watch(ACC)
+    confs = [{'id': '1'}]
+    _poll(w, confs)
+    intervals = []
+    for _ in range(4):
+        clock.t = w._watches[1].due
+        _poll(w, confs)
+        intervals.append(w._watches[1].interval)
+    assert intervals == [10, 20, 40, 40]
+    # not due before its interval is up
+    clock.t += 39
+    assert w._due()[0] == []
+    w.note_activity(ACC)
+    assert w._watches[1].interval == 5
+    _poll(w, confs + [{'id': '2'}])
+    assert w._watches[1].interval == 5
+
+def test_errors_keep_the_interval_and_the_snapshot():
+    w, clock = _watcher()
+    w.watch(ACC)
+    _poll(w, [{'id': '1'}])
+    clock.t = w._watches[1].due
+    _poll(w, [], error=OSError('down'))
+    assert w.snapshot(ACC) == [{'id': '1'}] and w._watches[1].interval == 5
+    assert w._watches[1].due == clock.t + 5
+
+def test_changes_are_diffed_by_conf_key():
+    w, clock = _watcher()
+    events = []
+    w.subscribe(lambda acc, added, removed, current: events.append((added, removed, len(current))))
+    w.watch(ACC)
+    _poll(w, [{'id': 'a'}, {'id': 'b'}])
+    clock.t = w._watches[1].due
+    # same ids, different objects: nothing published
+    _poll(w, [{'id': 'a'}, {'id': 'b'}])
+    clock.t = w._watches[1].due
+    _poll(w, [{'id': 'b'}, {'id': 'c'}])
+    assert events == [([{'id': 'a'}, {'id': 'b'}], [], 2), ([{'id': 'c'}], ['a'], 2)]
+    # without ids, the position is the key
+    assert [conf_key(c, i) for i, c in enumerate([{'id': 'x'}, {}, 'raw'])] == ['x', 1, 2]
+
+def test_unwatched_accounts_are_not_polled_or_published():
+    w, _ = _watcher()
+    events = []
+    w.subscribe(lambda *a: events.append(a))
+    w.watch(ACC)
+    w.unwatch(ACC)
+    assert w._due()[0] == []
+    w._on_result(ACC, [{'id': '1'}], None)
+    assert events == [] and w.snapshot(ACC) is None
+
+class RecordingSteam:
+    def __init__(self):
+        self.calls = []
+
+    def respond_confirmations(self, account, indices, accept=True, confirmations=None):
+        self.calls.append((account['id'], indices, accept, [c['id'] for c in confirmations]))
+        return True
+
+def test_auto_accept_answers_new_matches_in_one_batch():
+    w, clock = _watcher()
+    steam = RecordingSteam()
+    w.subscribe(auto_accept(steam, lambda c: c.get('type') == 2))
+    w.watch(ACC)
+    _poll(w, [{'id': '1', 'type': 2}, {'id': '2', 'type': 3}])
+    clock.t = w._watches[1].due
+    _poll(w, [{'id': '1', 'type': 2}, {'id': '2', 'type': 3}, {'id': '3', 'type': 2}, {'id': '4', 'type': 2}])
+    # only what is new each time, by its position in the current list
+    assert steam.calls == [(1, [0], True, ['1', '2']), (1, [2, 3], True, ['1', '2', '3', '4'])]
@@ -0,0 +1,363 @@
+"""Packed maFile vault: many accounts in one indexed file.
+
+Layout:
+    header  MAGIC (8 bytes) | base index offset (u64) | base index length (u64)
+    records compact JSON maFiles, back to back
+    index   JSON {key: [offset, length, name]}, the base index
+    batches BATCH_MAGIC | records length (u64) | delta length (u32) | crc32 (u32),
+            then the batch's records and a JSON delta {key: [offset, length, name] or null}
+
+Records are read through mmap. put_many() appends its records and the
+index changes as one checksummed batch with a single fsync, so a write
+costs the size of the batch, not of the whole index; a torn batch at the
+tail fails its checksum and is ignored on open. Existing data is never
+overwritten: superseded records and the batch deltas are reclaimed by
+compact(), which folds everything into a new base index and runs
+automatically once dead bytes exceed compact_ratio of the file.
+
+Writers and compaction hold an exclusive flock on VAULT.lock (where fcntl
+exists), so the app, the daemon and the importer can share one vault;
+each catches up on batches and compactions from other processes first.
+
+CLI:
+    python vault.py pack MAFILES_DIR VAULT
+    python vault.py unpack VAULT MAFILES_DIR
+    python vault.py compact VAULT
+    python vault.py migrate VAULT [DB]
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import zlib
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+from mafile_store import VAULT_PREFIX
+
+MAGIC = b'MAVAULT2'
+# same header, but every put rewrote the whole index; opened read-compatible
+MAGIC_V1 = b'MAVAULT1'
+HEADER = struct.Struct('>8sQQ')
+BATCH_MAGIC = b'VBAT'
+BATCH = struct.Struct('>4sQII')
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class Vault:
+    def __init__(self, path, compact_ratio=0.5, min_compact_size=1 << 16):
+        self.path = os.path.abspath(path)
+        self.compact_ratio = compact_ratio
+        self.min_compact_size = min_compact_size
+        self._lock = threading.RLock()
+        self._f = None
+        self._mm = None
+        self._lockf = None
+        self._writing_depth = 0
+        with self._writing():
+            if not os.path.exists(self.path):
+                self._create()
+            self._open()
+
+    def _create(self):
+        index = _dumps({})
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, HEADER.size, len(index)))
+            f.write(index)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _open(self):
+        self._f = open(self.path, 'r+b')
+        magic, index_off, index_len = HEADER.unpack(self._f.read(HEADER.size))
+        if magic not in (MAGIC, MAGIC_V1):
+            self._f.close()
+            raise ValueError(f'{self.path} is not a maFile vault')
+        self._magic = magic
+        self._remap()
+        self._index = json.loads(self._mm[index_off:index_off + index_len])
+        self._end = index_off + index_len
+        live = sum(v[1] for v in self._index.values())
+        self._dead = self._end - HEADER.size - live - index_len
+        self._scan()
+
+    def _scan(self):
+        """Apply the complete batches after _end; stops at a torn or foreign tail."""
+        mm, pos = self._mm, self._end
+        while pos + BATCH.size <= len(mm):
+            magic, rec_len, delta_len, crc = BATCH.unpack(mm[pos:pos + BATCH.size])
+            body = pos + BATCH.size
+            stop = body + rec_len + delta_len
+            if magic != BATCH_MAGIC or stop > len(mm) or zlib.crc32(mm[body:stop]) != crc:
+                break
+            self._apply(json.loads(mm[body + rec_len:stop]), BATCH.size + delta_len)
+            pos = stop
+        self._end = pos
+
+    def _apply(self, delta, overhead):
+        self._dead += overhead
+        for key, entry in delta.items():
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._dead += old[1]
+            if entry is not None:
+                self._index[key] = entry
+
+    def _remap(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def refresh(self):
+        """Pick up batches and compactions written by other processes."""
+        with self._lock:
+            st = os.stat(self.path)
+            if st.st_ino != os.fstat(self._f.fileno()).st_ino:
+                # compacted elsewhere: the old file is gone from the path
+                self._close_file()
+                self._open()
+            elif st.st_size > len(self._mm):
+                self._remap()
+                self._scan()
+
+    @contextmanager
+    def _writing(self):
+        """Thread lock plus, outermost only, the exclusive cross-process flock."""
+        with self._lock:
+            if self._writing_depth == 0 and fcntl is not None:
+                if self._lockf is None:
+                    self._lockf = open(self.path + '.lock', 'a+b')
+                fcntl.flock(self._lockf.fileno(), fcntl.LOCK_EX)
+            self._writing_depth += 1
+            try:
+                yield
+            finally:
+                self._writing_depth -= 1
+                if self._writing_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lockf.fileno(), fcntl.LOCK_UN)
+
+    def _close_file(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def close(self):
+        with self._lock:
+            self._close_file()
+            if self._lockf is not None:
+                self._lockf.close()
+                self._lockf = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return str(key) in self._index
+
+    def keys(self):
+        return list(self._index)
+
+    def names(self):
+        """{key: account name} straight from the index, no record reads."""
+        return {k: v[2] for k, v in self._index.items()}
+
+    def locate(self, key):
+        """(offset, length) of key's current record; raises KeyError."""
+        self.refresh()
+        off, length, _ = self._index[str(key)]
+        return off, length
+
+    def get_raw(self, key):
+        with self._lock:
+            off, length, _ = self._index[str(key)]
+            return self._mm[off:off + length]
+
+    def get(self, key):
+        return json.loads(self.get_raw(key))
+
+    def items(self):
+        """Yield (key, data) for every record in file order (one mmap, no opens)."""
+        with self._lock:
+            entries = sorted(self._index.items(), key=lambda kv: kv[1][0])
+            for k, (off, length, _) in entries:
+                yield k, json.loads(self._mm[off:off + length])
+
+    def put(self, key, data, name=None):
+        self.put_many([(key, data, name)])
+
+    def put_many(self, items):
+        """Append records [(key, data, name)] as one batch."""
+        with self._writing():
+            self.refresh()
+            pos = self._end + BATCH.size
+            payloads = []
+            delta = {}
+            for key, data, name in items:
+                key = str(key)
+                payload = _dumps(data)
+                payloads.append(payload)
+                if name is None:
+                    old = delta.get(key) or self._index.get(key)
+                    name = old[2] if old is not None else (data.get('account_name') if isinstance(data, dict) else None)
+                if key in delta:
+                    # rewritten within the batch: the earlier copy is dead at once
+                    self._dead += delta[key][1]
+                delta[key] = [pos, len(payload), name]
+                pos += len(payload)
+            self._append_batch(b''.join(payloads), delta)
+
+    def delete(self, key):
+        with self._writing():
+            self.refresh()
+            key = str(key)
+            if key not in self._index:
+                return False
+            self._append_batch(b'', {key: None})
+            return True
+
+    def _append_batch(self, records, delta):
+        delta_bytes = _dumps(delta)
+        body = records + delta_bytes
+        f = self._f
+        if os.fstat(f.fileno()).st_size > self._end:
+            # a torn batch from a crashed writer
+            f.truncate(self._end)
+        if self._magic != MAGIC:
+            # batches would be invisible to a v1 reader
+            f.seek(0)
+            f.write(MAGIC)
+            self._magic = MAGIC
+        f.seek(self._end)
+        f.write(BATCH.pack(BATCH_MAGIC, len(records), len(delta_bytes), zlib.crc32(body)))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+        self._end += BATCH.size + len(body)
+        self._apply(delta, BATCH.size + len(delta_bytes))
+        self._remap()
+        if self._end >= self.min_compact_size and self._dead > self._end * self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """Rewrite live records and one base index into a fresh file and swap it in atomically."""
+        with self._writing():
+            self.refresh()
+            tmp = self.path + '.compact'
+            index = {}
+            with open(tmp, 'wb') as out:
+                out.write(b'\0' * HEADER.size)
+                pos = HEADER.size
+                for k, (off, length, name) in sorted(self._index.items(), key=lambda kv: kv[1][0]):
+                    out.write(self._mm[off:off + length])
+                    index[k] = [pos, length, name]
+                    pos += length
+                payload = _dumps(index)
+                out.write(payload)
+                out.seek(0)
+                out.write(HEADER.pack(MAGIC, pos, len(payload)))
+                out.flush()
+                os.fsync(out.fileno())
+            self._close_file()
+            os.replace(tmp, self.path)
+            self._open()
+
+_vaults = {}
+_vaults_lock = threading.Lock()
+
+def open_vault(path):
+    """Shared Vault instance per file."""
+    key = os.path.abspath(path)
+    with _vaults_lock:
+        v = _vaults.get(key)
+        if v is None:
+            v = _vaults[key] = Vault(key)
+        return v
+
+def vault_path(vault_file, key):
+    """maFile path addressing one record, usable wherever a maFile path is."""
+    return f'{VAULT_PREFIX}{os.path.abspath(vault_file)}#{key}'
+
+def split_vault_path(path):
+    vault_file, _, key = path[len(VAULT_PREFIX):].rpartition('#')
+    return vault_file, key
+
+_MAFILE_RE = re.compile(r'^(?P<name>.+)_(?P<id>\d+)\.maFile$', re.IGNORECASE)
+
+def pack_mafiles(directory, vault_file):
+    """Pack every .maFile in directory into vault_file. Files named
+    {name}_{id}.maFile are keyed by id, others by file name. Returns the
+    {key: vault path} mapping."""
+    vault = open_vault(vault_file)
+    items = []
+    for fn in sorted(os.listdir(directory)):
+        if not fn.lower().endswith('.mafile'):
+            continue
+        with open(os.path.join(directory, fn), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        m = _MAFILE_RE.match(fn)
+        key = m.group('id') if m else fn[:-len('.maFile')]
+        name = data.get('account_name') if isinstance(data, dict) else None
+        items.append((key, data, name or (m.group('name') if m else key)))
+    vault.put_many(items)
+    return {k: vault_path(vault_file, k) for k, _, _ in items}
+
+def unpack_vault(vault_file, directory):
+    """Write each vault record back out as {name}_{key}.maFile. Returns the count."""
+    vault = open_vault(vault_file)
+    os.makedirs(directory, exist_ok=True)
+    names = vault.names()
+    n = 0
+    for key, data in vault.items():
+        name = names.get(key)
+        fn = f'{name}_{key}.maFile' if name and key.isdigit() else f'{key}.maFile'
+        with open(os.path.join(directory, fn), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        n += 1
+    return n
+
+def migrate_accounts(db, vault_file):
+    """Pack every account's maFile into vault_file (keyed by account id) and
+    repoint accounts.mafile_path at the vault records. Returns the count."""
+    vault = open_vault(vault_file)
+    items = []
+    paths = []
+    for acc_id, name, path in db.get_mafile_paths():
+        if not path or path.startswith(VAULT_PREFIX) or not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            items.append((acc_id, json.load(f), name))
+        paths.append((acc_id, vault_path(vault_file, acc_id)))
+    vault.put_many(items)
+    db.set_mafile_paths(paths)
+    return len(paths)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 3 and argv[0] == 'pack':
+        print(f'packed {len(pack_mafiles(argv[1], argv[2]))} maFiles')
+    elif len(argv) == 3 and argv[0] == 'unpack':
+        print(f'unpacked {unpack_vault(argv[1], argv[2])} maFiles')
+    elif len(argv) == 2 and argv[0] == 'compact':
+        open_vault(argv[1]).compact()
+    elif len(argv) in (2, 3) and argv[0] == 'migrate':
+        from db import get_database
+        db = get_database(*argv[2:])
+        print(f'migrated {migrate_accounts(db, argv[1])} accounts')
+    else:
+        print(__doc__.split('CLI:')[1])
+        return 2
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,179 @@
+import time
+import threading
+
+def conf_key(conf, index):
+    """Stable identity of a confirmation: its id, else its position."""
+    return conf.get('id', index) if isinstance(conf, dict) else index
+
+class _Watch:
+    __slots__ = ('account', 'interval', 'due', 'inflight', 'confs', 'keys')
+
+    def __init__(self, account, interval, due):
+        self.account = account
+        self.interval = interval
+        self.due = due
+        self.inflight = False
+        self.confs = None
+        self.keys = ()
+
+class ConfirmationWatcher:
+    """Background confirmation polling with per-account adaptive intervals.
+
+    Watched accounts are polled through a FleetPoller. After a poll that
+    changed something (or after note_activity()) an account is polled again
+    in min_interval seconds; each quiet poll multiplies its interval by
+    backoff up to max_interval, so idle accounts cost almost nothing.
+
+    Each result is diffed by confirmation id against the previous one and
+    only changes are published: subscribers are called as
+    fn(account, added, removed, current) through dispatch, where added is a
+    list of confirmations, removed a list of keys and current the full list.
+    """
+
+    def __init__(self, poller, min_interval=5.0, max_interval=300.0, backoff=2.0, dispatch=None, clock=time.monotonic):
+        self.poller = poller
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.dispatch = dispatch or (lambda fn: fn())
+        self.clock = clock
+        self._watches = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _key(account):
+        return account.get('id') if account.get('id') is not None else account.get('account_name')
+
+    def subscribe(self, fn):
+        """Register fn(account, added, removed, current); returns an unsubscribe callable."""
+        with self._lock:
+            self._subscribers.append(fn)
+
+        def unsubscribe():
+            with self._lock:
+                if fn in self._subscribers:
+                    self._subscribers.remove(fn)
+        return unsubscribe
+
+    def watch(self, account):
+        key = self._key(account)
+        with self._lock:
+            w = self._watches.get(key)
+            if w is None:
+                self._watches[key] = _Watch(account, self.min_interval, self.clock())
+                self._wake.set()
+            else:
+                w.account = account
+
+    def watch_all(self, accounts):
+        for acc in accounts:
+            self.watch(acc)
+
+    def unwatch(self, account):
+        with self._lock:
+            self._watches.pop(self._key(account), None)
+
+    def snapshot(self, account):
+        """Last fetched confirmations for account, or None if not polled yet."""
+        with self._lock:
+            w = self._watches.get(self._key(account))
+            return None if w is None or w.confs is None else list(w.confs)
+
+    def note_activity(self, account):
+        """Poll account right away and switch it back to the fast interval."""
+        with self._lock:
+            w = self._watches.get(self._key(account))
+            if w is not None:
+                w.interval = self.min_interval
+                w.due = self.clock()
+        self._wake.set()
+
+    def _on_result(self, account, confs, error):
+        key = self._key(account)
+        with self._lock:
+            w = self._watches.get(key)
+            if w is None:
+                return
+            w.inflight = False
+            if error is not None:
+                w.due = self.clock() + w.interval
+                self._wake.set()
+                return
+            confs = list(confs or [])
+            keys = [conf_key(c, i) for i, c in enumerate(confs)]
+            old = set(w.keys)
+            new = set(keys)
+            added = [c for c, k in zip(confs, keys) if k not in old]
+            removed = [k for k in w.keys if k not in new]
+            first = w.confs is None
+            w.confs = confs
+            w.keys = keys
+            if added or removed:
+                w.interval = self.min_interval
+            else:
+                w.interval = min(self.max_interval, w.interval * self.backoff)
+            w.due = self.clock() + w.interval
+            subscribers = list(self._subscribers)
+        # the loop may be sleeping on a longer deadline
+        self._wake.set()
+        if (added or removed or first) and subscribers:
+            def publish():
+                for fn in subscribers:
+                    fn(account, added, removed, confs)
+            self.dispatch(publish)
+
+    def _due(self):
+        now = self.clock()
+        due = []
+        next_at = None
+        with self._lock:
+            for w in self._watches.values():
+                if w.inflight:
+                    continue
+                if w.due <= now:
+                    w.inflight = True
+                    due.append(w.account)
+                elif next_at is None or w.due < next_at:
+                    next_at = w.due
+        return due, (None if next_at is None else max(0.0, next_at - now))
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            due, wait = self._due()
+            if due:
+                self.poller.poll_async(due, on_result=self._on_result, dispatch=lambda fn: fn())
+            self._wake.wait(self.max_interval if wait is None else min(wait, self.max_interval))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='conf-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+def auto_accept(steam, predicate, accept=True):
+    """Subscriber that answers newly added confirmations matching predicate.
+
+    steam is a SteamWrapper; matches for one account are sent in one batch.
+    It does network I/O, so register it on a watcher whose dispatch is not
+    the UI thread.
+    """
+    def on_change(account, added, removed, current):
+        if not added:
+            return
+        # added holds the same objects as current
+        picked = {id(c) for c in added if predicate(c)}
+        indices = [i for i, c in enumerate(current) if id(c) in picked]
+        if indices:
+            steam.respond_confirmations(account, indices, accept, confirmations=current)
+    return on_change